@@ -0,0 +1,59 @@
+from django.db.backends.mysql import base
+
+from api.db.pool import ConnectionPool, PoolExhausted, get_pool
+
+Database = base.Database
+
+
+def connect(conn_params):
+    # As Django's MySQL backend opens its connections
+    connection = Database.connect(**conn_params)
+    connection.encoders.pop(bytes, None)
+    return connection
+
+
+def ping(connection):
+    try:
+        connection.ping()
+    except Database.Error:
+        return False
+    return True
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    Django's MySQL/MariaDB backend, checking its connections out of a per-worker ConnectionPool.
+
+    The pool is configured by the POOL dict of the database settings (SIZE, TIMEOUT, MAX_AGE,
+    HEALTH_CHECKS). Closing the connection, e.g. at the end of a request, returns it to the pool.
+    """
+
+    def get_new_connection(self, conn_params):
+        options = self.settings_dict.get("POOL", {})
+        pool = get_pool(self.alias, lambda: ConnectionPool(
+            connect=lambda: connect(conn_params),
+            is_usable=ping,
+            size=options.get("SIZE", 10),
+            timeout=options.get("TIMEOUT", 10),
+            max_age=options.get("MAX_AGE", 600),
+            health_checks=options.get("HEALTH_CHECKS", True),
+        ))
+        try:
+            return pool.acquire()
+        except PoolExhausted as e:
+            raise Database.OperationalError(str(e)) from e
+
+    def _close(self):
+        if self.connection is None:
+            return
+        pool = get_pool(self.alias, None)
+        if pool is None:
+            # Opened before this process forked, the pool belongs to the parent
+            return super()._close()
+        # Leave no transaction open for the next borrower
+        try:
+            self.connection.rollback()
+        except Database.Error:
+            pool.release(self.connection, broken=True)
+            return
+        pool.release(self.connection)
@@ -0,0 +1,150 @@
+import os
+import threading
+import time
+from collections import deque
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    A bounded set of open DB-API connections shared by the threads of one worker.
+
+    connect() opens a new connection and is_usable(connection) pings one. At most size
+    connections are open at once, acquire() waits up to timeout seconds for one to be
+    released before raising PoolExhausted. Connections older than max_age seconds are
+    closed instead of reused, and idle ones are pinged before reuse when health_checks is set.
+    """
+
+    def __init__(self, connect, is_usable, size, timeout, max_age, health_checks):
+        self.connect = connect
+        self.is_usable = is_usable
+        self.size = size
+        self.timeout = timeout
+        self.max_age = max_age
+        self.health_checks = health_checks
+        self.pid = os.getpid()
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._opened_at = {}
+        self._stats = {
+            "connects": 0,
+            "connect_seconds": 0.0,
+            "checkouts": 0,
+            "reused": 0,
+            "wait_seconds": 0.0,
+            "timeouts": 0,
+            "discarded": 0,
+        }
+
+    def acquire(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        while True:
+            with self._cond:
+                while not self._idle and len(self._opened_at) >= self.size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolExhausted(f"no database connection was free within {self.timeout}s")
+                    self._cond.wait(remaining)
+                connection = self._idle.pop() if self._idle else None
+                if connection is None:
+                    # Hold the slot while connecting outside the lock
+                    slot = object()
+                    self._opened_at[id(slot)] = time.monotonic()
+            waited = time.monotonic() - start
+
+            if connection is None:
+                return self._open(slot, waited)
+            if self._reusable(connection):
+                self._checked_out(waited, reused=True)
+                return connection
+            self._discard(connection)
+
+    def release(self, connection, broken=False):
+        if broken or self._expired(connection):
+            self._discard(connection)
+            return
+        with self._cond:
+            self._idle.append(connection)
+            self._cond.notify()
+
+    def close_idle(self):
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+        for connection in idle:
+            self._discard(connection)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats, open=len(self._opened_at), idle=len(self._idle), size=self.size)
+        stats["reuse_ratio"] = stats["reused"] / stats["checkouts"] if stats["checkouts"] else 0.0
+        return stats
+
+    def _open(self, slot, waited):
+        start = time.monotonic()
+        try:
+            connection = self.connect()
+        except BaseException:
+            with self._cond:
+                del self._opened_at[id(slot)]
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._opened_at[id(connection)] = self._opened_at.pop(id(slot))
+            self._stats["connects"] += 1
+            self._stats["connect_seconds"] += time.monotonic() - start
+        self._checked_out(waited, reused=False)
+        return connection
+
+    def _checked_out(self, waited, reused):
+        with self._cond:
+            self._stats["checkouts"] += 1
+            self._stats["reused"] += reused
+            self._stats["wait_seconds"] += waited
+
+    def _expired(self, connection):
+        with self._cond:
+            opened_at = self._opened_at.get(id(connection))
+        return opened_at is None or time.monotonic() - opened_at >= self.max_age
+
+    def _reusable(self, connection):
+        if self._expired(connection):
+            return False
+        return not self.health_checks or self.is_usable(connection)
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._opened_at.pop(id(connection), None)
+            self._stats["discarded"] += 1
+            self._cond.notify()
+
+
+_pools_lock = threading.Lock()
+_pools = {}
+
+
+def get_pool(alias, create):
+    """The worker's pool for a database alias, created by create() on first use or after a fork."""
+    with _pools_lock:
+        pool = _pools.get(alias)
+        if pool is None or pool.pid != os.getpid():
+            if create is None:
+                return None
+            pool = _pools[alias] = create()
+        return pool
+
+
+def pool_stats():
+    with _pools_lock:
+        pools = dict(_pools)
+    return {alias: pool.stats() for alias, pool in pools.items() if pool.pid == os.getpid()}
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from api.models import MEDICATION_CLASS, RefreshWatermark, VISIT_MEDICATION
+from api.views.sql_queries import (
+    unclassified_medication_count_query,
+    unclassified_medication_query,
+    visit_medication_insert_query,
+)
+from api.views.utils.medication_classes import classify_medication, load_medication_rules
+
+
+WATERMARK_NAME = "medication_class"
+
+
+class Command(BaseCommand):
+    help = (
+        "Classify (medication id, name) pairs not yet in MEDICATION_CLASS using medication_classes.csv, "
+        "then rebuild the VISIT_MEDICATION rollup"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reclassify", action="store_true", help="Classify every medication again, e.g. after editing the rules")
+
+    def handle(self, *args, **kwargs):
+        rules = load_medication_rules()
+
+        with transaction.atomic(), connections["default"].cursor() as cursor:
+            if kwargs.get("reclassify"):
+                MEDICATION_CLASS.objects.all().delete()
+
+            cursor.execute(unclassified_medication_query)
+            pairs = cursor.fetchall()
+            MEDICATION_CLASS.objects.bulk_create(
+                [
+                    MEDICATION_CLASS(
+                        MEDICATION_ID=medication_id,
+                        MEDICATION_NAME=medication_name,
+                        **classify_medication([medication_name], rules),
+                    )
+                    for medication_id, medication_name in pairs
+                ],
+                batch_size=1000,
+            )
+
+            # The rollup is a join and group by, cheap enough to rebuild whole
+            VISIT_MEDICATION.objects.all().delete()
+            cursor.execute(visit_medication_insert_query)
+            visits = cursor.rowcount
+            cursor.execute(unclassified_medication_count_query)
+            (unclassified,) = cursor.fetchone()
+            RefreshWatermark.objects.update_or_create(name=WATERMARK_NAME)
+
+        self.stdout.write(self.style.SUCCESS(f"Classified {len(pairs)} new medications and rolled up {visits} visits"))
+        if unclassified:
+            self.stdout.write(self.style.WARNING(f"{unclassified} charted medications have no name and no class"))
@@ -0,0 +1,127 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from api.models import BILLING_CODES, INTRAOP_TRANSFUSION, SURGERY_CASE, VISIT_LABS
+from api.views.sql_queries import (
+    case_summary_query,
+    patient_query,
+    procedure_count_query,
+    surgery_case_query,
+    surgery_query,
+)
+
+
+# The analytics queries and bind values that make them runnable as-is
+ADVISED_QUERIES = {
+    "procedure_count_query": (procedure_count_query, {}),
+    "surgery_case_query": (surgery_case_query, {}),
+    "case_summary_query": (case_summary_query, {}),
+    "surgery_query": (surgery_query, {"id": 0}),
+    "patient_query": (patient_query, {"id": 0}),
+}
+
+# Unmanaged EHR tables whose Meta.indexes (including the composite join indexes) are applied
+INDEXED_MODELS = [SURGERY_CASE, BILLING_CODES, VISIT_LABS, INTRAOP_TRANSFUSION]
+
+
+def explain_findings(plan):
+    # plan rows are dicts of tabular EXPLAIN / ANALYZE output
+    findings = []
+    for row in plan:
+        table = row.get("table")
+        extra = row.get("Extra") or ""
+        rows = row.get("r_rows") or row.get("rows")
+        if row.get("type") == "ALL":
+            findings.append(f"full scan of {table} (~{rows} rows)")
+        if "Using filesort" in extra:
+            findings.append(f"filesort on {table}")
+        if "Using temporary" in extra:
+            findings.append(f"temporary table for {table}")
+    return findings
+
+
+def explain(cursor, sql, binds, analyze):
+    cursor.execute(f"{'ANALYZE' if analyze else 'EXPLAIN'} {sql}", binds)
+    columns = [col[0] for col in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def best_time(cursor, sql, binds, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cursor.execute(sql, binds)
+        cursor.fetchall()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def apply_indexes(connection):
+    created = []
+    introspection = connection.introspection
+    with connection.schema_editor() as editor, connection.cursor() as cursor:
+        for model in INDEXED_MODELS:
+            existing = introspection.get_constraints(cursor, model._meta.db_table)
+            for index in model._meta.indexes:
+                if index.name not in existing:
+                    editor.add_index(model, index)
+                    created.append(f"{model._meta.db_table}.{index.name}")
+
+        # Refresh the statistics the optimizer plans with
+        for model in INDEXED_MODELS:
+            cursor.execute(f"ANALYZE TABLE {model._meta.db_table}")
+            cursor.fetchall()
+
+    return created
+
+
+class Command(BaseCommand):
+    help = (
+        "EXPLAIN the analytics queries, report full scans and filesorts, and optionally add the "
+        "composite indexes for the EHR tables, timing each query before and after"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--apply", action="store_true", help="Create the missing indexes")
+        parser.add_argument("--analyze", action="store_true", help="Use ANALYZE (runs the query) instead of EXPLAIN")
+        parser.add_argument("--repeat", type=int, default=3, help="Runs per query, the best time is reported")
+        parser.add_argument("--query", action="append", choices=list(ADVISED_QUERIES), help="Only advise these queries")
+
+    def handle(self, *args, **kwargs):
+        connection = connections["default"]
+        if connection.vendor != "mysql":
+            raise CommandError("index_advisor reads MariaDB/MySQL query plans and needs that database")
+
+        names = kwargs.get("query") or list(ADVISED_QUERIES)
+        before = self.advise(connection, names, kwargs.get("analyze"), kwargs.get("repeat"))
+
+        if not kwargs.get("apply"):
+            return
+
+        created = apply_indexes(connection)
+        if created:
+            self.stdout.write(self.style.SUCCESS(f"Created {', '.join(created)}"))
+        else:
+            self.stdout.write("All advised indexes already exist")
+
+        after = self.advise(connection, names, kwargs.get("analyze"), kwargs.get("repeat"))
+        self.stdout.write("")
+        for name in names:
+            self.stdout.write(f"{name}: {before[name]:.3f}s -> {after[name]:.3f}s")
+
+    def advise(self, connection, names, analyze, repeat):
+        timings = {}
+        with connection.cursor() as cursor:
+            for name in names:
+                sql, binds = ADVISED_QUERIES[name]
+                findings = explain_findings(explain(cursor, sql, binds, analyze))
+                timings[name] = best_time(cursor, sql, binds, repeat)
+
+                self.stdout.write(self.style.MIGRATE_HEADING(f"{name} ({timings[name]:.3f}s)"))
+                for finding in findings:
+                    self.stdout.write(self.style.WARNING(f"  {finding}"))
+                if not findings:
+                    self.stdout.write("  no full scans or filesorts")
+        return timings
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from api.models import RefreshWatermark
+from api.views.utils.data_version import clear_data_version
+from api.views.utils.query_cache import get_query_cache, handoff_backend
+
+
+WATERMARK_NAME = "query_cache"
+
+
+class Command(BaseCommand):
+    help = "Retire every cached query result, for the data loader to run after each EHR refresh"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--purge", action="store_true", help="Also delete the shared entries: the file or django backend, or the memory backend's handoff files")
+
+    def handle(self, *args, **kwargs):
+        # Entries are tied to the data version, which this moves on for every worker
+        RefreshWatermark.objects.update_or_create(name=WATERMARK_NAME)
+        clear_data_version()
+
+        backend = get_query_cache()
+        if kwargs.get("purge") and backend is not None:
+            backend.clear()
+            if not backend.shared:
+                handoff_backend().clear()
+
+        self.stdout.write(self.style.SUCCESS("Invalidated the query cache"))
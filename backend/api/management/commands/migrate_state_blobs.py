@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import State
+from api.views.utils.state_blobs import store_definition
+
+
+class Command(BaseCommand):
+    help = "Move State.definition values saved before StateBlob existed into compressed, deduplicated blobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=200, help="States moved per transaction")
+
+    def handle(self, *args, **kwargs):
+        batch_size = kwargs["batch_size"]
+        moved = 0
+        last_id = 0
+        while True:
+            # Keyset batches, so each one is a short transaction and reruns pick up where they stopped
+            with transaction.atomic():
+                batch = list(
+                    State.objects.select_for_update()
+                    .filter(blob__isnull=True, id__gt=last_id)
+                    .order_by("id")
+                    .only("id", "definition")[:batch_size]
+                )
+                if not batch:
+                    break
+                for state in batch:
+                    state.blob = store_definition(state.definition)
+                    state.definition = ""
+                State.objects.bulk_update(batch, ["blob", "definition"])
+            last_id = batch[-1].id
+            moved += len(batch)
+            self.stdout.write(f"Moved {moved} states")
+
+        self.stdout.write(self.style.SUCCESS(f"Moved {moved} state definitions into blobs"))
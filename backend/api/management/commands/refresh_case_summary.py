@@ -0,0 +1,100 @@
+from datetime import date, datetime, time
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.utils.timezone import make_aware
+
+from api.models import RefreshWatermark, SURGERY_CASE_CODE, SURGERY_CASE_SUMMARY
+from api.views.sql_queries import (
+    TABLES,
+    case_code_insert_query,
+    case_summary_insert_query,
+    case_summary_orphan_query,
+    case_summary_stale_query,
+)
+
+
+WATERMARK_NAME = "surgery_case_summary"
+
+
+def case_id_filter(column, case_ids):
+    bind_names = [f"case{i}" for i in range(len(case_ids))]
+    return f"WHERE {column} IN (%({')s,%('.join(bind_names)})s)", dict(zip(bind_names, case_ids))
+
+
+def summary_tables():
+    # The summary and its case/code table, each with the query that fills it
+    return [
+        (TABLES.get("surgery_case_summary"), case_summary_insert_query),
+        (TABLES.get("surgery_case_code"), case_code_insert_query),
+    ]
+
+
+def summary_is_empty():
+    # A fresh deploy, or one upgraded past the migration adding SURGERY_CASE_CODE, has nothing to refresh incrementally
+    return not SURGERY_CASE_SUMMARY.objects.exists() or not SURGERY_CASE_CODE.objects.exists()
+
+
+def refresh_full(cursor):
+    # Build into shadow tables and swap them in together, so readers never see a half-built summary
+    for table, insert_query in summary_tables():
+        cursor.execute(f"DROP TABLE IF EXISTS {table}_NEW")
+        cursor.execute(f"DROP TABLE IF EXISTS {table}_OLD")
+        cursor.execute(f"CREATE TABLE {table}_NEW LIKE {table}")
+        cursor.execute(insert_query(f"{table}_NEW"))
+    cursor.execute("RENAME TABLE " + ", ".join(
+        f"{table} TO {table}_OLD, {table}_NEW TO {table}" for table, _ in summary_tables()
+    ))
+    for table, _ in summary_tables():
+        cursor.execute(f"DROP TABLE {table}_OLD")
+
+
+def refresh_cases(cursor, case_ids, batch_size):
+    for start in range(0, len(case_ids), batch_size):
+        batch = case_ids[start:start + batch_size]
+        delete_filter_sql, batch_binds = case_id_filter("CASE_ID", batch)
+        insert_filter_sql, _ = case_id_filter("REFRESHED.CASE_ID", batch)
+
+        with transaction.atomic():
+            for table, insert_query in summary_tables():
+                cursor.execute(f"DELETE FROM {table} {delete_filter_sql}", batch_binds)
+                cursor.execute(insert_query(table, insert_filter_sql), batch_binds)
+
+
+class Command(BaseCommand):
+    help = "Rebuild the SURGERY_CASE_SUMMARY table that backs get_sanguine_surgery_cases"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", help="Rebuild every case instead of only changed cases")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Cases refreshed per statement in incremental mode")
+
+    def handle(self, *args, **kwargs):
+        watermark, _ = RefreshWatermark.objects.get_or_create(name=WATERMARK_NAME)
+        full = kwargs.get("full") or watermark.watermark is None or summary_is_empty()
+
+        with connections["default"].cursor() as cursor:
+            cursor.execute(f"SELECT MAX(CASE_DATE) FROM {TABLES.get('surgery_case')}")
+            latest_case_date = cursor.fetchone()[0]
+
+            if full:
+                refresh_full(cursor)
+                self.stdout.write(self.style.SUCCESS("Rebuilt the full case summary"))
+            else:
+                cursor.execute(case_summary_orphan_query)
+                orphans = [row[0] for row in cursor.fetchall()]
+                if orphans:
+                    delete_filter_sql, orphan_binds = case_id_filter("CASE_ID", orphans)
+                    for table, _ in summary_tables():
+                        cursor.execute(f"DELETE FROM {table} {delete_filter_sql}", orphan_binds)
+
+                cursor.execute(case_summary_stale_query, {"watermark": watermark.watermark.date()})
+                stale = [row[0] for row in cursor.fetchall()]
+                refresh_cases(cursor, stale, kwargs.get("batch_size"))
+                self.stdout.write(self.style.SUCCESS(
+                    f"Refreshed {len(stale)} cases and removed {len(orphans)} cases from the case summary"
+                ))
+
+        if isinstance(latest_case_date, date) and not isinstance(latest_case_date, datetime):
+            latest_case_date = make_aware(datetime.combine(latest_case_date, time.min))
+        watermark.watermark = latest_case_date
+        watermark.save()
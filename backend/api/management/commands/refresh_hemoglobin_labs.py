@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from api.models import HEMOGLOBIN_LAB, RefreshWatermark
+from api.views.sql_queries import hemoglobin_lab_insert_query
+
+
+WATERMARK_NAME = "hemoglobin_lab"
+
+
+class Command(BaseCommand):
+    help = "Rebuild the HEMOGLOBIN_LAB table of numeric hemoglobin results from VISIT_LABS"
+
+    def handle(self, *args, **kwargs):
+        # One transaction, so refresh_case_summary never reads a half-loaded table
+        with transaction.atomic(), connections["default"].cursor() as cursor:
+            cursor.execute(f"DELETE FROM {HEMOGLOBIN_LAB._meta.db_table}")
+            cursor.execute(hemoglobin_lab_insert_query)
+            count = cursor.rowcount
+            RefreshWatermark.objects.update_or_create(name=WATERMARK_NAME)
+
+        self.stdout.write(self.style.SUCCESS(f"Extracted {count} hemoglobin results"))
@@ -0,0 +1,66 @@
+import time
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.management.commands.index_advisor import explain_findings
+from api.views.utils.slow_queries import read_entries
+
+
+def summarize(entries):
+    # Per query template: count, p50, p95 and max seconds, and its most recent entry
+    grouped = defaultdict(list)
+    for entry in entries:
+        grouped[entry["query"]].append(entry)
+
+    summary = []
+    for name, group in grouped.items():
+        seconds = np.array([entry["seconds"] for entry in group])
+        summary.append({
+            "query": name,
+            "count": len(group),
+            "p50": float(np.percentile(seconds, 50)),
+            "p95": float(np.percentile(seconds, 95)),
+            "max": float(seconds.max()),
+            "latest": group[-1],
+        })
+    return sorted(summary, key=lambda row: row["p95"], reverse=True)
+
+
+class Command(BaseCommand):
+    help = "Summarize the slow query log by query template, with p50/p95/max seconds"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", type=float, help="Only entries from the last SINCE hours")
+        parser.add_argument("--plans", action="store_true", help="Show the findings of each query's latest EXPLAIN")
+
+    def handle(self, *args, **kwargs):
+        since = time.time() - kwargs["since"] * 3600 if kwargs.get("since") else None
+        entries = read_entries(settings.SLOW_QUERY_LOG, settings.SLOW_QUERY_LOG_BACKUPS, since)
+        if not entries:
+            self.stdout.write(f"No slow queries logged in {settings.SLOW_QUERY_LOG}")
+            return
+
+        self.stdout.write(f"{'query':<32} {'count':>7} {'p50 (s)':>9} {'p95 (s)':>9} {'max (s)':>9}")
+        summary = summarize(entries)
+        for row in summary:
+            self.stdout.write(
+                f"{row['query']:<32} {row['count']:>7} {row['p50']:>9.3f} {row['p95']:>9.3f} {row['max']:>9.3f}"
+            )
+
+        if not kwargs.get("plans"):
+            return
+        for row in summary:
+            latest = row["latest"]
+            self.stdout.write("")
+            self.stdout.write(self.style.MIGRATE_HEADING(f"{row['query']} ({latest['time']}, {latest['view']})"))
+            if latest.get("plan") is None:
+                self.stdout.write(self.style.WARNING(f"  EXPLAIN failed: {latest.get('explain_error')}"))
+                continue
+            findings = explain_findings(latest["plan"])
+            for finding in findings:
+                self.stdout.write(self.style.WARNING(f"  {finding}"))
+            if not findings:
+                self.stdout.write("  no full scans or filesorts")
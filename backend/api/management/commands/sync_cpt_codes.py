@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from api.models import CPT_CODE, RefreshWatermark
+from api.views.utils.cpt_catalog import get_cpt_catalog
+
+
+WATERMARK_NAME = "cpt_code"
+
+
+class Command(BaseCommand):
+    help = "Sync the CPT_CODE table with cpt_codes_cleaned.csv"
+
+    def handle(self, *args, **kwargs):
+        rows = get_cpt_catalog().rows
+        codes = [
+            CPT_CODE(CODE=code, CODE_DESC=desc, CLEAN_NAME=name)
+            for code, desc, name in rows
+        ]
+
+        # MySQL upserts on any unique key and can't be given the conflict target
+        conflict_target = {}
+        if connections["default"].features.supports_update_conflicts_with_target:
+            conflict_target["unique_fields"] = ["CODE"]
+
+        with transaction.atomic():
+            removed, _ = CPT_CODE.objects.exclude(CODE__in=[code.CODE for code in codes]).delete()
+            CPT_CODE.objects.bulk_create(
+                codes,
+                update_conflicts=True,
+                update_fields=["CODE_DESC", "CLEAN_NAME"],
+                **conflict_target,
+            )
+            # Bump the data version, procedure counts and filters depend on this table
+            RefreshWatermark.objects.update_or_create(name=WATERMARK_NAME)
+
+        self.stdout.write(self.style.SUCCESS(f"Synced {len(codes)} CPT codes and removed {removed}"))
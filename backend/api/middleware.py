@@ -0,0 +1,64 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.urls import Resolver404, resolve
+
+from .views.utils.metrics import current_view, record_response, schedule_flush
+
+
+class MetricsMiddleware:
+    """Time each API response, count its bytes and tag the queries it runs with the view name."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        view, token, start = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_view.reset(token)
+        return self.finish(view, response, start)
+
+    async def __acall__(self, request):
+        view, token, start = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_view.reset(token)
+        return self.finish(view, response, start)
+
+    def start(self, request):
+        try:
+            view = resolve(request.path_info).url_name or "unnamed"
+        except Resolver404:
+            view = "not_found"
+        return view, current_view.set(view), time.perf_counter()
+
+    def finish(self, view, response, start):
+        if response.streaming and not response.is_async:
+            # Record once the body has been streamed out
+            response.streaming_content = self.counted(view, response, start, response.streaming_content)
+            return response
+        # Async streams are not counted, only their time to the first byte
+        size = 0 if response.streaming else len(response.content)
+        record_response(view, response.status_code, time.perf_counter() - start, size)
+        schedule_flush()
+        return response
+
+    def counted(self, view, response, start, chunks):
+        size = 0
+        try:
+            for chunk in chunks:
+                size += len(chunk)
+                yield chunk
+        finally:
+            record_response(view, response.status_code, time.perf_counter() - start, size)
+            schedule_flush()
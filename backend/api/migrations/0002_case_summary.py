@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RefreshWatermark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True)),
+                ('watermark', models.DateTimeField(null=True)),
+                ('refreshed_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SURGERY_CASE_SUMMARY',
+            fields=[
+                ('CASE_ID', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('VISIT_NO', models.BigIntegerField()),
+                ('MRN', models.BigIntegerField()),
+                ('SURGEON_PROV_ID', models.CharField(max_length=25)),
+                ('SURGEON_PROV_NAME', models.CharField(max_length=100)),
+                ('ANESTH_PROV_ID', models.CharField(max_length=25)),
+                ('ANESTH_PROV_NAME', models.CharField(max_length=100)),
+                ('PRBC_UNITS', models.FloatField(null=True)),
+                ('FFP_UNITS', models.FloatField(null=True)),
+                ('PLT_UNITS', models.FloatField(null=True)),
+                ('CRYO_UNITS', models.FloatField(null=True)),
+                ('CELL_SAVER_ML', models.FloatField(null=True)),
+                ('PRBC_UNITS_OUTSIDE_OR', models.FloatField(null=True)),
+                ('FFP_UNITS_OUTSIDE_OR', models.FloatField(null=True)),
+                ('PLT_UNITS_OUTSIDE_OR', models.FloatField(null=True)),
+                ('CRYO_UNITS_OUTSIDE_OR', models.FloatField(null=True)),
+                ('CELL_SAVER_ML_OUTSIDE_OR', models.FloatField(null=True)),
+                ('PREOP_HEMO', models.FloatField(null=True)),
+                ('POSTOP_HEMO', models.FloatField(null=True)),
+                ('YEAR', models.IntegerField()),
+                ('QUARTER', models.IntegerField()),
+                ('MONTH', models.IntegerField()),
+                ('CASE_DATE', models.DateField()),
+                ('VENT', models.IntegerField(null=True)),
+                ('DRG_WEIGHT', models.FloatField(null=True)),
+                ('DEATH', models.CharField(max_length=1, null=True)),
+                ('ECMO', models.IntegerField(null=True)),
+                ('STROKE', models.IntegerField(null=True)),
+                ('ALL_CODES', models.TextField(null=True)),
+                ('TXA', models.IntegerField(null=True)),
+                ('B12', models.IntegerField(null=True)),
+                ('AMICAR', models.IntegerField(null=True)),
+                ('IRON', models.IntegerField(null=True)),
+                ('SURGERY_TYPE_DESC', models.CharField(max_length=2000)),
+            ],
+            options={
+                'db_table': 'SURGERY_CASE_SUMMARY',
+                'indexes': [models.Index(fields=['CASE_DATE', 'CASE_ID'], name='CASE_DATE_IDX_SUMMARY'), models.Index(fields=['VISIT_NO'], name='VISIT_NO_IDX_SUMMARY'), models.Index(fields=['SURGEON_PROV_ID'], name='SURGEON_IDX_SUMMARY'), models.Index(fields=['ANESTH_PROV_ID'], name='ANESTH_IDX_SUMMARY')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_case_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CPT_CODE',
+            fields=[
+                ('CODE', models.CharField(max_length=80, primary_key=True, serialize=False)),
+                ('CODE_DESC', models.CharField(max_length=2000)),
+                ('CLEAN_NAME', models.CharField(max_length=200)),
+            ],
+            options={
+                'db_table': 'CPT_CODE',
+                'indexes': [models.Index(fields=['CLEAN_NAME'], name='CLEAN_NAME_IDX')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_cpt_code'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HEMOGLOBIN_LAB',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('VISIT_NO', models.BigIntegerField()),
+                ('LAB_DRAW_DTM', models.DateTimeField()),
+                ('RESULT_DTM', models.DateTimeField()),
+                ('RESULT_CODE', models.CharField(max_length=30)),
+                ('VALUE', models.DecimalField(decimal_places=3, max_digits=8)),
+            ],
+            options={
+                'db_table': 'HEMOGLOBIN_LAB',
+                'indexes': [models.Index(fields=['VISIT_NO', 'LAB_DRAW_DTM', 'RESULT_DTM', 'RESULT_CODE'], name='VISIT_NO_DRAW_IDX_HEMOGLOBIN')],
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_hemoglobin_lab'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MEDICATION_CLASS',
+            fields=[
+                ('MEDICATION_ID', models.DecimalField(decimal_places=0, max_digits=18, primary_key=True, serialize=False)),
+                ('MEDICATION_NAME', models.CharField(max_length=510)),
+                ('TXA', models.BooleanField(default=False)),
+                ('AMICAR', models.BooleanField(default=False)),
+                ('B12', models.BooleanField(default=False)),
+                ('IRON', models.BooleanField(default=False)),
+            ],
+            options={
+                'db_table': 'MEDICATION_CLASS',
+            },
+        ),
+        migrations.CreateModel(
+            name='VISIT_MEDICATION',
+            fields=[
+                ('VISIT_NO', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('TXA', models.IntegerField()),
+                ('AMICAR', models.IntegerField()),
+                ('B12', models.IntegerField()),
+                ('IRON', models.IntegerField()),
+            ],
+            options={
+                'db_table': 'VISIT_MEDICATION',
+            },
+        ),
+    ]
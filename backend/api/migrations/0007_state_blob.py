@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_state_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StateBlob',
+            fields=[
+                ('digest', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('data', models.BinaryField()),
+                ('size', models.IntegerField()),
+                ('literal_size', models.IntegerField()),
+                ('checksum', models.BigIntegerField()),
+                ('refcount', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='state',
+            name='blob',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, to='api.stateblob'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_state_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='state',
+            name='snapshot_version',
+            field=models.IntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='state',
+            name='version',
+            field=models.IntegerField(default=1),
+        ),
+        migrations.CreateModel(
+            name='StateVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.IntegerField()),
+                ('delta', models.TextField(null=True)),
+                ('author', models.CharField(max_length=128)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('blob', models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, to='api.stateblob')),
+                ('state', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.state')),
+            ],
+            options={
+                'unique_together': {('state', 'version')},
+            },
+        ),
+    ]
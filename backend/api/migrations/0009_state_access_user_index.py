@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_state_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stateaccess',
+            name='user',
+            field=models.CharField(db_index=True, max_length=128),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_state_access_user_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SURGERY_CASE_CODE',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('CASE_ID', models.BigIntegerField()),
+                ('CODE', models.CharField(max_length=80)),
+            ],
+            options={
+                'db_table': 'SURGERY_CASE_CODE',
+                'indexes': [models.Index(fields=['CODE', 'CASE_ID'], name='CODE_CASE_IDX')],
+                'unique_together': {('CASE_ID', 'CODE')},
+            },
+        ),
+    ]
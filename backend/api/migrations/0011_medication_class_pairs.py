@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # MEDICATION_CLASS only holds classify_medications output, so it is recreated with the
+    # new key rather than altered in place; run classify_medications after migrating
+
+    dependencies = [
+        ('api', '0010_surgery_case_code'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='MEDICATION_CLASS',
+        ),
+        migrations.CreateModel(
+            name='MEDICATION_CLASS',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('MEDICATION_ID', models.DecimalField(decimal_places=0, max_digits=18, null=True)),
+                ('MEDICATION_NAME', models.CharField(max_length=510)),
+                ('TXA', models.BooleanField(default=False)),
+                ('AMICAR', models.BooleanField(default=False)),
+                ('B12', models.BooleanField(default=False)),
+                ('IRON', models.BooleanField(default=False)),
+            ],
+            options={
+                'db_table': 'MEDICATION_CLASS',
+                'unique_together': {('MEDICATION_NAME', 'MEDICATION_ID')},
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_medication_class_pairs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccessGeneration',
+            fields=[
+                ('user', models.CharField(max_length=128, primary_key=True, serialize=False)),
+                ('generation', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
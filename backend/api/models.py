@@ -14,16 +14,46 @@ class AccessLevel(Enum):
 
 
 # Actual models
+class StateBlob(models.Model):
+    # A state definition stored once per distinct content, see api/views/utils/state_blobs.py
+    digest = models.CharField(max_length=64, primary_key=True)
+    data = models.BinaryField()
+    size = models.IntegerField()
+    literal_size = models.IntegerField()
+    checksum = models.BigIntegerField()
+    refcount = models.IntegerField(default=0)
+
+
 class State(models.Model):
     name = models.CharField(max_length=128, unique=True, default="New State")
+    # Empty once the definition is kept in blob, filled for states saved before blobs existed
     definition = models.TextField()
+    blob = models.ForeignKey(StateBlob, null=True, on_delete=models.PROTECT)
     owner = models.CharField(max_length=128, default="NA")
     public = models.BooleanField(default=False)
+    # Null for states last saved before it was tracked
+    updated_at = models.DateTimeField(auto_now=True, null=True)
+    # The current version, and the one blob (or definition) holds, see api/views/utils/state_versions.py
+    version = models.IntegerField(default=1)
+    snapshot_version = models.IntegerField(default=1)
+
+
+class StateVersion(models.Model):
+    # A saved version of a state: a full snapshot in blob, or a splice delta against the previous version
+    state = models.ForeignKey(State, on_delete=models.CASCADE)
+    version = models.IntegerField()
+    blob = models.ForeignKey(StateBlob, null=True, on_delete=models.PROTECT)
+    delta = models.TextField(null=True)
+    author = models.CharField(max_length=128)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ['state', 'version']
 
 
 class StateAccess(models.Model):
     state = models.ForeignKey(State, on_delete=models.CASCADE)
-    user = models.CharField(max_length=128)
+    user = models.CharField(max_length=128, db_index=True)
     role = models.CharField(
         max_length=6,
         choices=AccessLevel.choices(),
@@ -34,6 +64,75 @@ class StateAccess(models.Model):
         unique_together = ['state', 'user']
 
 
+class AccessGeneration(models.Model):
+    # Bumped whenever a user's shared roles change, so every worker can tell its cached roles are stale
+    user = models.CharField(max_length=128, primary_key=True)
+    generation = models.IntegerField(default=0)
+
+
+class RefreshWatermark(models.Model):
+    # High-water marks for the derived tables rebuilt from the EHR extracts
+    name = models.CharField(max_length=64, unique=True)
+    watermark = models.DateTimeField(null=True)
+    refreshed_at = models.DateTimeField(auto_now=True)
+
+
+class CPT_CODE(models.Model):
+    # Procedure CPT codes of interest, synced from cpt_codes_cleaned.csv by sync_cpt_codes
+    CODE = models.CharField(max_length=80, primary_key=True)
+    CODE_DESC = models.CharField(max_length=2000)
+    CLEAN_NAME = models.CharField(max_length=200)
+
+    class Meta:
+        db_table = 'CPT_CODE'
+        indexes = [
+            models.Index(fields=['CLEAN_NAME'], name='CLEAN_NAME_IDX'),
+        ]
+
+
+class HEMOGLOBIN_LAB(models.Model):
+    # Numeric hemoglobin results in g/dL, extracted from VISIT_LABS by refresh_hemoglobin_labs
+    VISIT_NO = models.BigIntegerField()
+    LAB_DRAW_DTM = models.DateTimeField()
+    RESULT_DTM = models.DateTimeField()
+    RESULT_CODE = models.CharField(max_length=30)
+    VALUE = models.DecimalField(max_digits=8, decimal_places=3)
+
+    class Meta:
+        db_table = 'HEMOGLOBIN_LAB'
+        indexes = [
+            models.Index(fields=['VISIT_NO', 'LAB_DRAW_DTM', 'RESULT_DTM', 'RESULT_CODE'], name='VISIT_NO_DRAW_IDX_HEMOGLOBIN'),
+        ]
+
+
+class MEDICATION_CLASS(models.Model):
+    # Classes of each (medication id, name) pair seen in INTRAOP_MEDS/EXTRAOP_MEDS, set by
+    # classify_medications. A renamed id is a new pair, and meds charted without an id are
+    # classified by name alone.
+    MEDICATION_ID = models.DecimalField(max_digits=18, decimal_places=0, null=True)
+    MEDICATION_NAME = models.CharField(max_length=510)
+    TXA = models.BooleanField(default=False)
+    AMICAR = models.BooleanField(default=False)
+    B12 = models.BooleanField(default=False)
+    IRON = models.BooleanField(default=False)
+
+    class Meta:
+        db_table = 'MEDICATION_CLASS'
+        unique_together = ['MEDICATION_NAME', 'MEDICATION_ID']
+
+
+class VISIT_MEDICATION(models.Model):
+    # Per visit medication class counts, rolled up from MEDICATION_CLASS by classify_medications
+    VISIT_NO = models.BigIntegerField(primary_key=True)
+    TXA = models.IntegerField()
+    AMICAR = models.IntegerField()
+    B12 = models.IntegerField()
+    IRON = models.IntegerField()
+
+    class Meta:
+        db_table = 'VISIT_MEDICATION'
+
+
 class PATIENT(models.Model):
     MRN = models.BigIntegerField(primary_key=True)
     PAT_FAMILY = models.CharField(max_length=30)
@@ -134,6 +233,7 @@ class BILLING_CODES(models.Model):
         indexes = [
             models.Index(fields=['VISIT_NO'], name='VISIT_NO_IDX_BILLING_CODES'),
             models.Index(fields=['CODE'], name='CODE_IDX'),
+            models.Index(fields=['VISIT_NO', 'PROC_DTM'], name='VISIT_NO_PROC_DTM_IDX'),
         ]
 
 
@@ -158,6 +258,7 @@ class VISIT_LABS(models.Model):
         indexes = [
             models.Index(fields=['VISIT_NO'], name='VISIT_NO_IDX_VISIT_LABS'),
             models.Index(fields=['RESULT_DESC'], name='RESULT_DESC_IDX'),
+            models.Index(fields=['VISIT_NO', 'LAB_DRAW_DTM'], name='VISIT_NO_DRAW_DTM_IDX'),
         ]
 
 
@@ -182,6 +283,7 @@ class INTRAOP_TRANSFUSION(models.Model):
         db_table = 'INTRAOP_TRANSFUSION'
         indexes = [
             models.Index(fields=['CASE_ID'], name='CASE_ID_IDX'),
+            models.Index(fields=['CASE_ID', 'TRNSFSN_DTM'], name='CASE_ID_TRNSFSN_DTM_IDX'),
         ]
 
 
@@ -230,3 +332,63 @@ class EXTRAOP_MEDS(models.Model):
         indexes = [
             models.Index(fields=['VISIT_NO'], name='VISIT_NO_IDX_EXTRAOP_MEDS'),
         ]
+
+
+class SURGERY_CASE_SUMMARY(models.Model):
+    # One row per surgery case, materialized from surgery_case_query by refresh_case_summary
+    CASE_ID = models.BigIntegerField(primary_key=True)
+    VISIT_NO = models.BigIntegerField()
+    MRN = models.BigIntegerField()
+    SURGEON_PROV_ID = models.CharField(max_length=25)
+    SURGEON_PROV_NAME = models.CharField(max_length=100)
+    ANESTH_PROV_ID = models.CharField(max_length=25)
+    ANESTH_PROV_NAME = models.CharField(max_length=100)
+    PRBC_UNITS = models.FloatField(null=True)
+    FFP_UNITS = models.FloatField(null=True)
+    PLT_UNITS = models.FloatField(null=True)
+    CRYO_UNITS = models.FloatField(null=True)
+    CELL_SAVER_ML = models.FloatField(null=True)
+    PRBC_UNITS_OUTSIDE_OR = models.FloatField(null=True)
+    FFP_UNITS_OUTSIDE_OR = models.FloatField(null=True)
+    PLT_UNITS_OUTSIDE_OR = models.FloatField(null=True)
+    CRYO_UNITS_OUTSIDE_OR = models.FloatField(null=True)
+    CELL_SAVER_ML_OUTSIDE_OR = models.FloatField(null=True)
+    PREOP_HEMO = models.FloatField(null=True)
+    POSTOP_HEMO = models.FloatField(null=True)
+    YEAR = models.IntegerField()
+    QUARTER = models.IntegerField()
+    MONTH = models.IntegerField()
+    CASE_DATE = models.DateField()
+    VENT = models.IntegerField(null=True)
+    DRG_WEIGHT = models.FloatField(null=True)
+    DEATH = models.CharField(max_length=1, null=True)
+    ECMO = models.IntegerField(null=True)
+    STROKE = models.IntegerField(null=True)
+    ALL_CODES = models.TextField(null=True)
+    TXA = models.IntegerField(null=True)
+    B12 = models.IntegerField(null=True)
+    AMICAR = models.IntegerField(null=True)
+    IRON = models.IntegerField(null=True)
+    SURGERY_TYPE_DESC = models.CharField(max_length=2000)
+
+    class Meta:
+        db_table = 'SURGERY_CASE_SUMMARY'
+        indexes = [
+            models.Index(fields=['CASE_DATE', 'CASE_ID'], name='CASE_DATE_IDX_SUMMARY'),
+            models.Index(fields=['VISIT_NO'], name='VISIT_NO_IDX_SUMMARY'),
+            models.Index(fields=['SURGEON_PROV_ID'], name='SURGEON_IDX_SUMMARY'),
+            models.Index(fields=['ANESTH_PROV_ID'], name='ANESTH_IDX_SUMMARY'),
+        ]
+
+
+class SURGERY_CASE_CODE(models.Model):
+    # The CPT codes of each summarized case, one row per code, kept in step by refresh_case_summary
+    CASE_ID = models.BigIntegerField()
+    CODE = models.CharField(max_length=80)
+
+    class Meta:
+        db_table = 'SURGERY_CASE_CODE'
+        unique_together = ['CASE_ID', 'CODE']
+        indexes = [
+            models.Index(fields=['CODE', 'CASE_ID'], name='CODE_CASE_IDX'),
+        ]
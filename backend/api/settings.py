@@ -12,6 +12,30 @@ env = environ.Env(
     DJANGO_HOSTNAME=(str, "localhost"),
     DJANGO_DISABLE_LOGINS=(bool, False),
     DJANGO_AUTH_PROVIDER=(str, AUTH_PROVIDER_CAS),
+    DJANGO_DATA_VERSION_TTL=(int, 30),
+    DJANGO_QUERY_CACHE=(str, "memory"),
+    DJANGO_QUERY_CACHE_BYTES=(int, 256 * 1024 * 1024),
+    DJANGO_QUERY_CACHE_DIR=(str, ""),
+    DJANGO_QUERY_CACHE_ALIAS=(str, "default"),
+    DJANGO_QUERY_CACHE_TTL=(int, 300),
+    DJANGO_QUERY_CACHE_LOCK_TIMEOUT=(int, 300),
+    DJANGO_QUERY_CACHE_MAX_STALE=(int, 3600),
+    DJANGO_DB_CONN_MAX_AGE=(int, 600),
+    DJANGO_DB_CONN_HEALTH_CHECKS=(bool, True),
+    DJANGO_DB_POOL_SIZE=(int, 0),
+    DJANGO_DB_POOL_TIMEOUT=(int, 10),
+    DJANGO_SERVER=(str, "wsgi"),
+    DJANGO_ASYNC_DB_THREADS=(int, 8),
+    DJANGO_METRICS_DIR=(str, ""),
+    DJANGO_METRICS_ALLOWED_IPS=(list, ["127.0.0.1", "::1"]),
+    DJANGO_SLOW_QUERY_SECONDS=(float, 2.0),
+    DJANGO_SLOW_QUERY_LOG=(str, ""),
+    DJANGO_SLOW_QUERY_LOG_BYTES=(int, 10 * 1024 * 1024),
+    DJANGO_SLOW_QUERY_LOG_BACKUPS=(int, 5),
+    DJANGO_STATE_SNAPSHOT_INTERVAL=(int, 20),
+    DJANGO_STATE_SNAPSHOTS_KEPT=(int, 5),
+    DJANGO_STATE_ACCESS_TTL=(int, 30),
+    DJANGO_STATE_ACCESS_CACHE_ALIAS=(str, ""),
     SAML_ENTITY_ID=(str, ""),
     SAML_SP_BASE_URL=(str, ""),
     SAML_IDP_METADATA_MODE=(str, "file"),
@@ -73,6 +97,7 @@ elif AUTH_PROVIDER == AUTH_PROVIDER_SAML:
 
 MIDDLEWARE = [
     "corsheaders.middleware.CorsMiddleware",
+    "api.middleware.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -115,10 +140,76 @@ DATABASES = {
         'PASSWORD': env("MARIADB_PASSWORD"),
         'HOST': env("MARIADB_HOST"),
         'PORT': env("MARIADB_PORT"),
+        # Keep each thread's connection across requests, pinging it before reuse after an error
+        'CONN_MAX_AGE': env("DJANGO_DB_CONN_MAX_AGE"),
+        'CONN_HEALTH_CHECKS': env("DJANGO_DB_CONN_HEALTH_CHECKS"),
     }
 }
+
+# With a pool size, connections are instead checked out of a per-worker pool shared by its
+# threads and returned at the end of each request; the pool recycles them after CONN_MAX_AGE
+if env("DJANGO_DB_POOL_SIZE"):
+    DATABASES['default'].update({
+        'ENGINE': 'api.db.mysql',
+        'CONN_MAX_AGE': 0,
+        'POOL': {
+            'SIZE': env("DJANGO_DB_POOL_SIZE"),
+            'TIMEOUT': env("DJANGO_DB_POOL_TIMEOUT"),
+            'MAX_AGE': env("DJANGO_DB_CONN_MAX_AGE"),
+            'HEALTH_CHECKS': env("DJANGO_DB_CONN_HEALTH_CHECKS"),
+        },
+    })
 DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
 
+# Seconds a worker trusts its cached EHR data version before re-reading it for ETags
+DATA_VERSION_TTL = env("DJANGO_DATA_VERSION_TTL")
+
+# Query result cache: "none", "memory" (per worker LRU of QUERY_CACHE_BYTES), "file" (shared
+# through QUERY_CACHE_DIR, by default under the app's var directory, created owner-only) or
+# "django" (the QUERY_CACHE_ALIAS cache, under keys of its own). TTLs are in seconds,
+# DJANGO_QUERY_CACHE_TTLS overrides them per query, e.g. "procedure_counts=3600;aggregate=600"
+QUERY_CACHE = env("DJANGO_QUERY_CACHE")
+QUERY_CACHE_BYTES = env("DJANGO_QUERY_CACHE_BYTES")
+QUERY_CACHE_DIR = env("DJANGO_QUERY_CACHE_DIR") or os.path.join(BASE_DIR, "var", "query-cache")
+QUERY_CACHE_ALIAS = env("DJANGO_QUERY_CACHE_ALIAS")
+QUERY_CACHE_TTL = env("DJANGO_QUERY_CACHE_TTL")
+QUERY_CACHE_TTLS = env.dict("DJANGO_QUERY_CACHE_TTLS", cast={"value": int}, default={})
+# Seconds a worker waits for another worker computing the same query before running it itself
+QUERY_CACHE_LOCK_TIMEOUT = env("DJANGO_QUERY_CACHE_LOCK_TIMEOUT")
+# Seconds past its TTL that a dashboard bootstrap result is still served while it refreshes
+QUERY_CACHE_MAX_STALE = env("DJANGO_QUERY_CACHE_MAX_STALE")
+
+# "wsgi" (sync gunicorn workers) or "asgi" (gunicorn with uvicorn workers), see entrypoint.sh.
+# Under ASGI the database-backed views are async and share ASYNC_DB_THREADS threads per worker
+SERVER = env("DJANGO_SERVER").lower()
+ASYNC_VIEWS = SERVER == "asgi"
+ASYNC_DB_THREADS = env("DJANGO_ASYNC_DB_THREADS")
+
+# Each worker writes its query and response metrics to METRICS_DIR (by default under the app's
+# var directory, created owner-only), /api/metrics merges them and serves them to collectors
+# connecting from METRICS_ALLOWED_IPS
+METRICS_DIR = env("DJANGO_METRICS_DIR") or os.path.join(BASE_DIR, "var", "metrics")
+METRICS_ALLOWED_IPS = env("DJANGO_METRICS_ALLOWED_IPS")
+
+# Queries slower than SLOW_QUERY_SECONDS (0 disables) are appended to SLOW_QUERY_LOG with their
+# EXPLAIN plan and redacted binds, rotated past SLOW_QUERY_LOG_BYTES into SLOW_QUERY_LOG_BACKUPS
+# files. Its directory, by default under the app's var directory, is created owner-only
+SLOW_QUERY_SECONDS = env("DJANGO_SLOW_QUERY_SECONDS")
+SLOW_QUERY_LOG = env("DJANGO_SLOW_QUERY_LOG") or os.path.join(BASE_DIR, "var", "slow-queries", "slow-queries.jsonl")
+SLOW_QUERY_LOG_BYTES = env("DJANGO_SLOW_QUERY_LOG_BYTES")
+SLOW_QUERY_LOG_BACKUPS = env("DJANGO_SLOW_QUERY_LOG_BACKUPS")
+
+# PATCHed states store deltas, with a full snapshot every STATE_SNAPSHOT_INTERVAL versions;
+# history older than the last STATE_SNAPSHOTS_KEPT snapshots is dropped
+STATE_SNAPSHOT_INTERVAL = env("DJANGO_STATE_SNAPSHOT_INTERVAL")
+STATE_SNAPSHOTS_KEPT = env("DJANGO_STATE_SNAPSHOTS_KEPT")
+
+# Seconds a user's shared state roles are cached for permission checks, per worker (checked
+# against the user's access generation on every use) unless STATE_ACCESS_CACHE_ALIAS names a
+# Django cache shared by the workers
+STATE_ACCESS_TTL = env("DJANGO_STATE_ACCESS_TTL")
+STATE_ACCESS_CACHE_ALIAS = env("DJANGO_STATE_ACCESS_CACHE_ALIAS")
+
 AUTHENTICATION_BACKENDS = (
     'django.contrib.auth.backends.ModelBackend',
 )
@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 
 os.environ.setdefault("DJANGO_SECRET_KEY", "test-secret-key")
@@ -11,6 +12,8 @@ os.environ.setdefault("MARIADB_USER", "test")
 os.environ.setdefault("MARIADB_PASSWORD", "test")
 os.environ.setdefault("MARIADB_HOST", "localhost")
 os.environ.setdefault("MARIADB_PORT", "3306")
+os.environ.setdefault("DJANGO_QUERY_CACHE", "none")
+os.environ.setdefault("DJANGO_STATE_ACCESS_TTL", "0")
 
 from .settings import *  # noqa: F401,F403
 
@@ -26,6 +29,10 @@ PASSWORD_HASHERS = [
     "django.contrib.auth.hashers.MD5PasswordHasher",
 ]
 
+METRICS_DIR = tempfile.mkdtemp(prefix="sanguine-metrics-")
+SLOW_QUERY_LOG = os.path.join(METRICS_DIR, "slow-queries.jsonl")
+QUERY_CACHE_DIR = tempfile.mkdtemp(prefix="sanguine-query-cache-")
+
 SESSION_COOKIE_SECURE = False
 CSRF_COOKIE_SECURE = False
 ALLOWED_HOSTS = [*ALLOWED_HOSTS, "localhost", "testserver"]  # noqa: F405
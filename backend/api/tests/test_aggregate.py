@@ -0,0 +1,74 @@
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+
+from api.tests.test_surgeries import make_case
+from api.views.utils.aggregation import group_aggregate, parse_measures
+from api.views.utils.data_version import clear_data_version
+
+
+class GroupAggregateTests(SimpleTestCase):
+    def test_sum_avg_and_percent_per_group(self):
+        measures = parse_measures(["sum:PRBC_UNITS", "avg:PREOP_HEMO", "percent:PRBC_UNITS"])
+
+        result = group_aggregate(
+            ["S2", "S1", "S1", "S2", "S1"],
+            {
+                "PRBC_UNITS": [0, 2, 0, 4, 1],
+                "PREOP_HEMO": [None, 12.0, 10.0, None, None],
+            },
+            measures,
+        )
+
+        self.assertEqual(result, [
+            {
+                "aggregateAttribute": "S1",
+                "caseCount": 3,
+                "measures": {"sum:PRBC_UNITS": 3.0, "avg:PREOP_HEMO": 11.0, "percent:PRBC_UNITS": 2 / 3 * 100},
+            },
+            {
+                "aggregateAttribute": "S2",
+                "caseCount": 2,
+                "measures": {"sum:PRBC_UNITS": 4.0, "avg:PREOP_HEMO": None, "percent:PRBC_UNITS": 50.0},
+            },
+        ])
+
+    def test_unknown_measure_is_rejected(self):
+        with self.assertRaises(ValueError):
+            parse_measures(["median:PRBC_UNITS"])
+        with self.assertRaises(ValueError):
+            parse_measures(["sum:MRN"])
+
+
+class AggregateEndpointTests(TestCase):
+    def setUp(self):
+        clear_data_version()
+        user = get_user_model().objects.create_user(username="alice", password="secret")
+        self.client.force_login(user)
+
+    def test_groups_filtered_cases(self):
+        make_case(1, YEAR=2023, PRBC_UNITS=2, DEATH="Y")
+        make_case(2, YEAR=2023, PRBC_UNITS=None)
+        make_case(3, YEAR=2024, PRBC_UNITS=1)
+        make_case(4, YEAR=2024, PRBC_UNITS=5, SURGERY_TYPE_DESC="Urgent")
+
+        response = self.client.get("/api/aggregate", {
+            "group_by": "YEAR",
+            "measure": ["sum:PRBC_UNITS", "percent:DEATH"],
+            "surgery_type": "Elective",
+        })
+
+        self.assertEqual(response.status_code, 200)
+        payload = response.json()
+        self.assertEqual(payload["caseCount"], 3)
+        self.assertEqual(payload["result"], [
+            {"aggregateAttribute": 2023, "caseCount": 2, "measures": {"sum:PRBC_UNITS": 2.0, "percent:DEATH": 50.0}},
+            {"aggregateAttribute": 2024, "caseCount": 1, "measures": {"sum:PRBC_UNITS": 1.0, "percent:DEATH": 0.0}},
+        ])
+
+    def test_invalid_parameters_are_rejected(self):
+        self.assertEqual(self.client.get("/api/aggregate", {"group_by": "MRN", "measure": "sum:PRBC_UNITS"}).status_code, 400)
+        self.assertEqual(self.client.get("/api/aggregate", {"group_by": "YEAR"}).status_code, 400)
+        self.assertEqual(
+            self.client.get("/api/aggregate", {"group_by": "YEAR", "measure": "sum:PRBC_UNITS", "date_from": "soon"}).status_code,
+            400,
+        )
@@ -0,0 +1,26 @@
+import random
+
+from django.test import SimpleTestCase
+
+from api.views.utils.aho_corasick import AhoCorasick
+from api.views.utils.cpt_catalog import get_cpt_catalog
+
+
+class AhoCorasickTests(SimpleTestCase):
+    def test_overlapping_and_nested_patterns(self):
+        matcher = AhoCorasick([("he", 1), ("she", 2), ("his", 3), ("hers", 4)])
+
+        self.assertEqual(matcher.find("ushers"), {1, 2, 4})
+        self.assertEqual(matcher.find("ahishe"), {1, 2, 3})
+        self.assertEqual(matcher.find("xyz"), set())
+
+    def test_matches_substring_scan_over_cpt_descriptions(self):
+        rows = get_cpt_catalog().rows
+        matcher = AhoCorasick((desc, name) for _, desc, name in rows)
+        rng = random.Random(7)
+
+        for _ in range(50):
+            descs = [row[1] for row in rng.sample(rows, 4)] + ["UNLISTED PROCEDURE"]
+            text = ", ".join(descs)
+            expected = {name for _, desc, name in rows if desc in text}
+            self.assertEqual(matcher.find(text), expected)
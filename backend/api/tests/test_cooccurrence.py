@@ -0,0 +1,72 @@
+import importlib.util
+import json
+import os
+from contextlib import redirect_stdout
+from io import StringIO
+
+from django.conf import settings
+from django.test import SimpleTestCase
+
+from api.views.utils.cooccurrence import procedure_cooccurrence
+
+
+NAME_TO_CODES = {
+    "CABG": ["33510", "33511"],
+    "TAVR": ["33361"],
+    "ECMO": ["33946"],
+}
+
+
+class ProcedureCooccurrenceTests(SimpleTestCase):
+    def test_counts_match_the_counter_implementation(self):
+        cases = [
+            "ECMO|CABG",
+            "CABG",
+            "TAVR",
+            "TAVR|CABG|ECMO",
+            "ECMO",
+        ]
+
+        result = procedure_cooccurrence(cases, NAME_TO_CODES)
+
+        # Order of procedures and overlap keys follows first appearance, as before
+        self.assertEqual(
+            json.dumps(result),
+            json.dumps([
+                {
+                    "procedureName": "CABG",
+                    "procedureCodes": ["33510", "33511"],
+                    "count": 3,
+                    "overlapList": {"ECMO": 2, "TAVR": 1, "Only CABG": 1},
+                },
+                {
+                    "procedureName": "ECMO",
+                    "procedureCodes": ["33946"],
+                    "count": 3,
+                    "overlapList": {"CABG": 2, "TAVR": 1, "Only ECMO": 1},
+                },
+                {
+                    "procedureName": "TAVR",
+                    "procedureCodes": ["33361"],
+                    "count": 2,
+                    "overlapList": {"CABG": 1, "ECMO": 1, "Only TAVR": 1},
+                },
+            ]),
+        )
+
+    def test_no_cases_returns_empty_list(self):
+        self.assertEqual(procedure_cooccurrence([], NAME_TO_CODES), [])
+
+
+class CooccurrenceBenchmarkTests(SimpleTestCase):
+    def test_benchmark_runs_on_a_small_input(self):
+        path = os.path.join(settings.BASE_DIR, "benchmarks", "cooccurrence.py")
+        spec = importlib.util.spec_from_file_location("cooccurrence_benchmark", path)
+        benchmark = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(benchmark)
+
+        # main exits when the engine and the Counter loop disagree
+        out = StringIO()
+        with redirect_stdout(out):
+            benchmark.main(["--cases", "200"])
+        self.assertEqual(out.getvalue().splitlines()[1].split()[0], "200")
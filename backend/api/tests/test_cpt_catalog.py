@@ -0,0 +1,74 @@
+import os
+from io import StringIO
+from tempfile import TemporaryDirectory
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+
+from api.models import CPT_CODE, RefreshWatermark
+from api.views.utils.cpt_catalog import CptCatalog, get_cpt_catalog
+
+
+class CptCatalogTests(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "cpt_codes_cleaned.csv")
+        self.write_rows([
+            ("33510", "CABG VEIN SINGLE", "CABG"),
+            ("33511", "CABG VEIN TWO", "CABG"),
+            ("33361", "REPLACE AORTIC VALVE PERQ", "TAVR"),
+        ])
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write_rows(self, rows, mtime_ns=None):
+        with open(self.path, "w") as file:
+            file.write("code,db_code_desc,clean_name\n")
+            for row in rows:
+                file.write(",".join(row) + "\n")
+        if mtime_ns is not None:
+            os.utime(self.path, ns=(mtime_ns, mtime_ns))
+
+    def test_indexes_are_built_from_the_file(self):
+        catalog = CptCatalog(self.path).refresh()
+
+        self.assertEqual(catalog.codes, ["33510", "33511", "33361"])
+        self.assertEqual(catalog.code_to_name["33361"], "TAVR")
+        self.assertEqual(catalog.name_to_codes["CABG"], ["33510", "33511"])
+        self.assertEqual(catalog.desc_to_codes["CABG VEIN TWO"], ["33511"])
+
+    def test_reloads_only_when_mtime_changes(self):
+        os.utime(self.path, ns=(1_000_000_000, 1_000_000_000))
+        catalog = CptCatalog(self.path).refresh()
+        rows = catalog.rows
+
+        self.assertIs(catalog.refresh().rows, rows)
+
+        self.write_rows([("33510", "CABG VEIN SINGLE", "CABG")], mtime_ns=2_000_000_000)
+
+        self.assertEqual(catalog.refresh().codes, ["33510"])
+        self.assertNotIn("TAVR", catalog.name_to_codes)
+
+    def test_procedures_in_finds_every_description(self):
+        catalog = CptCatalog(self.path).refresh()
+
+        codes = "CABG VEIN TWO, SOMETHING ELSE, REPLACE AORTIC VALVE PERQ"
+
+        self.assertEqual(catalog.procedures_in(codes), {"CABG", "TAVR"})
+        self.assertEqual(catalog.procedures_in("UNRELATED"), set())
+
+
+class SyncCptCodesTests(TestCase):
+    def test_table_matches_the_catalog(self):
+        CPT_CODE.objects.create(CODE="00000", CODE_DESC="RETIRED", CLEAN_NAME="Retired")
+        CPT_CODE.objects.create(CODE="33510", CODE_DESC="STALE", CLEAN_NAME="Stale")
+
+        call_command("sync_cpt_codes", stdout=StringIO())
+
+        catalog = get_cpt_catalog()
+        self.assertEqual(
+            sorted(CPT_CODE.objects.values_list("CODE", "CODE_DESC", "CLEAN_NAME")),
+            sorted(catalog.rows),
+        )
+        self.assertTrue(RefreshWatermark.objects.filter(name="cpt_code").exists())
@@ -0,0 +1,79 @@
+import threading
+from unittest.mock import Mock
+
+from django.test import SimpleTestCase
+
+from api.db.pool import ConnectionPool, PoolExhausted
+
+
+def make_pool(**options):
+    values = {"size": 2, "timeout": 1, "max_age": 600, "health_checks": True}
+    values.update(options)
+    connect = Mock(side_effect=lambda: Mock(name="connection"))
+    is_usable = Mock(return_value=True)
+    return ConnectionPool(connect=connect, is_usable=is_usable, **values), connect, is_usable
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def test_released_connections_are_reused(self):
+        pool, connect, is_usable = make_pool()
+
+        first = pool.acquire()
+        pool.release(first)
+        second = pool.acquire()
+
+        self.assertIs(second, first)
+        self.assertEqual(connect.call_count, 1)
+        is_usable.assert_called_once_with(first)
+        stats = pool.stats()
+        self.assertEqual((stats["connects"], stats["checkouts"], stats["reused"]), (1, 2, 1))
+        self.assertEqual(stats["reuse_ratio"], 0.5)
+
+    def test_unusable_and_expired_connections_are_replaced(self):
+        pool, connect, is_usable = make_pool()
+        broken = pool.acquire()
+        pool.release(broken)
+        is_usable.return_value = False
+
+        replacement = pool.acquire()
+
+        self.assertIsNot(replacement, broken)
+        broken.close.assert_called_once()
+
+        pool.max_age = 0
+        pool.release(replacement)
+        replacement.close.assert_called_once()
+        self.assertEqual(pool.stats()["open"], 0)
+
+    def test_checkouts_wait_for_a_free_connection(self):
+        pool, connect, _ = make_pool(size=1)
+        held = pool.acquire()
+        acquired = []
+
+        waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+        waiter.start()
+        waiter.join(0.1)
+        self.assertEqual(acquired, [])
+
+        pool.release(held)
+        waiter.join(1)
+
+        self.assertEqual(acquired, [held])
+        self.assertEqual(connect.call_count, 1)
+        self.assertGreater(pool.stats()["wait_seconds"], 0)
+
+    def test_exhausted_pool_times_out(self):
+        pool, _, _ = make_pool(size=1, timeout=0.05)
+        pool.acquire()
+
+        with self.assertRaises(PoolExhausted):
+            pool.acquire()
+        self.assertEqual(pool.stats()["timeouts"], 1)
+
+    def test_failed_connects_free_their_slot(self):
+        pool, connect, _ = make_pool(size=1)
+        connect.side_effect = [ConnectionError, Mock(name="connection")]
+
+        with self.assertRaises(ConnectionError):
+            pool.acquire()
+        self.assertIsNotNone(pool.acquire())
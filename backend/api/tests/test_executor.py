@@ -0,0 +1,62 @@
+import asyncio
+import inspect
+import json
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.http import JsonResponse
+from django.test import RequestFactory, TransactionTestCase, override_settings
+
+from api.tests.test_surgeries import make_case
+from api.views import get_sanguine_surgery_cases
+from api.views.utils import executor
+from api.views.utils.data_version import clear_data_version
+from api.views.utils.executor import executor_view
+
+
+@override_settings(ASYNC_DB_THREADS=2)
+class ExecutorViewTests(TransactionTestCase):
+    def setUp(self):
+        executor._executor.clear()
+        clear_data_version()
+        self.request = RequestFactory().get("/api/get_sanguine_surgery_cases")
+        self.request.user = get_user_model().objects.create_user(username="alice", password="secret")
+
+    def test_streamed_cases_are_drained_on_the_executor(self):
+        make_case(1)
+        make_case(2)
+
+        response = async_to_sync(executor_view(get_sanguine_surgery_cases))(self.request)
+
+        self.assertFalse(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertIn("ETag", response)
+        self.assertEqual(sorted(row["CASE_ID"] for row in json.loads(response.content)["result"]), [1, 2])
+
+    def test_views_share_a_bounded_pool_of_threads(self):
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def slow_view(request):
+            with lock:
+                running.append(threading.current_thread().name)
+                peak.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.pop()
+            return JsonResponse({"thread": threading.current_thread().name})
+
+        view = executor_view(slow_view)
+
+        async def burst():
+            return await asyncio.gather(*(view(self.request) for _ in range(6)))
+
+        responses = async_to_sync(burst)()
+
+        self.assertTrue(inspect.iscoroutinefunction(view))
+        self.assertEqual(max(peak), 2)
+        threads = {json.loads(response.content)["thread"] for response in responses}
+        self.assertTrue(all(name.startswith("sanguine-db") for name in threads))
@@ -0,0 +1,59 @@
+from datetime import datetime
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase
+
+from api.models import HEMOGLOBIN_LAB, VISIT_LABS
+
+
+class RefreshHemoglobinLabsTests(TransactionTestCase):
+    def setUp(self):
+        # VISIT_LABS is unmanaged, create a bare copy of the columns the extraction reads
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                CREATE TABLE {VISIT_LABS._meta.db_table} (
+                    VISIT_NO bigint, LAB_DRAW_DTM datetime, RESULT_DTM datetime, RESULT_CODE varchar(30),
+                    RESULT_DESC varchar(256), RESULT_VALUE varchar(1000), UOM_CODE varchar(30)
+                )
+            """)
+
+    def tearDown(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE {VISIT_LABS._meta.db_table}")
+
+    def add_lab(self, result_desc, result_value, uom_code, draw_hour=8):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {VISIT_LABS._meta.db_table} VALUES (10, %s, %s, 'HGB', %s, %s, %s)",
+                [datetime(2024, 2, 1, draw_hour), datetime(2024, 2, 1, draw_hour, 30), result_desc, result_value, uom_code],
+            )
+
+    def test_numeric_results_are_extracted_in_g_per_dl(self):
+        self.add_lab("Hemoglobin", "12.4", "g/dL", draw_hour=6)
+        self.add_lab("HGB", "131", "g/L", draw_hour=7)
+        self.add_lab("Hemoglobin", "see note", "g/dL")
+        self.add_lab("Hemoglobin", "12.4", "mmol/L")
+        self.add_lab("Platelets", "250", "g/dL")
+
+        call_command("refresh_hemoglobin_labs", stdout=StringIO())
+        call_command("refresh_hemoglobin_labs", stdout=StringIO())
+
+        self.assertEqual(
+            list(HEMOGLOBIN_LAB.objects.order_by("LAB_DRAW_DTM").values_list("VISIT_NO", "VALUE")),
+            [(10, Decimal("12.4")), (10, Decimal("13.1"))],
+        )
+
+    def test_results_outside_the_value_column_are_discarded(self):
+        self.add_lab("Hemoglobin", "11.2", "g/dL", draw_hour=6)
+        self.add_lab("Hemoglobin", "1234567", "g/dL", draw_hour=7)
+        self.add_lab("HGB", "99999.9999", "g/L", draw_hour=8)
+
+        call_command("refresh_hemoglobin_labs", stdout=StringIO())
+
+        self.assertEqual(
+            list(HEMOGLOBIN_LAB.objects.order_by("LAB_DRAW_DTM").values_list("VALUE", flat=True)),
+            [Decimal("11.2"), Decimal("10000")],
+        )
@@ -0,0 +1,45 @@
+import re
+
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+
+from api.management.commands.index_advisor import ADVISED_QUERIES, INDEXED_MODELS, explain_findings
+from api.views.sql_queries import hemoglobin_lab_insert_query
+
+
+class ExplainFindingsTests(SimpleTestCase):
+    def test_full_scans_and_filesorts_are_reported(self):
+        plan = [
+            {"table": "SURG", "type": "ALL", "rows": 1200, "Extra": "Using temporary; Using filesort"},
+            {"table": "BLNG", "type": "ref", "rows": 4, "Extra": "Using where"},
+            {"table": "TRNSF", "type": "ALL", "rows": 9000, "r_rows": 8123.0, "Extra": None},
+        ]
+
+        self.assertEqual(explain_findings(plan), [
+            "full scan of SURG (~1200 rows)",
+            "filesort on SURG",
+            "temporary table for SURG",
+            "full scan of TRNSF (~8123.0 rows)",
+        ])
+
+
+class AdvisedIndexTests(SimpleTestCase):
+    def test_indexed_columns_are_compared_as_stored(self):
+        editor = connection.schema_editor()
+        statements = [str(index.create_sql(model, editor)) for model in INDEXED_MODELS for index in model._meta.indexes]
+        # The advised queries, and the extraction reading VISIT_LABS
+        sql = "\n".join([query for query, _ in ADVISED_QUERIES.values()] + [hemoglobin_lab_insert_query])
+
+        for statement in statements:
+            columns = re.search(r"\((.*)\)", statement).group(1)
+            for column in re.findall(r"\w+", columns):
+                self.assertRegex(sql, rf"\b{column}\b", statement)
+                # A column wrapped in a CAST can't be looked up through the index
+                self.assertNotRegex(sql, rf"CAST\((\w+\.)?{column}\b", statement)
+
+
+class IndexAdvisorCommandTests(TestCase):
+    def test_requires_mariadb(self):
+        with self.assertRaises(CommandError):
+            call_command("index_advisor")
@@ -0,0 +1,93 @@
+import os
+from io import StringIO
+from tempfile import TemporaryDirectory
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TransactionTestCase
+
+from api.models import EXTRAOP_MEDS, INTRAOP_MEDS, MEDICATION_CLASS, VISIT_MEDICATION
+from api.views.utils.medication_classes import classify_medication, load_medication_rules
+
+
+class MedicationRulesTests(SimpleTestCase):
+    def test_names_are_matched_case_insensitively(self):
+        rules = load_medication_rules()
+
+        self.assertEqual(
+            classify_medication(["TRANEXAMIC ACID 1000 MG/10ML IV SOLN"], rules),
+            {"TXA": True, "AMICAR": False, "B12": False, "IRON": False},
+        )
+        self.assertEqual(
+            classify_medication(["Ferrous Sulfate 325 MG", "cyanocobalamin", None], rules),
+            {"TXA": False, "AMICAR": False, "B12": True, "IRON": True},
+        )
+
+    def test_unknown_classes_are_rejected(self):
+        with TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "medication_classes.csv")
+            with open(path, "w") as file:
+                file.write("class,pattern\nASPIRIN,aspirin\n")
+
+            with self.assertRaises(ValueError):
+                load_medication_rules(path)
+
+
+class ClassifyMedicationsTests(TransactionTestCase):
+    def setUp(self):
+        # The medication tables are unmanaged, create bare copies of the columns the command reads
+        with connection.cursor() as cursor:
+            for model in [INTRAOP_MEDS, EXTRAOP_MEDS]:
+                cursor.execute(
+                    f"CREATE TABLE {model._meta.db_table} (VISIT_NO bigint, MEDICATION_ID decimal, MEDICATION_NAME varchar(510))"
+                )
+
+    def tearDown(self):
+        with connection.cursor() as cursor:
+            for model in [INTRAOP_MEDS, EXTRAOP_MEDS]:
+                cursor.execute(f"DROP TABLE {model._meta.db_table}")
+
+    def add_meds(self, model, rows):
+        with connection.cursor() as cursor:
+            cursor.executemany(f"INSERT INTO {model._meta.db_table} VALUES (%s, %s, %s)", rows)
+
+    def test_new_medications_are_classified_and_rolled_up(self):
+        self.add_meds(INTRAOP_MEDS, [(10, 1, "tranexamic acid"), (10, 1, "tranexamic acid"), (10, 2, "propofol")])
+        self.add_meds(EXTRAOP_MEDS, [(10, 1, "tranexamic acid"), (20, 3, "ferric gluconate")])
+        call_command("classify_medications", stdout=StringIO())
+
+        # Already classified ids keep their class, only the new id is classified
+        MEDICATION_CLASS.objects.filter(MEDICATION_ID=2).update(AMICAR=True)
+        self.add_meds(EXTRAOP_MEDS, [(20, 4, "aminocaproic acid")])
+        call_command("classify_medications", stdout=StringIO())
+
+        self.assertEqual(
+            sorted(MEDICATION_CLASS.objects.filter(AMICAR=True).values_list("MEDICATION_ID", flat=True)),
+            [2, 4],
+        )
+        self.assertEqual(
+            list(VISIT_MEDICATION.objects.order_by("VISIT_NO").values_list("VISIT_NO", "TXA", "AMICAR", "B12", "IRON")),
+            [(10, 2, 1, 0, 0), (20, 0, 1, 0, 1)],
+        )
+
+        call_command("classify_medications", "--reclassify", stdout=StringIO())
+        self.assertEqual(VISIT_MEDICATION.objects.get(VISIT_NO=10).AMICAR, 0)
+
+    def test_renamed_and_unidentified_medications_are_classified_by_name(self):
+        self.add_meds(INTRAOP_MEDS, [(10, 1, "normal saline")])
+        call_command("classify_medications", stdout=StringIO())
+
+        # Id 1 is reused for tranexamic acid, and iron is charted without an id
+        self.add_meds(INTRAOP_MEDS, [(20, 1, "tranexamic acid"), (20, None, "iron sucrose"), (30, 5, None)])
+        out = StringIO()
+        call_command("classify_medications", stdout=out)
+
+        self.assertEqual(
+            list(VISIT_MEDICATION.objects.order_by("VISIT_NO").values_list("VISIT_NO", "TXA", "AMICAR", "B12", "IRON")),
+            [(10, 0, 0, 0, 0), (20, 1, 0, 0, 1), (30, 0, 0, 0, 0)],
+        )
+        self.assertIn("1 charted medications have no name", out.getvalue())
+
+        # Pairs without an id are not classified again
+        call_command("classify_medications", stdout=StringIO())
+        self.assertEqual(MEDICATION_CLASS.objects.count(), 3)
@@ -0,0 +1,117 @@
+import os
+from tempfile import TemporaryDirectory
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from api.views.utils import metrics
+
+from api.tests.test_surgeries import make_case
+from api.views.utils.data_version import clear_data_version
+from api.views.utils.metrics import (
+    BUCKETS,
+    load_snapshots,
+    record_response,
+    render_prometheus,
+    reset_metrics,
+    schedule_flush,
+)
+
+
+def snapshot(pid, count, seconds, rows):
+    buckets = [0] * len(BUCKETS)
+    buckets[BUCKETS.index(0.1)] = count
+    return {
+        "pid": pid,
+        "queries": [{"view": "aggregate", "query": "aggregate", "count": count, "sum": seconds,
+                     "buckets": buckets, "rows": rows}],
+        "responses": [],
+        "query_cache": {"aggregate": {"hits": 1, "misses": count}},
+        "db_pool": {"default": {"connects": 1, "connect_seconds": 0.5, "checkouts": 4, "reused": 3,
+                                "wait_seconds": 0.0, "timeouts": 0, "open": 2, "idle": 1}},
+    }
+
+
+class RenderPrometheusTests(SimpleTestCase):
+    def test_workers_are_summed(self):
+        text = render_prometheus([snapshot(os.getpid(), 2, 0.15, 10), snapshot(2 ** 22 + 1, 3, 0.2, 5)])
+        labels = 'view="aggregate",query="aggregate"'
+
+        self.assertIn(f'sanguine_query_duration_seconds_bucket{{{labels},le="0.05"}} 0', text)
+        self.assertIn(f'sanguine_query_duration_seconds_bucket{{{labels},le="0.1"}} 5', text)
+        self.assertIn(f'sanguine_query_duration_seconds_bucket{{{labels},le="+Inf"}} 5', text)
+        self.assertIn(f"sanguine_query_duration_seconds_count{{{labels}}} 5", text)
+        self.assertIn(f"sanguine_query_rows_total{{{labels}}} 15", text)
+        self.assertIn('sanguine_query_cache_total{query="aggregate",outcome="misses"} 5', text)
+        self.assertIn('sanguine_db_pool_total{alias="default",stat="checkouts"} 8', text)
+        # The second worker is gone, so only the first one's connections are still open
+        self.assertIn('sanguine_db_pool_connections{alias="default",state="open"} 2', text)
+
+    def test_label_values_are_escaped(self):
+        text = render_prometheus([dict(snapshot(os.getpid(), 1, 0.1, 1), query_cache={'a"b\\c': {"hits": 1}})])
+        self.assertIn('sanguine_query_cache_total{query="a\\"b\\\\c",outcome="hits"} 1', text)
+
+
+class MetricsEndpointTests(TestCase):
+    def setUp(self):
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(METRICS_DIR=directory.name))
+        reset_metrics()
+        self.addCleanup(reset_metrics)
+        clear_data_version()
+        self.client.force_login(get_user_model().objects.create_user(username="alice", password="secret"))
+
+    def test_queries_and_responses_are_reported_by_view(self):
+        make_case(1)
+        make_case(2)
+        b"".join(self.client.get("/api/get_sanguine_surgery_cases").streaming_content)
+        self.client.get("/api/aggregate", {"group_by": "SURGEON_PROV_ID", "measure": "sum:PRBC_UNITS"})
+
+        response = self.client.get("/api/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        text = response.content.decode()
+        self.assertIn('sanguine_query_rows_total{view="get_sanguine_surgery_cases",query="case_list"} 2', text)
+        self.assertIn('sanguine_query_rows_total{view="aggregate",query="case_aggregate"} 2', text)
+        self.assertIn('sanguine_request_duration_seconds_count{view="get_sanguine_surgery_cases",status="200"} 1', text)
+        self.assertRegex(text, r'sanguine_response_bytes_total\{view="get_sanguine_surgery_cases",status="200"\} [1-9]')
+
+    def test_remote_collectors_are_refused(self):
+        response = self.client.get("/api/metrics", REMOTE_ADDR="10.0.0.5")
+        self.assertEqual(response.status_code, 403)
+
+
+class MetricsFileTests(SimpleTestCase):
+    def setUp(self):
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.metrics_dir = os.path.join(directory.name, "metrics")
+        self.enterContext(override_settings(METRICS_DIR=self.metrics_dir))
+        reset_metrics()
+        self.addCleanup(reset_metrics)
+
+    def test_flushes_are_batched_on_a_background_thread(self):
+        record_response("aggregate", 200, 0.1, 10)
+        schedule_flush()
+        timer = metrics._pending["timer"]
+        record_response("aggregate", 200, 0.1, 10)
+        schedule_flush()
+
+        # One pending write for both responses, none made on the request path
+        self.assertIs(metrics._pending["timer"], timer)
+        self.assertFalse(os.path.exists(self.metrics_dir))
+        timer.join()
+        self.assertEqual(os.stat(self.metrics_dir).st_mode & 0o777, 0o700)
+        (data,) = load_snapshots()
+        self.assertEqual(data["responses"][0]["count"], 2)
+
+    def test_files_of_exited_workers_are_removed(self):
+        os.makedirs(self.metrics_dir)
+        exited = os.path.join(self.metrics_dir, f"{2 ** 22 + 1}.json")
+        with open(exited, "w") as file:
+            file.write("{}")
+
+        self.assertEqual(load_snapshots(), [])
+        self.assertFalse(os.path.exists(exited))
@@ -0,0 +1,286 @@
+import os
+import pickle
+import threading
+import time
+from io import StringIO
+from tempfile import TemporaryDirectory
+from unittest.mock import Mock, patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from api.views.sql_queries import procedure_count_query
+from api.views.utils.data_version import clear_data_version, get_data_version
+from api.views.utils.query_cache import (
+    CacheEntry,
+    DjangoCacheBackend,
+    FileBackend,
+    MemoryBackend,
+    cache_key,
+    cached_call,
+    cached_query,
+    get_query_cache,
+    host_lock,
+    query_cache_stats,
+    reset_query_cache,
+)
+
+
+def entry(value, version="v1"):
+    return CacheEntry(version, time.time(), pickle.dumps(value))
+
+
+class BackendTests(SimpleTestCase):
+    def test_memory_backend_evicts_least_recently_used_beyond_budget(self):
+        first, second, third = entry("a" * 100), entry("b" * 100), entry("c" * 100)
+        backend = MemoryBackend(max_bytes=len(first.payload) * 2)
+
+        backend.set("first", first, 60)
+        backend.set("second", second, 60)
+        backend.get("first")
+        backend.set("third", third, 60)
+
+        self.assertIs(backend.get("first"), first)
+        self.assertIsNone(backend.get("second"))
+        self.assertIs(backend.get("third"), third)
+
+    def test_memory_backend_expires_entries(self):
+        backend = MemoryBackend(max_bytes=10_000)
+        backend.set("key", entry([1]), 0)
+        self.assertIsNone(backend.get("key"))
+
+    def test_file_backend_round_trips_and_clears(self):
+        with TemporaryDirectory() as directory:
+            backend = FileBackend(directory)
+            backend.set("key", entry([{"CASE_ID": 1}]), 60)
+
+            self.assertEqual(FileBackend(directory).get("key").load(), [{"CASE_ID": 1}])
+
+            backend.clear()
+            self.assertIsNone(backend.get("key"))
+
+    def test_file_backend_directory_is_private(self):
+        with TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cache")
+            os.makedirs(path, mode=0o777)
+            os.chmod(path, 0o777)
+
+            FileBackend(path).set("key", entry([1]), 60)
+
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o700)
+
+    def test_django_backend_clears_only_its_own_keys(self):
+        backend = DjangoCacheBackend("default")
+        backend.cache.set("session:abc", "logged in")
+        backend.set("key", entry([1]), 60)
+
+        backend.clear()
+
+        self.assertIsNone(backend.get("key"))
+        self.assertEqual(backend.cache.get("session:abc"), "logged in")
+        backend.set("key", entry([2]), 60)
+        self.assertEqual(backend.get("key").load(), [2])
+
+    def test_keys_ignore_sql_whitespace(self):
+        self.assertEqual(
+            cache_key("SELECT *\n    FROM CASES WHERE ID = %(id)s", {"id": 1}),
+            cache_key("SELECT * FROM CASES WHERE ID = %(id)s", {"id": 1}),
+        )
+        self.assertNotEqual(cache_key("SELECT 1", {"id": 1}), cache_key("SELECT 1", {"id": 2}))
+
+
+@override_settings(QUERY_CACHE="memory", QUERY_CACHE_TTL=60, QUERY_CACHE_TTLS={"uncached": 0}, DATA_VERSION_TTL=0)
+class CachedQueryTests(TestCase):
+    def setUp(self):
+        # Each test gets its own handoff directory, memory backend results are published there
+        self.enterContext(self.settings(QUERY_CACHE_DIR=self.enterContext(TemporaryDirectory())))
+        reset_query_cache()
+        clear_data_version()
+        self.addCleanup(reset_query_cache)
+
+    def test_results_are_reused_until_invalidated(self):
+        execute = Mock(side_effect=lambda: [{"CASE_ID": 1}])
+
+        first = cached_query("cases", "SELECT 1", {}, execute)
+        first.append({"CASE_ID": 2})
+        second = cached_query("cases", "SELECT 1", {}, execute)
+
+        self.assertEqual(second, [{"CASE_ID": 1}])
+        self.assertEqual(execute.call_count, 1)
+
+        call_command("invalidate_query_cache", stdout=StringIO())
+        cached_query("cases", "SELECT 1", {}, execute)
+
+        self.assertEqual(execute.call_count, 2)
+        self.assertEqual(query_cache_stats()["cases"], {"hits": 1, "misses": 2, "coalesced": 0, "stale": 0})
+
+    def test_ttl_is_per_query(self):
+        execute = Mock(return_value=[])
+
+        cached_query("uncached", "SELECT 1", {}, execute)
+        cached_query("uncached", "SELECT 1", {}, execute)
+        cached_query(None, "SELECT 1", {}, execute)
+
+        self.assertEqual(execute.call_count, 3)
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+@override_settings(QUERY_CACHE="memory", QUERY_CACHE_TTL=60, QUERY_CACHE_MAX_STALE=60, DATA_VERSION_TTL=0)
+class StaleWhileRevalidateTests(TestCase):
+    def setUp(self):
+        # Each test gets its own handoff directory, memory backend results are published there
+        self.enterContext(self.settings(QUERY_CACHE_DIR=self.enterContext(TemporaryDirectory())))
+        reset_query_cache()
+        clear_data_version()
+        self.addCleanup(reset_query_cache)
+
+    def store(self, key, value, age):
+        old = CacheEntry(get_data_version().token, time.time() - age, pickle.dumps(value))
+        get_query_cache().set(key, old, 600)
+        return old
+
+    def test_expired_entry_is_served_while_refreshing(self):
+        old = self.store("key", "old", age=90)
+        execute = Mock(return_value="new")
+
+        value, stale = cached_call("counts", "key", execute, serve_stale=True)
+
+        self.assertEqual(value, "old")
+        self.assertIs(stale, old)
+        wait_for(lambda: get_query_cache().get("key") is not old)
+        self.assertEqual(cached_call("counts", "key", execute, serve_stale=True), ("new", None))
+        self.assertEqual(execute.call_count, 1)
+        self.assertEqual(query_cache_stats()["counts"]["stale"], 1)
+
+    def test_requests_block_past_max_staleness(self):
+        self.store("key", "old", age=150)
+        execute = Mock(return_value="new")
+
+        self.assertEqual(cached_call("counts", "key", execute, serve_stale=True), ("new", None))
+        self.assertEqual(cached_call("other", "key2", execute), ("new", None))
+        self.assertEqual(execute.call_count, 2)
+
+    def test_procedure_counts_are_marked_stale(self):
+        self.client.force_login(get_user_model().objects.create_user(username="alice", password="secret"))
+        old = self.store(cache_key(procedure_count_query, {}), [{"name": "CABG", "count": 3}], age=90)
+
+        with patch("api.views.surgeries.execute_sql", return_value=([], [])) as execute:
+            response = self.client.get("/api/get_procedure_counts")
+            wait_for(lambda: execute.called and get_query_cache().get(cache_key(procedure_count_query, {})) is not old)
+
+        self.assertEqual(response.json()["result"], [{"name": "CABG", "count": 3}])
+        self.assertEqual(response["X-Data-Stale"], "true")
+        self.assertEqual(response["ETag"], f'"{old.version}"')
+
+        fresh = self.client.get("/api/get_procedure_counts")
+        self.assertNotIn("X-Data-Stale", fresh)
+        self.assertEqual(fresh.json()["result"], [])
+
+
+@override_settings(QUERY_CACHE="memory", QUERY_CACHE_TTL=60, DATA_VERSION_TTL=0)
+class HandoffTests(TestCase):
+    def setUp(self):
+        self.enterContext(self.settings(QUERY_CACHE_DIR=self.enterContext(TemporaryDirectory())))
+        reset_query_cache()
+        clear_data_version()
+        self.addCleanup(reset_query_cache)
+
+    def test_memory_backend_workers_share_one_execution(self):
+        first = Mock(return_value=[{"CASE_ID": 1}])
+        self.assertEqual(cached_query("cases", "SELECT 1", {}, first), [{"CASE_ID": 1}])
+
+        # Another worker starts with an empty cache and finds the leader's published result
+        reset_query_cache()
+        second = Mock(return_value=[{"CASE_ID": 2}])
+        self.assertEqual(cached_query("cases", "SELECT 1", {}, second), [{"CASE_ID": 1}])
+        self.assertEqual(cached_query("cases", "SELECT 1", {}, second), [{"CASE_ID": 1}])
+
+        second.assert_not_called()
+        self.assertEqual(first.call_count, 1)
+        self.assertEqual(query_cache_stats()["cases"], {"hits": 1, "misses": 1, "coalesced": 0, "stale": 0})
+
+
+@override_settings(QUERY_CACHE="none")
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        reset_query_cache()
+        self.addCleanup(reset_query_cache)
+
+    def test_concurrent_identical_queries_share_one_execution(self):
+        release = threading.Event()
+        calls = []
+
+        def execute():
+            calls.append(1)
+            release.wait(5)
+            return [{"CASE_ID": 1}]
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(cached_query("cases", "SELECT 1", {}, execute)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        # Let the leader start executing and the others queue up behind it
+        while not calls:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [[{"CASE_ID": 1}]] * 5)
+        self.assertIsNot(results[0], results[1])
+        self.assertEqual(query_cache_stats()["cases"], {"hits": 0, "misses": 1, "coalesced": 4, "stale": 0})
+
+    def test_failures_propagate(self):
+        def execute():
+            raise RuntimeError("database went away")
+
+        with self.assertRaises(RuntimeError):
+            cached_query("cases", "SELECT 1", {}, execute)
+
+    def test_host_lock_is_exclusive_and_times_out(self):
+        with TemporaryDirectory() as directory, self.settings(QUERY_CACHE_DIR=directory):
+            with host_lock("key", timeout=1) as acquired:
+                self.assertTrue(acquired)
+                with host_lock("key", timeout=0.1) as contended:
+                    self.assertFalse(contended)
+                with host_lock("other", timeout=0.1) as independent:
+                    self.assertTrue(independent)
+            # Lock files are removed on release rather than left behind for every key
+            self.assertEqual(os.listdir(os.path.join(directory, "locks")), [])
+
+    def test_host_lock_waiters_relock_a_removed_file(self):
+        with TemporaryDirectory() as directory, self.settings(QUERY_CACHE_DIR=directory):
+            waiting = threading.Event()
+            released = threading.Event()
+            outcome = {}
+
+            def waiter():
+                waiting.set()
+                with host_lock("key", timeout=5) as acquired:
+                    # The leader's file is gone, this lock has to be on a file still at the path
+                    with host_lock("key", timeout=0.1) as contended:
+                        outcome.update(acquired=acquired, contended=contended)
+                released.wait(5)
+
+            with host_lock("key", timeout=1):
+                thread = threading.Thread(target=waiter)
+                thread.start()
+                waiting.wait(5)
+                time.sleep(0.1)
+            released.set()
+            thread.join()
+
+            self.assertEqual(outcome, {"acquired": True, "contended": False})
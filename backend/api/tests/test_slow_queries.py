@@ -0,0 +1,117 @@
+import os
+import time
+from datetime import date
+from io import StringIO
+from tempfile import TemporaryDirectory
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from api.tests.test_surgeries import make_case
+from api.views.utils.slow_queries import append_entry, read_entries, redact_binds
+from api.views.utils import metrics
+from api.views.utils.utils import execute_sql_dict, execute_sql_stream
+
+
+class SlowQueryLogTestMixin:
+    def setUp(self):
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "slow.jsonl")
+        self.enterContext(override_settings(SLOW_QUERY_LOG=self.path))
+
+
+class SlowQueryLogTests(SlowQueryLogTestMixin, TestCase):
+    def test_redaction_keeps_only_non_patient_values(self):
+        self.assertEqual(
+            redact_binds({"id": 1234, "date_from": date(2024, 1, 1), "procedure0": "CABG", "limit": 51, "after_id": None}),
+            {"id": "<int>", "date_from": "<date>", "procedure0": "CABG", "limit": 51, "after_id": None},
+        )
+
+    @override_settings(SLOW_QUERY_SECONDS=1e-9)
+    def test_slow_queries_are_logged_with_their_plan(self):
+        make_case(1)
+
+        rows = execute_sql_dict("SELECT CASE_ID FROM SURGERY_CASE_SUMMARY WHERE MRN = %(mrn)s", mrn=100)
+
+        self.assertEqual(rows, [{"CASE_ID": 1}])
+        [entry] = read_entries(self.path, 0)
+        self.assertEqual(entry["query"], "sql")
+        self.assertEqual(entry["view"], "background")
+        self.assertEqual(entry["rows"], 1)
+        self.assertEqual(entry["binds"], {"mrn": "<int>"})
+        self.assertTrue(entry["plan"])
+
+    @override_settings(SLOW_QUERY_SECONDS=1e-9)
+    def test_dashboard_queries_are_logged_by_template(self):
+        make_case(1)
+        self.client.force_login(get_user_model().objects.create_user(username="alice", password="secret"))
+
+        b"".join(self.client.get("/api/get_sanguine_surgery_cases", {"procedure": "CABG"}).streaming_content)
+        self.client.get("/api/aggregate", {"group_by": "SURGEON_PROV_ID", "measure": "sum:PRBC_UNITS"})
+
+        self.assertEqual(
+            [(entry["query"], entry["view"]) for entry in read_entries(self.path, 0)],
+            [("case_list", "get_sanguine_surgery_cases"), ("case_aggregate", "aggregate")],
+        )
+
+    @override_settings(SLOW_QUERY_SECONDS=0.2)
+    def test_slow_stream_readers_do_not_make_a_query_slow(self):
+        make_case(1)
+        make_case(2)
+        metrics.reset_metrics()
+        self.addCleanup(metrics.reset_metrics)
+
+        for _ in execute_sql_stream("SELECT CASE_ID FROM SURGERY_CASE_SUMMARY", batch_size=1, template="case_list"):
+            time.sleep(0.15)
+
+        self.assertFalse(os.path.exists(self.path))
+        [query] = metrics.snapshot()["queries"]
+        [stream] = metrics.snapshot()["streams"]
+        self.assertEqual(query["rows"], 2)
+        self.assertLess(query["sum"], 0.2)
+        self.assertGreater(stream["sum"], 0.2)
+
+    @override_settings(SLOW_QUERY_SECONDS=0)
+    def test_threshold_zero_disables_the_log(self):
+        execute_sql_dict("SELECT 1 AS ONE")
+        self.assertFalse(os.path.exists(self.path))
+
+
+class SlowQueryFileTests(SlowQueryLogTestMixin, SimpleTestCase):
+    def entry(self, query, seconds, time="2026-01-01T00:00:00+00:00"):
+        return {"time": time, "query": query, "view": "aggregate", "seconds": seconds, "rows": 1,
+                "binds": {}, "plan": [{"table": "SURGERY_CASE_SUMMARY", "type": "ALL", "rows": 900}]}
+
+    def test_log_directory_is_private(self):
+        path = os.path.join(os.path.dirname(self.path), "logs", "slow.jsonl")
+        with override_settings(SLOW_QUERY_LOG=path):
+            append_entry(self.entry("aggregate", 3))
+
+        self.assertEqual(os.stat(os.path.dirname(path)).st_mode & 0o777, 0o700)
+
+    @override_settings(SLOW_QUERY_LOG_BYTES=400, SLOW_QUERY_LOG_BACKUPS=2)
+    def test_log_rotates_and_keeps_backups(self):
+        for i in range(8):
+            append_entry(self.entry("aggregate", i))
+
+        self.assertTrue(os.path.exists(f"{self.path}.2"))
+        self.assertFalse(os.path.exists(f"{self.path}.3"))
+        seconds = [entry["seconds"] for entry in read_entries(self.path, 2)]
+        self.assertEqual(seconds, sorted(seconds))
+        self.assertEqual(seconds[-1], 7)
+
+    def test_report_groups_by_template(self):
+        for seconds in [1, 2, 3, 4]:
+            append_entry(self.entry("procedure_count_query", seconds))
+        append_entry(self.entry("surgery_query", 9))
+        append_entry(self.entry("surgery_query", 9, time="2000-01-01T00:00:00+00:00"))
+
+        out = StringIO()
+        call_command("slow_queries", "--plans", "--since", "100000", stdout=out)
+
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[1].split(), ["surgery_query", "1", "9.000", "9.000", "9.000"])
+        self.assertEqual(lines[2].split(), ["procedure_count_query", "4", "2.500", "3.850", "4.000"])
+        self.assertIn("full scan of SURGERY_CASE_SUMMARY (~900 rows)", out.getvalue())
@@ -1,9 +1,18 @@
 import json
+import zlib
+from io import StringIO
+from unittest import mock
 
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
-from api.models import State, StateAccess
+from api.models import State, StateAccess, StateBlob, StateVersion
+from api.views.utils import state_access
+from api.views.utils.state_access import can_read, can_write, get_roles, reset_state_access
+from api.views.utils.state_blobs import load_definition
 
 
 class StateEndpointTests(TestCase):
@@ -57,7 +66,7 @@ class StateEndpointTests(TestCase):
 
         self.assertEqual(response.status_code, 200)
         state = State.objects.get(name="Shared State")
-        self.assertEqual(state.definition, "after")
+        self.assertEqual(load_definition(state), "after")
         self.assertTrue(state.public)
 
     def test_update_state_applies_explicit_public_flag(self):
@@ -84,6 +93,22 @@ class StateEndpointTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTrue(State.objects.get(name="Private State").public)
 
+    def test_update_state_without_definition_keeps_the_current_version(self):
+        self.client.post("/api/state", {"name": "Draft", "definition": "before"})
+
+        response = self.client.put(
+            "/api/state",
+            data=json.dumps({"old_name": "Draft", "new_name": "Final", "new_public": True}),
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        state = State.objects.get(name="Final")
+        self.assertTrue(state.public)
+        self.assertEqual(state.version, 1)
+        self.assertEqual(load_definition(state), "before")
+        self.assertEqual(StateVersion.objects.filter(state=state).count(), 1)
+
     def test_share_state_returns_created_for_new_share(self):
         State.objects.create(
             name="Owner State",
@@ -109,3 +134,357 @@ class StateEndpointTests(TestCase):
                 role="RE",
             ).exists()
         )
+
+
+class StateListTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="alice", password="secret")
+        self.client.force_login(self.user)
+        State.objects.create(name="Mine", definition="x" * 50, owner="alice")
+        State.objects.create(name="Public", definition="y", owner="carol", public=True)
+        shared = State.objects.create(name="Shared", definition="zz", owner="carol")
+        StateAccess.objects.create(state=shared, user="alice", role="WR")
+        State.objects.create(name="Hidden", definition="secret", owner="carol")
+
+    def test_names_are_listed_in_one_query_without_definitions(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/state")
+
+        self.assertEqual(response.json(), ["Mine", "Public", "Shared"])
+        state_queries = [query["sql"] for query in queries if "api_state" in query["sql"]]
+        self.assertEqual(len(state_queries), 1)
+        self.assertNotIn("definition", state_queries[0])
+
+    def test_metadata_is_paged_by_name(self):
+        with CaptureQueriesContext(connection) as queries:
+            first = self.client.get("/api/state", {"limit": 2}).json()
+
+        self.assertEqual(
+            [(row["name"], row["owner"], row["role"], row["definition_size"]) for row in first["result"]],
+            [("Mine", "alice", "owner", 50), ("Public", "carol", "public", 1)],
+        )
+        self.assertIsNotNone(first["result"][0]["updated_at"])
+        self.assertEqual(first["next_cursor"], "Public")
+        state_queries = [query["sql"] for query in queries if "api_state" in query["sql"]]
+        self.assertEqual(len(state_queries), 1)
+
+        second = self.client.get("/api/state", {"limit": 2, "after": first["next_cursor"]}).json()
+        self.assertEqual([(row["name"], row["role"]) for row in second["result"]], [("Shared", "WR")])
+        self.assertIsNone(second["next_cursor"])
+
+    def test_invalid_page_size_is_rejected(self):
+        self.assertEqual(self.client.get("/api/state", {"limit": "lots"}).status_code, 400)
+
+
+class StateBlobTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="alice", password="secret")
+        self.client.force_login(self.user)
+
+    def create(self, name, definition):
+        response = self.client.post("/api/state", {"name": name, "definition": definition})
+        self.assertEqual(response.status_code, 201)
+
+    def delete(self, name):
+        response = self.client.delete("/api/state", json.dumps({"name": name}), content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+
+    def test_a_failed_delete_keeps_the_access_rows(self):
+        self.create("Shared", "d")
+        StateAccess.objects.create(state=State.objects.get(name="Shared"), user="bob", role="RE")
+
+        with mock.patch("api.views.state.delete_state", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.delete("/api/state", json.dumps({"name": "Shared"}), content_type="application/json")
+
+        self.assertTrue(StateAccess.objects.filter(state__name="Shared", user="bob").exists())
+
+    def test_identical_definitions_are_stored_once(self):
+        definition = json.dumps({"charts": ["PRBC_UNITS"] * 100})
+        self.create("First", definition)
+        self.create("Second", definition)
+
+        # One reference from each state and one from each state's first version
+        blob = StateBlob.objects.get()
+        self.assertEqual(blob.refcount, 4)
+        self.assertLess(len(blob.data), len(definition))
+        self.assertEqual(State.objects.get(name="First").definition, "")
+
+        self.delete("First")
+        self.assertEqual(StateBlob.objects.get().refcount, 2)
+        self.delete("Second")
+        self.assertFalse(StateBlob.objects.exists())
+
+    def test_updates_release_the_previous_definition(self):
+        self.create("Mine", "before")
+        self.client.put(
+            "/api/state",
+            json.dumps({"old_name": "Mine", "new_name": "Mine", "new_definition": "after"}),
+            content_type="application/json",
+        )
+
+        # The state's reference moved, version 1 still holds the previous definition
+        refcounts = {blob.size: blob.refcount for blob in StateBlob.objects.all()}
+        self.assertEqual(refcounts, {len("before"): 1, len("after"): 2})
+        self.assertEqual(self.client.get("/api/state", {"name": "Mine"}).json()["definition"], "after")
+
+    def test_stored_compression_is_passed_through(self):
+        definition = '{"filters": "\u00e9 \"quoted\"", "charts": [1, 2, 3]}'
+        self.create("Mine", definition)
+
+        plain = self.client.get("/api/state", {"name": "Mine"})
+        deflated = self.client.get("/api/state", {"name": "Mine"}, HTTP_ACCEPT_ENCODING="gzip, deflate, br")
+
+        self.assertNotIn("Content-Encoding", plain)
+        self.assertEqual(deflated["Content-Encoding"], "deflate")
+        self.assertIn("Accept-Encoding", deflated["Vary"])
+        self.assertEqual(json.loads(zlib.decompress(deflated.content)), plain.json())
+        self.assertEqual(plain.json()["definition"], definition)
+
+    def test_deflate_refused_with_a_zero_q_value_is_not_sent(self):
+        self.create("Mine", "definition")
+
+        for accept_encoding in ["gzip, deflate;q=0", "deflate; q=0.0, *", "*;q=0", "gzip"]:
+            response = self.client.get("/api/state", {"name": "Mine"}, HTTP_ACCEPT_ENCODING=accept_encoding)
+            self.assertNotIn("Content-Encoding", response)
+            self.assertEqual(response.json()["definition"], "definition")
+        for accept_encoding in ["deflate;q=0.5", "br, *"]:
+            response = self.client.get("/api/state", {"name": "Mine"}, HTTP_ACCEPT_ENCODING=accept_encoding)
+            self.assertEqual(response["Content-Encoding"], "deflate")
+
+    def test_legacy_definitions_are_migrated_in_batches(self):
+        for i in range(5):
+            State.objects.create(name=f"Legacy {i}", definition=f"definition {i % 2}", owner="alice")
+        self.assertEqual(self.client.get("/api/state", {"name": "Legacy 3"}).json()["definition"], "definition 1")
+
+        call_command("migrate_state_blobs", "--batch-size", "2", stdout=StringIO())
+
+        self.assertFalse(State.objects.filter(blob__isnull=True).exists())
+        self.assertEqual(sorted(StateBlob.objects.values_list("refcount", flat=True)), [2, 3])
+        self.assertEqual(self.client.get("/api/state", {"name": "Legacy 3"}).json()["definition"], "definition 1")
+        listed = self.client.get("/api/state", {"metadata": "true"}).json()["result"]
+        self.assertEqual(listed[0]["definition_size"], len("definition 0"))
+
+
+class StateVersionTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="alice", password="secret")
+        self.client.force_login(self.user)
+        self.client.post("/api/state", {"name": "Mine", "definition": "a" * 100})
+
+    def patch(self, base_version, delta, name="Mine"):
+        return self.client.patch(
+            "/api/state",
+            json.dumps({"name": name, "base_version": base_version, "delta": delta}),
+            content_type="application/json",
+        )
+
+    def get(self, **params):
+        return self.client.get("/api/state", {"name": "Mine", **params})
+
+    def test_patch_stores_only_the_delta(self):
+        response = self.patch(1, [[0, 1, "b"], [99, 100, "cc"]])
+
+        self.assertEqual(response.json(), {"version": 2})
+        self.assertEqual(StateBlob.objects.count(), 1)
+        self.assertEqual(StateVersion.objects.get(version=2).delta, json.dumps([[0, 1, "b"], [99, 100, "cc"]]))
+        state = self.get().json()
+        self.assertEqual(state["version"], 2)
+        self.assertEqual(state["definition"], "b" + "a" * 98 + "cc")
+        self.assertEqual(self.get(version=1).json()["definition"], "a" * 100)
+
+    def test_stale_base_version_conflicts(self):
+        self.assertEqual(self.patch(1, [[0, 1, "b"]]).status_code, 200)
+
+        conflict = self.patch(1, [[0, 1, "c"]])
+
+        self.assertEqual(conflict.status_code, 409)
+        self.assertEqual(conflict.json()["version"], 2)
+        self.assertEqual(self.get().json()["definition"][0], "b")
+        stale_put = self.client.put(
+            "/api/state",
+            json.dumps({"old_name": "Mine", "new_name": "Mine", "new_definition": "x", "base_version": 1}),
+            content_type="application/json",
+        )
+        self.assertEqual(stale_put.status_code, 409)
+
+    def test_invalid_deltas_are_rejected(self):
+        self.assertEqual(self.patch(1, [[5, 6, "b"], [0, 1, "c"]]).status_code, 400)
+        self.assertEqual(self.patch(1, [[100, 101, "b"]]).status_code, 400)
+        self.assertEqual(self.patch(1, "a").status_code, 400)
+        self.assertEqual(self.patch(1, [[0, 1, "b"]], name="Missing").status_code, 404)
+        self.assertEqual(StateVersion.objects.count(), 1)
+
+    def test_readers_cannot_patch(self):
+        bob = get_user_model().objects.create_user(username="bob", password="secret")
+        StateAccess.objects.create(state=State.objects.get(name="Mine"), user="bob", role="RE")
+        self.client.force_login(bob)
+
+        self.assertEqual(self.patch(1, [[0, 1, "b"]]).status_code, 403)
+
+    @override_settings(STATE_SNAPSHOT_INTERVAL=3, STATE_SNAPSHOTS_KEPT=2)
+    def test_snapshots_are_taken_periodically_and_old_history_pruned(self):
+        for version in range(1, 8):
+            self.assertEqual(self.patch(version, [[version - 1, version, "b"]]).status_code, 200)
+
+        # Snapshots at 1, 4 and 7; versions before the second latest are pruned with their blob
+        versions = StateVersion.objects.order_by("version").values_list("version", flat=True)
+        self.assertEqual(list(versions), [4, 5, 6, 7, 8])
+        self.assertEqual(StateBlob.objects.count(), 2)
+        self.assertIsNone(StateVersion.objects.get(version=7).delta)
+        self.assertEqual(self.get().json()["definition"], "b" * 7 + "a" * 93)
+        self.assertEqual(self.get(version=5).json()["definition"], "b" * 4 + "a" * 96)
+        self.assertEqual(self.get(version=2).status_code, 404)
+
+        self.client.patch("/api/state", json.dumps({"name": "Mine", "base_version": 8, "delta": []}),
+                          content_type="application/json")
+        self.client.delete("/api/state", json.dumps({"name": "Mine"}), content_type="application/json")
+        self.assertFalse(StateBlob.objects.exists())
+
+
+@override_settings(STATE_ACCESS_TTL=60)
+class StateAccessTests(TestCase):
+    def setUp(self):
+        reset_state_access()
+        self.addCleanup(reset_state_access)
+        self.alice = get_user_model().objects.create_user(username="alice", password="secret")
+        self.carol = get_user_model().objects.create_user(username="carol", password="secret")
+        self.state = State.objects.create(name="Carol's", definition="d", owner="carol")
+
+    def share(self, role):
+        self.client.force_login(self.carol)
+        response = self.client.post("/api/share_state", {"name": "Carol's", "user": "alice", "role": role})
+        self.client.force_login(self.alice)
+        return response
+
+    def rename(self, new_name):
+        return self.client.put(
+            "/api/state",
+            json.dumps({"old_name": self.state.name, "new_name": new_name, "new_definition": "e"}),
+            content_type="application/json",
+        )
+
+    def test_roles_are_read_once_per_user(self):
+        self.share("RE")
+        self.assertTrue(can_read(self.alice, self.state))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(can_read(self.alice, self.state))
+            self.assertFalse(can_write(self.alice, self.state))
+            self.assertEqual(self.client.get("/api/state", {"name": "Carol's"}).status_code, 200)
+        self.assertFalse([query for query in queries if "api_stateaccess" in query["sql"]])
+
+    def test_sharing_invalidates_the_cached_roles(self):
+        self.client.force_login(self.alice)
+        self.assertEqual(self.client.get("/api/state", {"name": "Carol's"}).status_code, 403)
+
+        self.share("RE")
+        self.assertEqual(self.client.get("/api/state", {"name": "Carol's"}).status_code, 200)
+        self.assertEqual(self.rename("Renamed").status_code, 403)
+
+        self.share("WR")
+        self.assertEqual(self.rename("Renamed").status_code, 200)
+        self.state.refresh_from_db()
+        self.assertTrue(can_write(self.alice, self.state))
+
+        self.client.force_login(self.carol)
+        self.client.delete("/api/state", json.dumps({"name": "Renamed"}), content_type="application/json")
+        self.assertEqual(get_roles("alice"), {})
+
+    def test_revokes_through_another_worker_apply_at_once(self):
+        self.share("WR")
+        self.assertTrue(can_write(self.alice, self.state))
+
+        # A second worker, with a role cache of its own, downgrades and then revokes alice
+        with mock.patch.object(state_access, "_indexes", {}):
+            self.share("RE")
+        self.assertFalse(can_write(self.alice, self.state))
+        self.assertTrue(can_read(self.alice, self.state))
+
+        with mock.patch.object(state_access, "_indexes", {}):
+            self.client.force_login(self.carol)
+            self.client.post(
+                "/api/share_states",
+                json.dumps({"states": ["Carol's"], "revokes": ["alice"]}),
+                content_type="application/json",
+            )
+        self.assertFalse(can_read(self.alice, self.state))
+
+    def test_public_states_are_readable_only(self):
+        self.state.public = True
+        self.assertTrue(can_read(self.alice, self.state))
+        self.assertFalse(can_write(self.alice, self.state))
+        self.assertTrue(can_write(self.carol, self.state))
+
+
+class BulkShareTests(TestCase):
+    def setUp(self):
+        self.owner = get_user_model().objects.create_user(username="alice", password="secret")
+        self.client.force_login(self.owner)
+        for username in ["bob", "dave", *[f"user{i}" for i in range(20)]]:
+            get_user_model().objects.create_user(username=username, password="secret")
+        self.first = State.objects.create(name="First", definition="d", owner="alice")
+        self.second = State.objects.create(name="Second", definition="d", owner="alice")
+        State.objects.create(name="Carol's", definition="d", owner="carol")
+        StateAccess.objects.create(state=self.first, user="bob", role="RE")
+        StateAccess.objects.create(state=self.first, user="dave", role="WR")
+
+    def share(self, body):
+        return self.client.post("/api/share_states", json.dumps(body), content_type="application/json")
+
+    def test_grants_and_revokes_report_each_entry(self):
+        response = self.share({
+            "states": ["First", "Second", "Carol's", "Missing"],
+            "grants": [{"user": "bob", "role": "WR"}, {"user": "nobody", "role": "RE"}, {"user": "alice", "role": "RE"}],
+            "revokes": ["dave"],
+        })
+
+        self.assertEqual(response.status_code, 200)
+        outcomes = {
+            (entry["state"], entry["user"]): entry.get("status") or entry["error"]
+            for entry in response.json()["results"]
+        }
+        self.assertEqual(outcomes[("First", "bob")], "updated")
+        self.assertEqual(outcomes[("Second", "bob")], "created")
+        self.assertEqual(outcomes[("First", "nobody")], "User does not exist")
+        self.assertEqual(outcomes[("First", "alice")], "User is already the owner of the state")
+        self.assertEqual(outcomes[("First", "dave")], "revoked")
+        self.assertEqual(outcomes[("Second", "dave")], "not_shared")
+        self.assertEqual(outcomes[("Carol's", "bob")], "Requesting user is not the owner")
+        self.assertEqual(outcomes[("Missing", "dave")], "State not found")
+        self.assertEqual(
+            sorted(StateAccess.objects.values_list("state__name", "user", "role")),
+            [("First", "bob", "WR"), ("Second", "bob", "WR")],
+        )
+
+    def test_revokes_match_usernames_case_insensitively(self):
+        results = self.share({"states": ["First"], "revokes": ["Dave"]}).json()["results"]
+
+        self.assertEqual(results[0]["status"], "revoked")
+        self.assertEqual(list(StateAccess.objects.values_list("user", flat=True)), ["bob"])
+
+    def test_query_count_does_not_grow_with_the_grants(self):
+        grants = [{"user": f"user{i}", "role": "RE"} for i in range(20)]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.share({"states": ["First", "Second"], "grants": grants})
+
+        self.assertEqual({entry["status"] for entry in response.json()["results"]}, {"created"})
+        self.assertEqual(StateAccess.objects.filter(role="RE").count(), 41)
+        access_queries = [query for query in queries if "api_stateaccess" in query["sql"]]
+        self.assertEqual(len(access_queries), 2)
+
+        again = self.share({"states": ["First"], "grants": grants[:1]}).json()["results"]
+        self.assertEqual(again[0]["status"], "unchanged")
+
+    def test_malformed_requests_are_rejected(self):
+        self.assertEqual(self.share({"grants": []}).status_code, 400)
+        self.assertEqual(self.share({"states": "First"}).status_code, 400)
+        self.assertEqual(
+            self.share({"states": ["First"], "grants": [{"user": "bob", "role": "RE"}], "revokes": ["bob"]}).status_code,
+            400,
+        )
+        self.assertEqual(
+            self.share({"states": ["First"], "grants": [{"user": "Bob", "role": "RE"}], "revokes": ["bob"]}).status_code,
+            400,
+        )
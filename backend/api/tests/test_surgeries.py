@@ -0,0 +1,309 @@
+import base64
+import json
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from api.models import RefreshWatermark, SURGERY_CASE, SURGERY_CASE_CODE, SURGERY_CASE_SUMMARY
+from api.views.utils.data_version import clear_data_version, compute_data_version
+from api.views.utils.columnar import columnar_payload, stream_columnar_payload
+from api.views.utils.query_cache import reset_query_cache
+from api.views.utils.utils import execute_sql_stream, stream_json_result
+
+
+def decode(column):
+    return np.frombuffer(base64.b64decode(column["data"]), dtype=np.dtype(column["type"]).newbyteorder("<"))
+
+
+def make_case(case_id, **fields):
+    values = {
+        "CASE_ID": case_id,
+        "VISIT_NO": case_id * 10,
+        "MRN": case_id * 100,
+        "SURGEON_PROV_ID": "S1",
+        "SURGEON_PROV_NAME": "Surgeon One",
+        "ANESTH_PROV_ID": "A1",
+        "ANESTH_PROV_NAME": "Anesth One",
+        "PRBC_UNITS": 2,
+        "FFP_UNITS": 0,
+        "PLT_UNITS": 0,
+        "CRYO_UNITS": 0,
+        "CELL_SAVER_ML": 250,
+        "PREOP_HEMO": 12.5,
+        "POSTOP_HEMO": 9.1,
+        "YEAR": 2024,
+        "QUARTER": 1,
+        "MONTH": 2,
+        "CASE_DATE": date(2024, 2, 1),
+        "VENT": 0,
+        "DRG_WEIGHT": 1.5,
+        "DEATH": None,
+        "ECMO": 0,
+        "STROKE": 0,
+        "ALL_CODES": "33510,33511",
+        "TXA": 1,
+        "B12": 0,
+        "AMICAR": 0,
+        "IRON": 0,
+        "SURGERY_TYPE_DESC": "Elective",
+    }
+    values.update(fields)
+    # As refresh_case_summary does, list the case's codes in SURGERY_CASE_CODE too
+    SURGERY_CASE_CODE.objects.bulk_create(
+        SURGERY_CASE_CODE(CASE_ID=case_id, CODE=code) for code in (values["ALL_CODES"] or "").split(",") if code
+    )
+    return SURGERY_CASE_SUMMARY.objects.create(**values)
+
+
+class SurgeryCaseEndpointTests(TestCase):
+    def setUp(self):
+        clear_data_version()
+        user = get_user_model().objects.create_user(username="alice", password="secret")
+        self.client.force_login(user)
+
+    def test_cases_are_read_from_the_summary_table(self):
+        make_case(1)
+        make_case(2, SURGEON_PROV_ID="S2", PRBC_UNITS=None)
+
+        response = self.client.get("/api/get_sanguine_surgery_cases")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        payload = json.loads(b"".join(response.streaming_content))
+        rows = sorted(payload["result"], key=lambda row: row["CASE_ID"])
+        self.assertEqual([row["CASE_ID"] for row in rows], [1, 2])
+        self.assertEqual(rows[0]["CASE_DATE"], "2024-02-01")
+        self.assertEqual(rows[0]["ALL_CODES"], "33510,33511")
+        self.assertIsNone(rows[1]["PRBC_UNITS"])
+
+    @override_settings(QUERY_CACHE="memory")
+    def test_unfiltered_cases_stream_with_the_default_cache(self):
+        reset_query_cache()
+        self.addCleanup(reset_query_cache)
+        make_case(1)
+
+        for _ in range(2):
+            response = self.client.get("/api/get_sanguine_surgery_cases")
+            self.assertTrue(response.streaming)
+            self.assertEqual(json.loads(b"".join(response.streaming_content))["result"][0]["CASE_ID"], 1)
+
+    @override_settings(QUERY_CACHE="memory")
+    def test_unfiltered_columns_are_cached_with_the_default_cache(self):
+        reset_query_cache()
+        self.addCleanup(reset_query_cache)
+        make_case(1)
+
+        with patch("api.views.surgeries.execute_sql_stream", wraps=execute_sql_stream) as execute:
+            for _ in range(2):
+                response = self.client.get("/api/get_sanguine_surgery_cases", {"format": "columnar"})
+                self.assertEqual(decode(response.json()["columns"]["CASE_ID"]).tolist(), [1])
+
+        execute.assert_called_once()
+
+    def test_cases_can_be_requested_as_columns(self):
+        make_case(1)
+        make_case(2, SURGEON_PROV_ID="S2")
+
+        response = self.client.get("/api/get_sanguine_surgery_cases", {"format": "columnar"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        payload = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(payload["length"], 2)
+        self.assertEqual(sorted(decode(payload["columns"]["CASE_ID"]).tolist()), [1, 2])
+        self.assertEqual(payload["columns"]["YEAR"]["type"], "int16")
+
+    def test_filters_are_applied_in_the_query(self):
+        call_command("sync_cpt_codes", stdout=StringIO())
+        make_case(1)
+        make_case(2, ALL_CODES="21601", DEATH="Y")
+        make_case(3, ALL_CODES="21601,33516", DEATH="Y")
+        make_case(4, DEATH="Y", SURGERY_TYPE_DESC="Urgent")
+        make_case(5, DEATH="Y", CASE_DATE=date(2023, 5, 1))
+
+        response = self.client.get("/api/get_sanguine_surgery_cases", {
+            "procedure": "CABG",
+            "outcome": "DEATH",
+            "surgery_type": "Elective",
+            "date_from": "2024-01-01",
+        })
+
+        payload = json.loads(b"".join(response.streaming_content))
+        self.assertEqual([row["CASE_ID"] for row in payload["result"]], [3])
+
+    def test_cases_are_paged_by_keyset_cursor(self):
+        make_case(1, CASE_DATE=date(2024, 3, 1))
+        make_case(2, CASE_DATE=date(2024, 1, 1))
+        make_case(3, CASE_DATE=date(2024, 1, 1))
+
+        first = self.client.get("/api/get_sanguine_surgery_cases", {"limit": 2}).json()
+        self.assertEqual([row["CASE_ID"] for row in first["result"]], [2, 3])
+        self.assertEqual(first["next_cursor"], "2024-01-01_3")
+
+        second = self.client.get(
+            "/api/get_sanguine_surgery_cases", {"limit": 2, "after": first["next_cursor"]}
+        ).json()
+        self.assertEqual([row["CASE_ID"] for row in second["result"]], [1])
+        self.assertIsNone(second["next_cursor"])
+
+    def test_invalid_filters_are_rejected(self):
+        for params in [
+            {"procedure": "Not A Procedure"},
+            {"outcome": "HEADACHE"},
+            {"limit": 0},
+            {"after": "2024-01-01_3"},
+            {"limit": 2, "after": "yesterday"},
+        ]:
+            with self.subTest(params=params):
+                response = self.client.get("/api/get_sanguine_surgery_cases", params)
+                self.assertEqual(response.status_code, 400)
+
+
+class RefreshCaseSummaryTests(TransactionTestCase):
+    def setUp(self):
+        # SURGERY_CASE is unmanaged, create a bare copy of the columns the refresh reads
+        with connection.cursor() as cursor:
+            cursor.execute(f"CREATE TABLE {SURGERY_CASE._meta.db_table} (CASE_ID bigint, VISIT_NO bigint, CASE_DATE date)")
+            cursor.execute(f"INSERT INTO {SURGERY_CASE._meta.db_table} VALUES (1, 10, '2024-02-01')")
+        RefreshWatermark.objects.create(
+            name="surgery_case_summary", watermark=datetime(2024, 2, 2, tzinfo=dt_timezone.utc)
+        )
+
+    def tearDown(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE {SURGERY_CASE._meta.db_table}")
+
+    def test_an_empty_summary_is_rebuilt_in_full(self):
+        with patch("api.management.commands.refresh_case_summary.refresh_full") as refresh_full:
+            call_command("refresh_case_summary", stdout=StringIO())
+
+        refresh_full.assert_called_once()
+
+    def test_a_filled_summary_is_refreshed_incrementally(self):
+        make_case(1)
+
+        with patch("api.management.commands.refresh_case_summary.refresh_full") as refresh_full:
+            call_command("refresh_case_summary", stdout=StringIO())
+
+        refresh_full.assert_not_called()
+        self.assertTrue(SURGERY_CASE_SUMMARY.objects.filter(CASE_ID=1).exists())
+
+
+@override_settings(DATA_VERSION_TTL=0)
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        clear_data_version()
+        user = get_user_model().objects.create_user(username="alice", password="secret")
+        self.client.force_login(user)
+        RefreshWatermark.objects.create(name="surgery_case_summary")
+        make_case(1)
+
+    def test_matching_etag_returns_not_modified(self):
+        response = self.client.get("/api/get_sanguine_surgery_cases")
+        etag = response["ETag"]
+
+        self.assertTrue(etag.startswith('"'))
+        self.assertIn("Last-Modified", response)
+        self.assertIn("no-cache", response["Cache-Control"])
+
+        with patch("api.views.surgeries.execute_sql_stream") as execute:
+            response = self.client.get("/api/get_sanguine_surgery_cases", HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        execute.assert_not_called()
+
+    def test_last_modified_follows_raw_table_loads(self):
+        refreshed_at = RefreshWatermark.objects.get().refreshed_at
+        cursor = MagicMock()
+        cursor.fetchall.return_value = [
+            ("SURGERY_CASE", 10, datetime(2020, 1, 1), None),
+            ("VISIT", 20, datetime(2020, 1, 1), datetime(2099, 1, 2, 3, 4, 5)),
+        ]
+        connection = MagicMock(vendor="mysql", timezone=dt_timezone.utc)
+        connection.cursor.return_value.__enter__.return_value = cursor
+
+        with patch("api.views.utils.data_version.connections", {"default": connection}):
+            version = compute_data_version()
+
+        self.assertEqual(version.last_modified, datetime(2099, 1, 2, 3, 4, 5, tzinfo=dt_timezone.utc))
+        self.assertGreater(version.last_modified, refreshed_at)
+
+    def test_refresh_changes_the_etag(self):
+        etag = self.client.get("/api/get_sanguine_surgery_cases")["ETag"]
+
+        RefreshWatermark.objects.create(name="hemoglobin_labs")
+
+        response = self.client.get("/api/get_sanguine_surgery_cases", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+class StreamJsonResultTests(SimpleTestCase):
+    def test_matches_json_response_encoding(self):
+        batches = [[{"CASE_ID": 1, "CASE_DATE": date(2024, 1, 2)}], [], [{"CASE_ID": 2, "CASE_DATE": None}]]
+
+        streamed = "".join(stream_json_result(batches))
+
+        self.assertEqual(
+            streamed,
+            '{"result": [{"CASE_ID": 1, "CASE_DATE": "2024-01-02"}, {"CASE_ID": 2, "CASE_DATE": null}]}',
+        )
+        self.assertEqual("".join(stream_json_result([])), '{"result": []}')
+
+
+class ColumnarPayloadTests(SimpleTestCase):
+    def test_columns_are_typed_and_dictionary_encoded(self):
+        batches = [
+            [
+                {"CASE_ID": 1, "PRBC_UNITS": 2.0, "SURGERY_TYPE_DESC": "Elective", "CASE_DATE": date(2024, 1, 2)},
+                {"CASE_ID": 2, "PRBC_UNITS": None, "SURGERY_TYPE_DESC": "Elective", "CASE_DATE": date(2024, 1, 2)},
+            ],
+            [
+                {"CASE_ID": 300, "PRBC_UNITS": 1.0, "SURGERY_TYPE_DESC": "Urgent", "CASE_DATE": date(2024, 1, 2)},
+                {"CASE_ID": 4, "PRBC_UNITS": 0.0, "SURGERY_TYPE_DESC": "Elective", "CASE_DATE": date(2024, 1, 3)},
+            ],
+        ]
+
+        payload = columnar_payload(batches)
+        columns = payload["columns"]
+
+        self.assertEqual(payload["length"], 4)
+        self.assertEqual(columns["CASE_ID"]["type"], "int16")
+        self.assertEqual(decode(columns["CASE_ID"]).tolist(), [1, 2, 300, 4])
+        prbc = decode(columns["PRBC_UNITS"])
+        self.assertEqual(columns["PRBC_UNITS"]["type"], "float64")
+        self.assertTrue(np.isnan(prbc[1]))
+        self.assertEqual(prbc[[0, 2, 3]].tolist(), [2.0, 1.0, 0.0])
+        self.assertEqual(columns["SURGERY_TYPE_DESC"]["type"], "dictionary")
+        self.assertEqual(columns["SURGERY_TYPE_DESC"]["values"], ["Elective", "Urgent"])
+        self.assertEqual(decode(columns["SURGERY_TYPE_DESC"]["indices"]).tolist(), [0, 0, 1, 0])
+        self.assertEqual(columns["CASE_DATE"]["values"], ["2024-01-02", "2024-01-03"])
+
+    def test_high_cardinality_strings_stay_plain(self):
+        payload = columnar_payload([[{"ALL_CODES": "a"}, {"ALL_CODES": "b"}, {"ALL_CODES": None}]])
+
+        self.assertEqual(payload["columns"]["ALL_CODES"], {"type": "string", "data": ["a", "b", None]})
+
+    def test_stream_matches_the_payload(self):
+        batches = [[{"CASE_ID": 1, "DEATH": "Y", "PRBC_UNITS": 1.5}], [], [{"CASE_ID": 2, "DEATH": None, "PRBC_UNITS": None}]]
+
+        streamed = json.loads("".join(stream_columnar_payload(batches)))
+
+        self.assertEqual(streamed, json.loads(json.dumps(columnar_payload(batches))))
+        self.assertEqual(json.loads("".join(stream_columnar_payload([]))), {"format": "columnar", "length": 0, "columns": {}})
+
+    def test_decimals_are_serialized_as_in_the_rows_format(self):
+        batches = [[{"DRG_WEIGHT": Decimal("1.500")}, {"DRG_WEIGHT": Decimal("2.250")}, {"DRG_WEIGHT": None}]]
+
+        rows = json.loads("".join(stream_json_result(batches)))["result"]
+        payload = columnar_payload(batches)
+
+        self.assertEqual(payload["columns"]["DRG_WEIGHT"]["data"], [row["DRG_WEIGHT"] for row in rows])
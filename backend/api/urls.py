@@ -4,6 +4,13 @@ from django.urls import include, path
 
 from .auth import auth_login, auth_logout
 from . import views
+from .views.utils.executor import executor_view
+
+
+def db_view(view):
+    # Under ASGI the database-backed views run on the bounded executor instead of a thread per request
+    return executor_view(view) if settings.ASYNC_VIEWS else view
+
 
 urlpatterns = [
     path("api/admin/", admin.site.urls),
@@ -12,13 +19,16 @@ urlpatterns = [
     path("api/csrf/", views.get_csrf_token, name="get_csrf_token"),
     path("api/", views.index, name="index"),
     path("api/whoami", views.whoami, name="whoami"),
-    path("api/get_procedure_counts", views.get_procedure_counts, name="get_procedure_counts"),
-    path("api/fetch_surgery", views.fetch_surgery, name="fetch_surgery"),
-    path("api/fetch_patient", views.fetch_patient, name="fetch_patient"),
-    path("api/state", views.state, name="state"),
-    path("api/share_state", views.share_state, name="share_state"),
-    path("api/state_unids", views.state_unids, name="state_unids"),
-    path("api/get_sanguine_surgery_cases", views.get_sanguine_surgery_cases, name="get_sanguine_surgery_cases"),
+    path("api/get_procedure_counts", db_view(views.get_procedure_counts), name="get_procedure_counts"),
+    path("api/fetch_surgery", db_view(views.fetch_surgery), name="fetch_surgery"),
+    path("api/fetch_patient", db_view(views.fetch_patient), name="fetch_patient"),
+    path("api/state", db_view(views.state), name="state"),
+    path("api/share_state", db_view(views.share_state), name="share_state"),
+    path("api/share_states", db_view(views.share_states), name="share_states"),
+    path("api/state_unids", db_view(views.state_unids), name="state_unids"),
+    path("api/get_sanguine_surgery_cases", db_view(views.get_sanguine_surgery_cases), name="get_sanguine_surgery_cases"),
+    path("api/aggregate", db_view(views.aggregate), name="aggregate"),
+    path("api/metrics", views.metrics, name="metrics"),
 ]
 
 if settings.AUTH_PROVIDER == "saml":
@@ -1,3 +1,4 @@
 # flake8: noqa
 from .surgeries import *
 from .state import *
+from .monitoring import *
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views.decorators.http import require_http_methods
+
+from .utils.metrics import flush, load_snapshots, render_prometheus
+
+
+@require_http_methods(["GET"])
+def metrics(request):
+    # For a collector on the host, requests proxied in from outside come from another address
+    if request.META.get("REMOTE_ADDR") not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden("Metrics are only served to local collectors")
+
+    flush(force=True)
+    return HttpResponse(render_prometheus(load_snapshots()), content_type="text/plain; version=0.0.4; charset=utf-8")
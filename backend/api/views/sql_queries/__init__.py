@@ -1,2 +1,38 @@
-from .mariadb import procedure_count_query, patient_query, surgery_query, surgery_case_query
-all = [procedure_count_query, patient_query, surgery_query, surgery_case_query]
+from .mariadb import (
+    procedure_count_query,
+    patient_query,
+    surgery_query,
+    surgery_case_query,
+    case_summary_query,
+    case_list_query,
+    case_aggregate_query,
+    case_summary_stale_query,
+    case_summary_orphan_query,
+    case_summary_insert_query,
+    case_code_insert_query,
+    hemoglobin_lab_insert_query,
+    unclassified_medication_query,
+    unclassified_medication_count_query,
+    visit_medication_insert_query,
+    CASE_SUMMARY_COLUMNS,
+    TABLES,
+)
+__all__ = [
+    "procedure_count_query",
+    "patient_query",
+    "surgery_query",
+    "surgery_case_query",
+    "case_summary_query",
+    "case_list_query",
+    "case_aggregate_query",
+    "case_summary_stale_query",
+    "case_summary_orphan_query",
+    "case_summary_insert_query",
+    "case_code_insert_query",
+    "hemoglobin_lab_insert_query",
+    "unclassified_medication_query",
+    "unclassified_medication_count_query",
+    "visit_medication_insert_query",
+    "CASE_SUMMARY_COLUMNS",
+    "TABLES",
+]
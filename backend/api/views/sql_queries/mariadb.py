@@ -3,12 +3,19 @@ from api.models import (
     VISIT,
     SURGERY_CASE,
     BILLING_CODES,
+    CPT_CODE,
+    HEMOGLOBIN_LAB,
+    MEDICATION_CLASS,
     VISIT_LABS,
+    VISIT_MEDICATION,
     EXTRAOP_MEDS,
     INTRAOP_MEDS,
     INTRAOP_TRANSFUSION,
+    SURGERY_CASE_CODE,
+    SURGERY_CASE_SUMMARY,
 )
-from ..utils.utils import get_all_cpt_code_filters
+from ..utils.cooccurrence import PROCEDURE_SEPARATOR
+from ..utils.medication_classes import MEDICATION_FLAGS
 
 FIELDS = {
     "admin_dose": "ADMIN_DOSE",
@@ -22,6 +29,7 @@ FIELDS = {
     "billing_code": "CODE",
     "case_date": "CASE_DATE",
     "case_id": "CASE_ID",
+    "clean_name": "CLEAN_NAME",
     "code_desc": "CODE_DESC",
     "death_date": "DEATH_DATE",
     "dose_unit_desc": "DOSE_UNIT_DESC",
@@ -53,6 +61,10 @@ FIELDS = {
 
 TABLES = {
     "billing_codes": BILLING_CODES._meta.db_table,
+    "cpt_code": CPT_CODE._meta.db_table,
+    "hemoglobin_lab": HEMOGLOBIN_LAB._meta.db_table,
+    "medication_class": MEDICATION_CLASS._meta.db_table,
+    "visit_medication": VISIT_MEDICATION._meta.db_table,
     "intra_op_trnsfsd": INTRAOP_TRANSFUSION._meta.db_table,
     "patient": PATIENT._meta.db_table,
     "surgery_case": SURGERY_CASE._meta.db_table,
@@ -60,19 +72,31 @@ TABLES = {
     "visit_labs": VISIT_LABS._meta.db_table,
     "extraop_meds": EXTRAOP_MEDS._meta.db_table,
     "intraop_meds": INTRAOP_MEDS._meta.db_table,
+    "surgery_case_summary": SURGERY_CASE_SUMMARY._meta.db_table,
+    "surgery_case_code": SURGERY_CASE_CODE._meta.db_table,
 }
 
-_, _, filters_safe_sql = get_all_cpt_code_filters()
+# Columns of surgery_case_query, in order, as materialized in the summary table
+CASE_SUMMARY_COLUMNS = [field.column for field in SURGERY_CASE_SUMMARY._meta.fields]
 
+# Semi-join billing rows against the synced CPT_CODE table (see sync_cpt_codes)
+cpt_code_filter_sql = f"""
+        WHERE {FIELDS.get('billing_code')} IN (SELECT CODE FROM {TABLES.get('cpt_code')})
+"""
+
+# Billing rows are matched to the case day as a PROC_DTM range, so the join can seek
+# VISIT_NO_PROC_DTM_IDX on both columns rather than CAST every row of the visit
 procedure_count_query = f"""
         SELECT
-            GROUP_CONCAT({FIELDS.get('billing_code')}) as codes,
+            GROUP_CONCAT(DISTINCT CPT.{FIELDS.get('clean_name')} SEPARATOR '{PROCEDURE_SEPARATOR}') as procedures,
             SURG.{FIELDS.get('case_id')}
         FROM {TABLES.get('billing_codes')} BLNG
         INNER JOIN {TABLES.get('surgery_case')} SURG
             ON BLNG.{FIELDS.get('visit_no')} = SURG.{FIELDS.get('visit_no')}
-            AND CAST(BLNG.{FIELDS.get('procedure_dtm')} AS DATE) = SURG.{FIELDS.get('case_date')}
-        {filters_safe_sql}
+            AND BLNG.{FIELDS.get('procedure_dtm')} >= SURG.{FIELDS.get('case_date')}
+            AND BLNG.{FIELDS.get('procedure_dtm')} < SURG.{FIELDS.get('case_date')} + INTERVAL 1 DAY
+        INNER JOIN {TABLES.get('cpt_code')} CPT
+            ON CPT.{FIELDS.get('billing_code')} = BLNG.{FIELDS.get('billing_code')}
         GROUP BY SURG.{FIELDS.get('case_id')}
     """
 
@@ -91,33 +115,27 @@ patient_query = f"""
     WHERE PATIENT.{FIELDS.get('patient_id')} = %(id)s
     """
 
+# Billing rows on the case day, matched as in procedure_count_query
 surgery_query = f"""
-    WITH
-        codes AS (
-            SELECT
-                CONCAT(BLNG.{FIELDS.get('visit_no')}, ', ', CAST(BLNG.{FIELDS.get('procedure_dtm')} AS DATE)) AS comb,
-                GROUP_CONCAT(BLNG.{FIELDS.get('code_desc')} SEPARATOR ', ') AS CODES
-            FROM {TABLES.get('billing_codes')} BLNG
-            GROUP BY CONCAT(BLNG.{FIELDS.get('visit_no')}, ', ', CAST(BLNG.{FIELDS.get('procedure_dtm')} AS DATE))
-        ),
-        surg_cases AS (
-            SELECT
-                CONCAT(SURG.{FIELDS.get('visit_no')}, ', ', CAST(SURG.{FIELDS.get('case_date')} AS DATE)) AS comb,
-                SURG.{FIELDS.get('case_id')},
-                SURG.{FIELDS.get('visit_no')},
-                SURG.{FIELDS.get('case_date')},
-                SURG.{FIELDS.get('surgery_start_time')},
-                SURG.{FIELDS.get('surgery_end_time')},
-                SURG.{FIELDS.get('surgery_elapsed')},
-                SURG.{FIELDS.get('surgery_type')},
-                SURG.{FIELDS.get('prim_proc_desc')},
-                SURG.{FIELDS.get('post_op_icu_los')}
-            FROM SURGERY_CASE SURG
-            WHERE SURG.{FIELDS.get('case_id')} = %(id)s
-        )
-    SELECT surg_cases.*, codes.CODES AS CODES
-    FROM surg_cases
-    INNER JOIN codes ON surg_cases.comb = codes.comb
+    SELECT
+        CONCAT(SURG.{FIELDS.get('visit_no')}, ', ', CAST(SURG.{FIELDS.get('case_date')} AS DATE)) AS comb,
+        SURG.{FIELDS.get('case_id')},
+        SURG.{FIELDS.get('visit_no')},
+        SURG.{FIELDS.get('case_date')},
+        SURG.{FIELDS.get('surgery_start_time')},
+        SURG.{FIELDS.get('surgery_end_time')},
+        SURG.{FIELDS.get('surgery_elapsed')},
+        SURG.{FIELDS.get('surgery_type')},
+        SURG.{FIELDS.get('prim_proc_desc')},
+        SURG.{FIELDS.get('post_op_icu_los')},
+        GROUP_CONCAT(BLNG.{FIELDS.get('code_desc')} SEPARATOR ', ') AS CODES
+    FROM SURGERY_CASE SURG
+    INNER JOIN {TABLES.get('billing_codes')} BLNG
+        ON BLNG.{FIELDS.get('visit_no')} = SURG.{FIELDS.get('visit_no')}
+        AND BLNG.{FIELDS.get('procedure_dtm')} >= SURG.{FIELDS.get('case_date')}
+        AND BLNG.{FIELDS.get('procedure_dtm')} < SURG.{FIELDS.get('case_date')} + INTERVAL 1 DAY
+    WHERE SURG.{FIELDS.get('case_id')} = %(id)s
+    GROUP BY SURG.{FIELDS.get('case_id')}
     """
 
 surgery_case_query = rf"""
@@ -183,94 +201,8 @@ surgery_case_query = rf"""
                 )) AS ECMO,
             GROUP_CONCAT(CODE) AS ALL_CODES
         FROM {TABLES.get('billing_codes')}
-        {filters_safe_sql}
+        {cpt_code_filter_sql}
         GROUP BY VISIT_NO
-    ),
-    MEDS AS (
-        SELECT
-            VISIT_NO,
-            MAX(TXA) AS TXA,
-            MAX(AMICAR) AS AMICAR,
-            MAX(B12) AS B12,
-            MAX(IRON) AS IRON
-        FROM (
-            SELECT
-                VISIT_NO,
-                SUM(CASE WHEN LOWER(MEDICATION_NAME) REGEXP 'tranexamic|txa' THEN 1 ELSE 0 END) AS TXA,
-                SUM(CASE WHEN LOWER(MEDICATION_NAME) REGEXP 'amicar|aminocaproic|eaca' THEN 1 ELSE 0 END) AS AMICAR,
-                SUM(CASE WHEN LOWER(MEDICATION_NAME) REGEXP 'b12|cobalamin' THEN 1 ELSE 0 END) AS B12,
-                SUM(CASE WHEN LOWER(MEDICATION_NAME) REGEXP 'iron |ferric|ferrous' THEN 1 ELSE 0 END) AS IRON
-            FROM {TABLES.get('intraop_meds')}
-            GROUP BY VISIT_NO
-            UNION ALL
-            SELECT
-                VISIT_NO,
-                SUM(CASE WHEN LOWER(MEDICATION_NAME) REGEXP 'tranexamic|txa' THEN 1 ELSE 0 END) AS TXA,
-                SUM(CASE WHEN LOWER(MEDICATION_NAME) REGEXP 'amicar|aminocaproic|eaca' THEN 1 ELSE 0 END) AS AMICAR,
-                SUM(CASE WHEN LOWER(MEDICATION_NAME) REGEXP 'b12|cobalamin' THEN 1 ELSE 0 END) AS B12,
-                SUM(CASE WHEN LOWER(MEDICATION_NAME) REGEXP 'iron |ferric|ferrous' THEN 1 ELSE 0 END) AS IRON
-            FROM {TABLES.get('extraop_meds')}
-            GROUP BY VISIT_NO
-        ) meds_union
-        GROUP BY VISIT_NO
-    ),
-    LAB_HB AS (
-        SELECT
-            VISIT_NO,
-            LAB_DRAW_DTM,
-            RESULT_DTM,
-            RESULT_CODE,
-            RESULT_VALUE
-        FROM VISIT_LABS
-        WHERE (UPPER(RESULT_DESC) REGEXP 'HEMOGLOBIN|HGB')
-          AND RESULT_VALUE REGEXP '^[+-]?\\d+(\\.\\d+)?$'
-          AND LOWER(UOM_CODE) = 'g/dl'
-    ),
-    PREOP_HB AS (
-        SELECT
-            PREOP_ROWS.VISIT_NO,
-            PREOP_ROWS.CASE_ID,
-            PREOP_ROWS.LAB_DRAW_DTM AS DI_PREOP_DRAW_DTM,
-            PREOP_ROWS.RESULT_VALUE AS PREOP_HEMO
-        FROM (
-            SELECT
-                SC.VISIT_NO,
-                SC.CASE_ID,
-                LH.LAB_DRAW_DTM,
-                LH.RESULT_VALUE,
-                ROW_NUMBER() OVER (
-                    PARTITION BY SC.CASE_ID
-                    ORDER BY LH.LAB_DRAW_DTM DESC, LH.RESULT_DTM DESC, LH.RESULT_CODE DESC
-                ) AS RN
-            FROM SURGERY_CASE SC
-            INNER JOIN LAB_HB LH
-                ON SC.VISIT_NO = LH.VISIT_NO
-               AND LH.LAB_DRAW_DTM < SC.SURGERY_START_DTM
-        ) PREOP_ROWS
-        WHERE PREOP_ROWS.RN = 1
-    ),
-    POSTOP_HB AS (
-        SELECT
-            POSTOP_ROWS.VISIT_NO,
-            POSTOP_ROWS.CASE_ID,
-            POSTOP_ROWS.LAB_DRAW_DTM AS DI_POSTOP_DRAW_DTM,
-            POSTOP_ROWS.RESULT_VALUE AS POSTOP_HEMO
-        FROM (
-            SELECT
-                SC.VISIT_NO,
-                SC.CASE_ID,
-                LH.LAB_DRAW_DTM,
-                LH.RESULT_VALUE,
-                ROW_NUMBER() OVER (
-                    PARTITION BY SC.CASE_ID
-                    ORDER BY LH.LAB_DRAW_DTM ASC, LH.RESULT_DTM DESC, LH.RESULT_CODE DESC
-                ) AS RN
-            FROM SURGERY_CASE SC
-            INNER JOIN LAB_HB LH
-                ON SC.VISIT_NO = LH.VISIT_NO
-               AND LH.LAB_DRAW_DTM > SC.SURGERY_END_DTM
-        ) POSTOP_ROWS
-        WHERE POSTOP_ROWS.RN = 1
     )
     SELECT
         SURG.CASE_ID,
@@ -290,8 +222,22 @@ surgery_case_query = rf"""
         T.PLT_UNITS_OUTSIDE_OR,
         T.CRYO_UNITS_OUTSIDE_OR,
         T.CELL_SAVER_ML_OUTSIDE_OR,
-        PRE.PREOP_HEMO,
-        POST.POSTOP_HEMO,
+        (
+            SELECT HB.VALUE
+            FROM {TABLES.get('hemoglobin_lab')} HB
+            WHERE HB.VISIT_NO = SURG.VISIT_NO
+                AND HB.LAB_DRAW_DTM < SURG.SURGERY_START_DTM
+            ORDER BY HB.LAB_DRAW_DTM DESC, HB.RESULT_DTM DESC, HB.RESULT_CODE DESC
+            LIMIT 1
+        ) AS PREOP_HEMO,
+        (
+            SELECT HB.VALUE
+            FROM {TABLES.get('hemoglobin_lab')} HB
+            WHERE HB.VISIT_NO = SURG.VISIT_NO
+                AND HB.LAB_DRAW_DTM > SURG.SURGERY_END_DTM
+            ORDER BY HB.LAB_DRAW_DTM ASC, HB.RESULT_DTM DESC, HB.RESULT_CODE DESC
+            LIMIT 1
+        ) AS POSTOP_HEMO,
         YEAR(SURG.CASE_DATE) AS YEAR,
         QUARTER(SURG.CASE_DATE) AS QUARTER,
         MONTH(SURG.CASE_DATE) AS MONTH,
@@ -311,7 +257,156 @@ surgery_case_query = rf"""
     INNER JOIN BILLING_CODES BLNG ON SURG.VISIT_NO = BLNG.VISIT_NO
     LEFT JOIN TRANSFUSED_UNITS T ON SURG.CASE_ID = T.CASE_ID
     LEFT JOIN VISIT VST ON SURG.VISIT_NO = VST.VISIT_NO
-    LEFT JOIN MEDS ON SURG.VISIT_NO = MEDS.VISIT_NO
-    LEFT JOIN PREOP_HB PRE ON SURG.CASE_ID = PRE.CASE_ID
-    LEFT JOIN POSTOP_HB POST ON SURG.CASE_ID = POST.CASE_ID
+    LEFT JOIN {TABLES.get('visit_medication')} MEDS ON SURG.VISIT_NO = MEDS.VISIT_NO
+"""
+
+case_summary_query = f"""
+    SELECT {', '.join(CASE_SUMMARY_COLUMNS)}
+    FROM {TABLES.get('surgery_case_summary')}
+"""
+
+
+def case_list_query(where_sql="", paginate=False):
+    # Pages are keyset pages in CASE_DATE_IDX_SUMMARY order, bounded by the limit bind
+    page_sql = "ORDER BY CASE_DATE, CASE_ID LIMIT %(limit)s" if paginate else ""
+    return f"""
+        {case_summary_query}
+        {where_sql}
+        {page_sql}
+    """
+
+
+def case_aggregate_query(group_by, column_sql, where_sql=""):
+    # group_by and column_sql must come from the whitelists in utils.aggregation
+    return f"""
+        SELECT {group_by}, {', '.join(column_sql)}
+        FROM {TABLES.get('surgery_case_summary')}
+        {where_sql}
+    """
+
+
+# Cases whose summary row is missing, re-keyed, or on/after the last refresh watermark
+case_summary_stale_query = f"""
+    SELECT SURG.{FIELDS.get('case_id')}
+    FROM {TABLES.get('surgery_case')} SURG
+    LEFT JOIN {TABLES.get('surgery_case_summary')} SUMM
+        ON SUMM.{FIELDS.get('case_id')} = SURG.{FIELDS.get('case_id')}
+    WHERE SURG.{FIELDS.get('case_date')} >= %(watermark)s
+        OR SUMM.{FIELDS.get('case_id')} IS NULL
+        OR SUMM.{FIELDS.get('visit_no')} <> SURG.{FIELDS.get('visit_no')}
+        OR SUMM.{FIELDS.get('case_date')} <> SURG.{FIELDS.get('case_date')}
+"""
+
+# Summary rows for cases that no longer exist upstream
+case_summary_orphan_query = f"""
+    SELECT SUMM.{FIELDS.get('case_id')}
+    FROM {TABLES.get('surgery_case_summary')} SUMM
+    LEFT JOIN {TABLES.get('surgery_case')} SURG
+        ON SURG.{FIELDS.get('case_id')} = SUMM.{FIELDS.get('case_id')}
+    WHERE SURG.{FIELDS.get('case_id')} IS NULL
+"""
+
+
+def case_summary_insert_query(target_table, case_filter_sql=""):
+    # Materialize surgery_case_query rows into target_table, optionally for a subset of cases
+    return f"""
+        INSERT INTO {target_table} ({', '.join(CASE_SUMMARY_COLUMNS)})
+        SELECT {', '.join(CASE_SUMMARY_COLUMNS)}
+        FROM ({surgery_case_query}) REFRESHED
+        {case_filter_sql}
+    """
+
+
+def case_code_insert_query(target_table, case_filter_sql=""):
+    # The CPT codes of interest billed on each case's visit, as ALL_CODES lists them, one row per code
+    return f"""
+        INSERT INTO {target_table} ({FIELDS.get('case_id')}, {FIELDS.get('billing_code')})
+        SELECT DISTINCT {FIELDS.get('case_id')}, {FIELDS.get('billing_code')}
+        FROM (
+            SELECT SURG.{FIELDS.get('case_id')}, BLNG.{FIELDS.get('billing_code')}
+            FROM {TABLES.get('surgery_case')} SURG
+            INNER JOIN {TABLES.get('billing_codes')} BLNG
+                ON BLNG.{FIELDS.get('visit_no')} = SURG.{FIELDS.get('visit_no')}
+            WHERE BLNG.{FIELDS.get('billing_code')} IN (SELECT CODE FROM {TABLES.get('cpt_code')})
+        ) REFRESHED
+        {case_filter_sql}
+    """
+
+
+# Numeric hemoglobin results in g/dL, g/L results are scaled down
+# VALUE is DECIMAL(8, 3): results with more than 5 integer digits are discarded rather than
+# cast, since in strict mode a single out-of-range value would abort the whole refresh
+hemoglobin_lab_insert_query = rf"""
+    INSERT INTO {TABLES.get('hemoglobin_lab')} (VISIT_NO, LAB_DRAW_DTM, RESULT_DTM, RESULT_CODE, VALUE)
+    SELECT
+        VISIT_NO,
+        LAB_DRAW_DTM,
+        RESULT_DTM,
+        RESULT_CODE,
+        CASE
+            WHEN LOWER(UOM_CODE) = 'g/l' THEN CAST(CAST(RESULT_VALUE AS DECIMAL(8, 3)) / 10.0 AS DECIMAL(8, 3))
+            ELSE CAST(RESULT_VALUE AS DECIMAL(8, 3))
+        END AS VALUE
+    FROM {TABLES.get('visit_labs')}
+    WHERE (UPPER(RESULT_DESC) REGEXP 'HEMOGLOBIN|HGB')
+      AND RESULT_VALUE REGEXP '^[+-]?[0-9]{{1,5}}([.][0-9]+)?$'
+      AND LOWER(UOM_CODE) IN ('g/dl', 'g/l')
+"""
+
+
+# A charted medication row's MEDICATION_CLASS pair, matching a NULL id to a NULL id
+_medication_class_match = f"""
+    LEFT JOIN {TABLES.get('medication_class')} MC ON MC.MEDICATION_NAME = MEDS.MEDICATION_NAME
+        AND (MC.MEDICATION_ID = MEDS.MEDICATION_ID OR (MC.MEDICATION_ID IS NULL AND MEDS.MEDICATION_ID IS NULL))
+"""
+
+
+def _charted_medications(union="UNION"):
+    return f"""(
+        SELECT VISIT_NO, {FIELDS.get('medication_id')}, MEDICATION_NAME FROM {TABLES.get('intraop_meds')}
+        {union}
+        SELECT VISIT_NO, {FIELDS.get('medication_id')}, MEDICATION_NAME FROM {TABLES.get('extraop_meds')}
+    ) MEDS"""
+
+
+# (Medication id, name) pairs charted in either medication table that have no class yet
+unclassified_medication_query = f"""
+    SELECT DISTINCT MEDS.MEDICATION_ID, MEDS.MEDICATION_NAME
+    FROM {_charted_medications()}
+    {_medication_class_match}
+    WHERE MEDS.MEDICATION_NAME IS NOT NULL AND MC.id IS NULL
+"""
+
+# Charted medication rows left without a class, i.e. those charted without a name
+unclassified_medication_count_query = f"""
+    SELECT COUNT(*)
+    FROM {_charted_medications("UNION ALL")}
+    {_medication_class_match}
+    WHERE MC.id IS NULL
+"""
+
+
+def _visit_medication_counts(meds_table):
+    return f"""
+        SELECT
+            MEDS.VISIT_NO,
+            {', '.join(f'COALESCE(SUM(MC.{flag}), 0) AS {flag}' for flag in MEDICATION_FLAGS)}
+        FROM {meds_table} MEDS
+        {_medication_class_match}
+        GROUP BY MEDS.VISIT_NO
+    """
+
+
+# Per visit class counts, the larger of the intraop and extraop counts as the REGEXP version had it
+visit_medication_insert_query = f"""
+    INSERT INTO {TABLES.get('visit_medication')} (VISIT_NO, {', '.join(MEDICATION_FLAGS)})
+    SELECT
+        VISIT_NO,
+        {', '.join(f'MAX({flag})' for flag in MEDICATION_FLAGS)}
+    FROM (
+        {_visit_medication_counts(TABLES.get('intraop_meds'))}
+        UNION ALL
+        {_visit_medication_counts(TABLES.get('extraop_meds'))}
+    ) MEDS_UNION
+    GROUP BY VISIT_NO
 """
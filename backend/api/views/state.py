@@ -1,5 +1,6 @@
 import ast
 import json
+from django.core.serializers.json import DjangoJSONEncoder
 from django.http import (
     HttpResponse,
     JsonResponse,
@@ -9,10 +10,18 @@ from django.http import (
 )
 from django.forms.models import model_to_dict
 from django.contrib.auth.models import User
+from django.db import connections, transaction
+from django.db.models import Exists, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Length
+from django.utils.cache import patch_vary_headers
 from django.views.decorators.http import require_http_methods
 
 from api.models import State, StateAccess, AccessLevel
 from .decorators.conditional_login_required import conditional_login_required
+from .utils.case_filters import parse_page_size
+from .utils.state_access import can_read, can_write, invalidate_access
+from .utils.state_blobs import decode_definition, deflate_document, delete_state
+from .utils.state_versions import VersionConflict, load_current, load_version, parse_delta, save_delta, save_snapshot
 from .utils.utils import log_request
 
 
@@ -24,6 +33,23 @@ def parse_request_body(request):
         return ast.literal_eval(body)
 
 
+def accepts_deflate(accept_encoding):
+    # deflate, or * when deflate is not listed, with a q-value above 0; q=0 refuses the coding
+    qualities = {}
+    for coding in accept_encoding.split(","):
+        name, *params = [part.strip() for part in coding.split(";")]
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.lower()] = quality
+    return qualities.get("deflate", qualities.get("*", 0.0)) > 0
+
+
 def parse_bool(value):
     if value is None:
         return None
@@ -32,7 +58,73 @@ def parse_bool(value):
     return str(value).lower() == "true"
 
 
-@require_http_methods(["GET", "POST", "PUT", "DELETE"])
+def version_conflict(version):
+    return JsonResponse({"error": f"the state is at version {version}", "version": version}, status=409)
+
+
+def state_response(request, state):
+    fields = model_to_dict(state, exclude=["definition", "blob", "snapshot_version"])
+    if state.blob_id is None or state.version != state.snapshot_version:
+        # Not stored as a whole in the blob, deltas after the snapshot are applied here
+        return JsonResponse({**fields, "definition": load_current(state)})
+
+    if accepts_deflate(request.META.get("HTTP_ACCEPT_ENCODING", "")):
+        # Send the stored compressed definition as is, inside a deflate-coded JSON document
+        prefix = DjangoJSONEncoder().encode(fields)[:-1] + ', "definition": '
+        response = HttpResponse(
+            deflate_document(prefix.encode(), state.blob, b"}"), content_type="application/json"
+        )
+        response["Content-Encoding"] = "deflate"
+    else:
+        response = JsonResponse({**fields, "definition": decode_definition(state.blob)})
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
+
+
+def accessible_states(username):
+    # States the user owns, was given a role on, or that are public, as one query
+    access = StateAccess.objects.filter(state=OuterRef("pk"), user=username)
+    return State.objects.annotate(shared=Exists(access)).filter(
+        Q(owner=username) | Q(public=True) | Q(shared=True)
+    )
+
+
+def list_states(request):
+    """
+    Names of the states the user can open, or with metadata= or limit= one page of their
+    metadata ordered by name, without reading any definition.
+    """
+    username = str(request.user)
+    states = accessible_states(username).order_by("name")
+
+    if not (request.GET.get("metadata") or request.GET.get("limit")):
+        return JsonResponse(list(states.values_list("name", flat=True)), safe=False)
+
+    try:
+        limit = parse_page_size(request.GET.get("limit") or "100")
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    if request.GET.get("after"):
+        states = states.filter(name__gt=request.GET.get("after"))
+
+    rows = list(
+        states.annotate(
+            role=Subquery(StateAccess.objects.filter(state=OuterRef("pk"), user=username).values("role")[:1]),
+            definition_size=Coalesce("blob__size", Length("definition")),
+        ).values("name", "owner", "public", "role", "definition_size", "version", "updated_at")[:limit + 1]
+    )
+    for row in rows:
+        # The requester's own access: owner, a shared role (RE/WR), or public
+        if row["owner"] == username:
+            row["role"] = "owner"
+        elif row["role"] is None:
+            row["role"] = "public"
+
+    next_cursor = rows[limit - 1]["name"] if len(rows) > limit else None
+    return JsonResponse({"result": rows[:limit], "next_cursor": next_cursor})
+
+
+@require_http_methods(["GET", "POST", "PUT", "PATCH", "DELETE"])
 @conditional_login_required
 def state(request):
     log_request(request, ["definition", "new_definition", ])
@@ -45,28 +137,30 @@ def state(request):
         if name:
             # Get the object from the database and all related StateAccess objects
             try:
-                state = State.objects.get(name=name)  # username = uid
+                state = State.objects.select_related("blob").get(name=name)  # username = uid
             except State.DoesNotExist:
                 return HttpResponseNotFound("State not found")
-            state_access = StateAccess.objects.filter(state=state).filter(user=user)
 
             # Make sure that user is owner or at least reader
-            if not (str(state.owner) == str(user) or state_access or state.public):
+            if not can_read(user, state):
                 return HttpResponseForbidden("Not authorized")
 
+            if request.GET.get("version"):
+                try:
+                    version = int(request.GET.get("version"))
+                except ValueError:
+                    return HttpResponseBadRequest("version must be an integer")
+                definition = load_version(state, version)
+                if definition is None:
+                    return HttpResponseNotFound("Version not found")
+                fields = model_to_dict(state, exclude=["definition", "blob", "snapshot_version"])
+                return JsonResponse({**fields, "version": version, "definition": definition})
+
             # Return the json for the state
-            return JsonResponse(model_to_dict(state))
+            return state_response(request, state)
 
         else:
-            # Get the names of all the state objects that a user can access
-            states = [o.name for o in State.objects.all().filter(owner=user)]
-            state_access = [o.state.name for o in StateAccess.objects.filter(user=user)]
-            public_states = [o.name for o in State.objects.all().filter(public=True)]
-
-            response = set(states + state_access + public_states)
-
-            # Return the names as a list
-            return JsonResponse(list(response), safe=False)
+            return list_states(request)
 
     elif request.method == "POST":
         # Get the name and definition from the request
@@ -84,10 +178,8 @@ def state(request):
 
         if name and definition:  # owner is guaranteed by login
             # Create and save the new State object
-            new_state = State(
-                name=name, definition=definition, owner=owner, public=public
-            )
-            new_state.save()
+            new_state = State(name=name, owner=owner, public=public)
+            save_snapshot(new_state, definition, str(owner))
 
             return HttpResponse("state object created", status=201)
         else:
@@ -100,54 +192,80 @@ def state(request):
         new_name = put.get("new_name")
         new_definition = put.get("new_definition")
         new_public_request = put.get("new_public")
+        base_version = put.get("base_version")
 
-        owned_states = [o.name for o in State.objects.all().filter(owner=request.user)]
-        public_states = [o.name for o in State.objects.all().filter(public=True)]
-        writable_states = [
-            o.state.name
-            for o in StateAccess.objects.filter(user=request.user).filter(role="WR")
-        ]
-        readable_states = [
-            o.state.name
-            for o in StateAccess.objects.filter(user=request.user).filter(role="RE")
-        ]
-        all_accessible_states = set(
-            owned_states + public_states + writable_states + readable_states
-        )
-        all_modifiable_states = set(owned_states + writable_states)
+        # Update the State object and save, unless it changed since base_version when that is given
+        with transaction.atomic():
+            try:
+                result = State.objects.select_for_update().get(name=old_name)
+            except State.DoesNotExist:
+                return HttpResponseNotFound("State not found")
+            if not can_read(request.user, result):
+                return HttpResponseNotFound("State not found")
+            if not can_write(request.user, result):
+                return HttpResponseForbidden("Not authorized")
+            if base_version is not None and str(base_version) != str(result.version):
+                return version_conflict(result.version)
+            if new_name:
+                result.name = new_name
+            if new_public_request is not None:
+                result.public = parse_bool(new_public_request)
+            if new_definition is None:
+                # A rename or public toggle keeps the current definition and version
+                result.save(update_fields=["name", "public", "updated_at"])
+            else:
+                save_snapshot(result, new_definition, str(request.user))
 
-        if old_name not in all_accessible_states:
-            return HttpResponseNotFound("State not found")
-        if old_name not in all_modifiable_states:
-            return HttpResponseForbidden("Not authorized")
+        return HttpResponse("state object updated")
 
-        # Update the State object and save
-        result = State.objects.get(name=old_name)
-        result.name = new_name
-        result.definition = new_definition
-        if new_public_request is not None:
-            result.public = parse_bool(new_public_request)
-        result.save()
+    elif request.method == "PATCH":
+        # Apply a delta to the definition at base_version, storing only the delta
+        patch = parse_request_body(request)
+        name = patch.get("name")
+        try:
+            base_version = int(patch.get("base_version"))
+            edits = parse_delta(patch.get("delta"))
+        except (TypeError, ValueError) as e:
+            return HttpResponseBadRequest(f"base_version and delta are required: {e}")
 
-        return HttpResponse("state object updated")
+        with transaction.atomic():
+            try:
+                result = State.objects.select_for_update().select_related("blob").get(name=name)
+            except State.DoesNotExist:
+                return HttpResponseNotFound("State not found")
+            if not can_write(request.user, result):
+                return HttpResponseForbidden("Not authorized")
+
+            try:
+                save_delta(result, base_version, edits, str(request.user))
+            except VersionConflict as e:
+                return version_conflict(e.version)
+            except ValueError as e:
+                return HttpResponseBadRequest(str(e))
+
+        return JsonResponse({"version": result.version})
 
     elif request.method == "DELETE":
         # Get the required information from the request body
         delete = parse_request_body(request)
         name = delete.get("name")
 
-        # Delete the matching State object
-        try:
-            result = State.objects.get(name=name)  # username = uid
-        except State.DoesNotExist:
-            return HttpResponseNotFound("State not found")
+        # Delete the matching State object, its access rows and its blob references together
+        with transaction.atomic():
+            try:
+                result = State.objects.select_for_update().get(name=name)  # username = uid
+            except State.DoesNotExist:
+                return HttpResponseNotFound("State not found")
+
+            if str(result.owner) != str(request.user):
+                return HttpResponseForbidden("Requester is not owner")
 
-        if str(result.owner) != str(request.user):
-            return HttpResponseForbidden("Requester is not owner")
+            shared_with = list(StateAccess.objects.filter(state_id=result.id).values_list("user", flat=True))
+            StateAccess.objects.all().filter(state_id=result.id).delete()
 
-        StateAccess.objects.all().filter(state_id=result.id).delete()
+            delete_state(result)
 
-        result.delete()
+        invalidate_access(*shared_with)
 
         return HttpResponse("state object deleted")
 
@@ -194,6 +312,7 @@ def share_state(request):
             state_access_object = state_access_object.first()
             state_access_object.role = role
             state_access_object.save()
+            invalidate_access(user)
             return HttpResponse("Updated user role")
         else:
             return HttpResponse(
@@ -206,9 +325,119 @@ def share_state(request):
         user=user,
         role=role,
     )
+    invalidate_access(user)
     return HttpResponse("Added new user to role", status=201)
 
 
+def parse_share_request(body):
+    # {"states": [name, ...], "grants": [{"user", "role"}, ...], "revokes": [user, ...]}
+    names, grants, revokes = body["states"], body.get("grants", []), body.get("revokes", [])
+    if not (
+        isinstance(names, list) and all(isinstance(name, str) for name in names)
+        and isinstance(grants, list)
+        and all(isinstance(grant, dict) and isinstance(grant.get("user"), str) for grant in grants)
+        and isinstance(revokes, list) and all(isinstance(user, str) for user in revokes)
+    ):
+        raise ValueError("expected {states: [name], grants: [{user, role}], revokes: [user]}")
+    # Compared case-insensitively, as usernames are under MariaDB's default collation
+    if {grant["user"].casefold() for grant in grants} & {user.casefold() for user in revokes}:
+        raise ValueError("a user cannot be both granted and revoked")
+    return names, grants, revokes
+
+
+@require_http_methods(["POST"])
+@conditional_login_required
+def share_states(request):
+    """
+    Grant and revoke roles on several states of the requester at once. The changes are
+    applied in one transaction, revokes before grants, and the outcome of each (state, user)
+    entry is returned.
+    """
+    log_request(request)
+
+    try:
+        names, grants, revokes = parse_share_request(json.loads(request.body.decode()))
+    except (ValueError, KeyError, TypeError) as e:
+        return HttpResponseBadRequest(str(e))
+
+    requester = str(request.user)
+    allowed_roles = [a[1] for a in AccessLevel.choices()]
+    granted_users = {grant["user"] for grant in grants}
+    # Access rows are matched case-insensitively, as parse_share_request compares the users
+    named_users = {user.casefold() for user in granted_users | set(revokes)}
+
+    with transaction.atomic():
+        states = {state.name: state for state in State.objects.select_for_update().filter(name__in=names)}
+        existing_users = set(User.objects.filter(username__in=granted_users).values_list("username", flat=True))
+        current = {
+            (state_id, user.casefold()): (user, role)
+            for state_id, user, role in StateAccess.objects.filter(
+                state__in=states.values()
+            ).values_list("state_id", "user", "role")
+            if user.casefold() in named_users
+        }
+
+        results = []
+        upserts = {}
+        revoked_states = set()
+        revoked_users = set()
+        for name in names:
+            state = states.get(name)
+            if state is None:
+                state_error = "State not found"
+            elif state.owner != requester:
+                state_error = "Requesting user is not the owner"
+            else:
+                state_error = None
+
+            for grant in grants:
+                user, role = grant["user"], grant.get("role")
+                result = {"state": name, "user": user, "action": "grant"}
+                if state_error:
+                    result["error"] = state_error
+                elif role not in allowed_roles:
+                    result["error"] = f"role must be in: {allowed_roles}"
+                elif user not in existing_users:
+                    result["error"] = "User does not exist"
+                elif user == state.owner:
+                    result["error"] = "User is already the owner of the state"
+                else:
+                    stored, previous = current.get((state.pk, user.casefold()), (user, None))
+                    if previous == role:
+                        result["status"] = "unchanged"
+                    else:
+                        result["status"] = "created" if previous is None else "updated"
+                        upserts[(state.pk, stored)] = StateAccess(state=state, user=stored, role=role)
+                results.append(result)
+
+            for user in revokes:
+                result = {"state": name, "user": user, "action": "revoke"}
+                if state_error:
+                    result["error"] = state_error
+                elif (state.pk, user.casefold()) in current:
+                    result["status"] = "revoked"
+                    revoked_states.add(state.pk)
+                    revoked_users.add(current[(state.pk, user.casefold())][0])
+                else:
+                    result["status"] = "not_shared"
+                results.append(result)
+
+        # Revokes go first, so a grant is never undone by a revoke of the same row
+        if revoked_states:
+            StateAccess.objects.filter(state_id__in=revoked_states, user__in=revoked_users).delete()
+        # MySQL upserts on any unique key and can't be given the conflict target
+        conflict_target = {}
+        if connections["default"].features.supports_update_conflicts_with_target:
+            conflict_target["unique_fields"] = ["state", "user"]
+        if upserts:
+            StateAccess.objects.bulk_create(
+                list(upserts.values()), update_conflicts=True, update_fields=["role"], **conflict_target
+            )
+
+    invalidate_access(*{user for _, user in upserts}, *revoked_users)
+    return JsonResponse({"results": results})
+
+
 @require_http_methods(["GET"])
 @conditional_login_required
 def state_unids(request):
@@ -1,12 +1,31 @@
-from collections import Counter, defaultdict
-from django.http import HttpResponse, JsonResponse, HttpResponseBadRequest
+from django.http import HttpResponse, JsonResponse, HttpResponseBadRequest, StreamingHttpResponse
 from django.conf import settings
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_http_methods
 from django.views.decorators.csrf import ensure_csrf_cookie
 
 from .decorators.conditional_login_required import conditional_login_required
-from .sql_queries import procedure_count_query, patient_query, surgery_query, surgery_case_query
-from .utils.utils import cpt, get_all_cpt_code_filters, log_request, execute_sql, execute_sql_dict
+from .sql_queries import procedure_count_query, patient_query, surgery_query, case_list_query, case_aggregate_query
+from .utils.aggregation import GROUP_BY_COLUMNS, MEASURE_COLUMNS, group_aggregate, parse_measures
+from .utils.case_filters import (
+    after_cursor_clause,
+    case_filter_clauses,
+    encode_cursor,
+    parse_page_size,
+    where_sql,
+)
+from .utils.columnar import columnar_payload, stream_columnar_payload
+from .utils.cooccurrence import procedure_cooccurrence
+from .utils.cpt_catalog import get_cpt_catalog
+from .utils.data_version import data_version_etag, data_version_last_modified
+from .utils.query_cache import cache_key, cached_call, get_query_cache, mark_stale
+from .utils.utils import (
+    log_request,
+    execute_sql,
+    execute_sql_dict,
+    execute_sql_stream,
+    stream_json_result,
+)
 
 
 @require_http_methods(["GET"])
@@ -30,60 +49,26 @@ def get_csrf_token(request):
 
 @require_http_methods(["GET"])
 @conditional_login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=data_version_etag, last_modified_func=data_version_last_modified)
 def get_procedure_counts(request):
     log_request(request)
 
-    filters, bind_names, _ = get_all_cpt_code_filters()
-
     command = procedure_count_query
 
-    result = list(execute_sql(command, **dict(zip(bind_names, filters)))[0])
-
-    # Make co-occurrences list
-    cpt_codes_csv = cpt()
-    mapping = {x[0]: x[2] for x in cpt_codes_csv}
-    procedures_in_case = [
-        sorted(list(set([mapping[y] for y in x[0].split(",")]))) for x in result
-    ]
-
-    # Count the number of times each procedure co-occurred
-    co_occur_counts = defaultdict(Counter)
-    for case_procedures in procedures_in_case:
-        for procedure in case_procedures:
-            co_occur_counts[procedure].update(
-                el for el in case_procedures if el is not procedure
-            )
-
-    # Count the raw number of procedures done
-    total_counts = Counter(
-        [item for sublist in procedures_in_case for item in sublist]
-    )
+    def count_procedures():
+        result = execute_sql(command, template="procedure_counts")[0]
+
+        # Count procedures, already resolved to clean names by the query, and their co-occurrences
+        return procedure_cooccurrence((row[0] for row in result), get_cpt_catalog().name_to_codes)
 
-    # Get the CPTs that happened alone (didn't have any other co-occurrences)
-    all_single_cpt_cases = [
-        y for y in [set(x) for x in procedures_in_case] if len(y) == 1
-    ]
-    exclusive_counts = Counter(
-        [item for sublist in all_single_cpt_cases for item in sublist]
+    # Dashboard bootstrap data, an expired copy is served while it is recomputed
+    combined_counts, stale = cached_call(
+        "procedure_counts", cache_key(command, {}), count_procedures, serve_stale=True
     )
 
-    # Combine the raw count with co-occurrences
-    combined_counts = [
-        {
-            "procedureName": proc_name,
-            "procedureCodes": [
-                key for key, val in mapping.items() if val == proc_name
-            ],
-            "count": total_counts[proc_name],
-            "overlapList": {
-                **co_occur_counts[proc_name],
-                **{f"Only {proc_name}": exclusive_counts[proc_name]},
-            },
-        }
-        for proc_name in total_counts
-    ]
-
-    return JsonResponse({"result": combined_counts})
+    response = JsonResponse({"result": combined_counts})
+    return mark_stale(response, stale) if stale else response
 
 
 @require_http_methods(["GET"])
@@ -99,11 +84,10 @@ def fetch_surgery(request):
 
     command = surgery_query
 
-    cpts = cpt()
-    data = execute_sql_dict(command=command, id=case_id)
+    catalog = get_cpt_catalog()
+    data = execute_sql_dict(command=command, template="surgery", id=case_id)
     for row in data:
-        print(row)
-        row["cpt"] = list(set([cpt[2] for cpt in cpts if cpt[1] in row["CODES"]]))
+        row["cpt"] = list(catalog.procedures_in(row["CODES"]))
         del row["CODES"]
 
     return JsonResponse({"result": data})
@@ -122,21 +106,94 @@ def fetch_patient(request):
 
     command = patient_query
 
-    data = execute_sql_dict(command=command, id=patient_id)
+    data = execute_sql_dict(command=command, template="patient", id=patient_id)
 
     return JsonResponse({"result": data})
 
 
 @require_http_methods(["GET"])
 @conditional_login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=data_version_etag, last_modified_func=data_version_last_modified)
 def get_sanguine_surgery_cases(request):
     log_request(request)
 
-    filters, bind_names, _ = get_all_cpt_code_filters()
+    try:
+        clauses, binds = case_filter_clauses(request.GET)
+        limit = parse_page_size(request.GET.get("limit")) if request.GET.get("limit") else None
+        if request.GET.get("after"):
+            if limit is None:
+                raise ValueError("after requires limit")
+            clause, cursor_binds = after_cursor_clause(request.GET.get("after"))
+            clauses.append(clause)
+            binds.update(cursor_binds)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    columnar = request.GET.get("format") == "columnar"
+
+    # Read the materialized rows kept up to date by refresh_case_summary
+    if limit is not None:
+        command = case_list_query(where_sql(clauses), paginate=True)
+        rows = execute_sql_dict(command, template="case_page", cache="case_page", limit=limit + 1, **binds)
+        next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        rows = rows[:limit]
+
+        payload = columnar_payload([rows]) if columnar else {"result": rows}
+        payload["next_cursor"] = next_cursor
+        return JsonResponse(payload)
+
+    command = case_list_query(where_sql(clauses))
+
+    backend = get_query_cache()
+    if not clauses and backend is not None and (columnar or backend.shared):
+        # The unfiltered list bootstraps the dashboard, keep its rendered body and serve it stale while it refreshes.
+        # The compact columnar body is kept in every backend, but the rows body only in a shared one:
+        # a per-worker copy of it would hold the whole list in every worker, so it streams instead
+        def render():
+            if columnar:
+                return "".join(stream_columnar_payload(execute_sql_stream(command, template="case_list")))
+            return "".join(stream_json_result(execute_sql_stream(command, template="case_list")))
+
+        body, stale = cached_call(
+            "cases", cache_key(command, {"format": "columnar" if columnar else "rows"}), render, serve_stale=True
+        )
+        response = HttpResponse(body, content_type="application/json")
+        return mark_stale(response, stale) if stale else response
+
+    # Stream the rows out as they come off the server-side cursor, or the columns once they are read
+    stream = stream_columnar_payload if columnar else stream_json_result
+    return StreamingHttpResponse(
+        stream(execute_sql_stream(command, template="case_list", **binds)),
+        content_type="application/json",
+    )
+
+
+@require_http_methods(["GET"])
+@conditional_login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=data_version_etag, last_modified_func=data_version_last_modified)
+def aggregate(request):
+    log_request(request)
+
+    group_by = request.GET.get("group_by")
+    if group_by not in GROUP_BY_COLUMNS:
+        return HttpResponseBadRequest(f"group_by must be in: {GROUP_BY_COLUMNS}")
+
+    try:
+        measures = parse_measures(request.GET.getlist("measure"))
+        clauses, binds = case_filter_clauses(request.GET)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    if not measures:
+        return HttpResponseBadRequest("at least one measure must be supplied")
 
-    # Get the data from the database
-    command = surgery_case_query
+    # Pull only the grouping column and the measured columns for the filtered cases
+    measured = list(dict.fromkeys(column for _, _, column in measures))
+    filter_sql = where_sql(clauses)
+    command = case_aggregate_query(group_by, [f"{MEASURE_COLUMNS[column]} AS {column}" for column in measured], filter_sql)
+    rows, _ = execute_sql(command, template="case_aggregate", cache="aggregate", **binds)
 
-    result = execute_sql_dict(command, **dict(zip(bind_names, filters)))
+    values = list(zip(*rows)) if rows else [()] * (len(measured) + 1)
+    result = group_aggregate(values[0], dict(zip(measured, values[1:])), measures)
 
-    return JsonResponse({"result": result})
+    return JsonResponse({"result": result, "caseCount": len(rows)})
@@ -0,0 +1,83 @@
+import numpy as np
+
+
+GROUP_BY_COLUMNS = ["SURGEON_PROV_ID", "ANESTH_PROV_ID", "YEAR", "QUARTER", "MONTH", "SURGERY_TYPE_DESC"]
+
+# Measurable columns, normalized the same way App.tsx prepares the case list
+MEASURE_COLUMNS = {
+    "PRBC_UNITS": "COALESCE(PRBC_UNITS, 0)",
+    "FFP_UNITS": "COALESCE(FFP_UNITS, 0)",
+    "PLT_UNITS": "COALESCE(PLT_UNITS, 0)",
+    "CRYO_UNITS": "COALESCE(CRYO_UNITS, 0)",
+    "CELL_SAVER_ML": "COALESCE(CELL_SAVER_ML, 0)",
+    "PREOP_HEMO": "PREOP_HEMO",
+    "POSTOP_HEMO": "POSTOP_HEMO",
+    "DRG_WEIGHT": "COALESCE(DRG_WEIGHT, 0)",
+    "DEATH": "CASE WHEN DEATH = 'Y' THEN 1 ELSE 0 END",
+    "VENT": "COALESCE(VENT, 0)",
+    "STROKE": "COALESCE(STROKE, 0)",
+    "ECMO": "COALESCE(ECMO, 0)",
+    "TXA": "COALESCE(TXA, 0)",
+    "B12": "COALESCE(B12, 0)",
+    "AMICAR": "COALESCE(AMICAR, 0)",
+    "IRON": "COALESCE(IRON, 0)",
+}
+
+AGGREGATES = ["sum", "avg", "percent"]
+
+
+def parse_measures(specs):
+    # Each spec is "<aggregate>:<column>", e.g. "sum:PRBC_UNITS" or "percent:DEATH"
+    measures = []
+    for spec in specs:
+        aggregate, _, column = spec.partition(":")
+        if aggregate not in AGGREGATES or column not in MEASURE_COLUMNS:
+            raise ValueError(
+                f"measure {spec!r} must be <aggregate>:<column> with aggregate in {AGGREGATES} "
+                f"and column in {list(MEASURE_COLUMNS)}"
+            )
+        measures.append((spec, aggregate, column))
+    return measures
+
+
+def group_aggregate(keys, columns, measures):
+    """
+    Group cases by keys and compute the requested measures per group.
+
+    keys is one group value per case and columns maps each measured column to its per-case
+    values. sum ignores nulls, avg averages the non-null values, and percent is the share of
+    cases in the group with a value above zero, matching the chart generators.
+    """
+    group_ids = {}
+    inverse = np.fromiter((group_ids.setdefault(key, len(group_ids)) for key in keys), dtype=np.int64, count=len(keys))
+    n_groups = len(group_ids)
+    case_counts = np.bincount(inverse, minlength=n_groups)
+
+    results = {}
+    for spec, aggregate, column in measures:
+        values = np.asarray(columns[column], dtype=np.float64)
+        present = ~np.isnan(values)
+        if aggregate == "sum":
+            result = np.bincount(inverse[present], weights=values[present], minlength=n_groups)
+        elif aggregate == "avg":
+            totals = np.bincount(inverse[present], weights=values[present], minlength=n_groups)
+            counts = np.bincount(inverse[present], minlength=n_groups)
+            result = np.divide(totals, counts, out=np.full(n_groups, np.nan), where=counts > 0)
+        else:
+            positive = np.bincount(inverse, weights=present & (np.nan_to_num(values) > 0), minlength=n_groups)
+            result = positive / case_counts * 100
+        results[spec] = result
+
+    rows = [
+        {
+            "aggregateAttribute": key,
+            "caseCount": int(case_counts[group]),
+            "measures": {
+                spec: None if np.isnan(result[group]) else float(result[group])
+                for spec, result in results.items()
+            },
+        }
+        for key, group in group_ids.items()
+    ]
+    rows.sort(key=lambda row: (row["aggregateAttribute"] is None, row["aggregateAttribute"]))
+    return rows
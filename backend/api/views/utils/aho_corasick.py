@@ -0,0 +1,57 @@
+from collections import deque
+
+
+class AhoCorasick:
+    """
+    Multi-pattern substring matcher.
+
+    Builds a trie over the patterns with failure links once, then reports every pattern
+    that occurs in a text with a single left to right pass over it. Each pattern carries
+    a value, and matching returns the set of values whose patterns were found.
+    """
+
+    def __init__(self, patterns):
+        # Node 0 is the root; every node has its transitions, failure link and outputs
+        self._goto = [{}]
+        self._fail = [0]
+        outputs = [set()]
+        for pattern, value in patterns:
+            if not pattern:
+                continue
+            node = 0
+            for char in pattern:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][char] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    outputs.append(set())
+                node = next_node
+            outputs[node].add(value)
+
+        # Breadth first so each node's failure target is finished before the node itself
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                outputs[child] |= outputs[self._fail[child]]
+                queue.append(child)
+
+        self._out = [frozenset(out) for out in outputs]
+
+    def find(self, text):
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if out[node]:
+                found |= out[node]
+        return found
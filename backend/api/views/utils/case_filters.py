@@ -0,0 +1,123 @@
+from datetime import date
+
+from api.models import CPT_CODE, SURGERY_CASE_CODE
+
+from .cpt_catalog import get_cpt_catalog
+
+
+# Outcome flags a case can be filtered on, and the condition that marks the outcome
+OUTCOME_CONDITIONS = {
+    "DEATH": "DEATH = 'Y'",
+    "VENT": "VENT > 0",
+    "STROKE": "STROKE > 0",
+    "ECMO": "ECMO > 0",
+}
+
+MAX_PAGE_SIZE = 10000
+
+
+def in_clause(column, name, values):
+    bind_names = [f"{name}{i}" for i in range(len(values))]
+    return f"{column} IN (%({')s,%('.join(bind_names)})s)", dict(zip(bind_names, values))
+
+
+def parse_date(value, name):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a date formatted as YYYY-MM-DD")
+
+
+def procedure_clause(names):
+    catalog = get_cpt_catalog()
+    unknown = [name for name in names if name not in catalog.name_to_codes]
+    if unknown:
+        raise ValueError(f"unknown procedure groups: {unknown}")
+
+    # Resolve the groups' codes in the database and find their cases through CODE_CASE_IDX
+    names_sql, binds = in_clause("CPT.CLEAN_NAME", "procedure", names)
+    clause = f"""CASE_ID IN (
+        SELECT CASE_CODE.CASE_ID
+        FROM {SURGERY_CASE_CODE._meta.db_table} CASE_CODE
+        INNER JOIN {CPT_CODE._meta.db_table} CPT ON CPT.CODE = CASE_CODE.CODE
+        WHERE {names_sql}
+    )"""
+    return clause, binds
+
+
+def case_filter_clauses(params):
+    """
+    Turn request parameters into WHERE conditions and bind values over SURGERY_CASE_SUMMARY.
+
+    Supported parameters:
+        date_from, date_to: inclusive CASE_DATE bounds (YYYY-MM-DD)
+        surgery_type: SURGERY_TYPE_DESC values, repeatable
+        surgeon_id, anesth_id: SURGEON_PROV_ID / ANESTH_PROV_ID values, repeatable
+        procedure: procedure group names (CPT_CODE.CLEAN_NAME), repeatable; a case matches
+            when it was billed any code of any of the groups
+        outcome: DEATH, VENT, STROKE or ECMO, repeatable; a case must have every outcome
+
+    Raises ValueError for malformed values.
+    """
+    clauses = []
+    binds = {}
+
+    if params.get("date_from"):
+        clauses.append("CASE_DATE >= %(date_from)s")
+        binds["date_from"] = parse_date(params.get("date_from"), "date_from")
+    if params.get("date_to"):
+        clauses.append("CASE_DATE <= %(date_to)s")
+        binds["date_to"] = parse_date(params.get("date_to"), "date_to")
+
+    for param, column in [
+        ("surgery_type", "SURGERY_TYPE_DESC"),
+        ("surgeon_id", "SURGEON_PROV_ID"),
+        ("anesth_id", "ANESTH_PROV_ID"),
+    ]:
+        values = [value for value in params.getlist(param) if value]
+        if values:
+            clause, clause_binds = in_clause(column, param, values)
+            clauses.append(clause)
+            binds.update(clause_binds)
+
+    procedures = [value for value in params.getlist("procedure") if value]
+    if procedures:
+        clause, clause_binds = procedure_clause(procedures)
+        clauses.append(clause)
+        binds.update(clause_binds)
+
+    for outcome in params.getlist("outcome"):
+        if outcome not in OUTCOME_CONDITIONS:
+            raise ValueError(f"outcome must be in: {list(OUTCOME_CONDITIONS)}")
+        clauses.append(OUTCOME_CONDITIONS[outcome])
+
+    return clauses, binds
+
+
+def where_sql(clauses):
+    return f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+
+def encode_cursor(row):
+    return f"{row['CASE_DATE']}_{row['CASE_ID']}"
+
+
+def after_cursor_clause(cursor):
+    # Keyset condition for (CASE_DATE, CASE_ID) > cursor, spelled out so it can use CASE_DATE_IDX_SUMMARY
+    case_date, _, case_id = cursor.partition("_")
+    try:
+        binds = {"after_date": date.fromisoformat(case_date), "after_id": int(case_id)}
+    except ValueError:
+        raise ValueError("after must be a cursor returned as next_cursor")
+    clause = "(CASE_DATE > %(after_date)s OR (CASE_DATE = %(after_date)s AND CASE_ID > %(after_id)s))"
+    return clause, binds
+
+
+def parse_page_size(value):
+    try:
+        limit = int(value)
+    except ValueError:
+        limit = 0
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be an integer between 1 and {MAX_PAGE_SIZE}")
+    return limit
@@ -0,0 +1,129 @@
+import base64
+import json
+import math
+from array import array
+
+import numpy as np
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+INT_TYPES = [np.int8, np.int16, np.int32]
+INDEX_TYPES = [np.uint8, np.uint16, np.uint32]
+
+
+def typed_array(array):
+    # Little-endian buffers so the browser can wrap them in a TypedArray without copying
+    array = array.astype(array.dtype.newbyteorder("<"), copy=False)
+    return {
+        "type": array.dtype.name,
+        "data": base64.b64encode(array.tobytes()).decode("ascii"),
+    }
+
+
+def smallest_dtype(low, high, dtypes):
+    for dtype in dtypes:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return dtype
+    return None
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class Column:
+    """
+    One column filled in row by row without keeping the row objects.
+
+    Numbers go into a float64 buffer (NaN for nulls) until the first other value, from which
+    on the column is dictionary encoded: a table of distinct values plus one index per row.
+    """
+
+    def __init__(self, nulls=0):
+        self.numbers = array("d")
+        self.ints = True
+        self.distinct = None
+        self.indices = None
+        for _ in range(nulls):
+            self.append(None)
+
+    def append(self, value):
+        if self.distinct is None:
+            if value is None or is_number(value):
+                self.ints = self.ints and isinstance(value, int)
+                self.numbers.append(math.nan if value is None else float(value))
+                return
+            self.to_strings()
+        self.indices.append(self.distinct.setdefault(value, len(self.distinct)))
+
+    def to_strings(self):
+        integral = all(number.is_integer() for number in self.numbers if not math.isnan(number))
+        self.distinct, self.indices = {}, array("L")
+        for number in self.numbers:
+            value = None if math.isnan(number) else int(number) if integral else number
+            self.indices.append(self.distinct.setdefault(value, len(self.distinct)))
+        self.numbers = None
+
+    def encode(self):
+        if self.distinct is None:
+            numbers = np.frombuffer(self.numbers, dtype=np.float64)
+            if self.ints:
+                dtype = smallest_dtype(numbers.min(), numbers.max(), INT_TYPES) if len(numbers) else np.int8
+                if dtype is not None:
+                    return typed_array(numbers.astype(dtype))
+            return typed_array(numbers)
+
+        # Only worth a values table when the column repeats itself
+        values = list(self.distinct)
+        if len(values) * 2 > len(self.indices):
+            return {"type": "string", "data": [values[index] for index in self.indices]}
+
+        indices = np.frombuffer(self.indices, dtype=np.dtype(self.indices.typecode))
+        return {
+            "type": "dictionary",
+            "values": values,
+            "indices": typed_array(indices.astype(smallest_dtype(0, len(values), INDEX_TYPES))),
+        }
+
+
+def read_columns(batches):
+    # Values JSON can't hold are converted as DjangoJSONEncoder does for the rows format, e.g. Decimal to a string
+    encoder = DjangoJSONEncoder()
+    columns = {}
+    length = 0
+    for batch in batches:
+        for row in batch:
+            for name, value in row.items():
+                if not isinstance(value, (str, bool, int, float, type(None))):
+                    value = encoder.default(value)
+                column = columns.get(name)
+                if column is None:
+                    column = columns[name] = Column(length)
+                column.append(value)
+            length += 1
+    return length, columns
+
+
+def columnar_payload(batches):
+    """
+    Turn batches of dict rows into one array per column.
+
+    Numeric columns are sent as base64 typed arrays (float64 with NaN for nulls, or the
+    smallest signed int type that fits), and repetitive string columns are dictionary
+    encoded as a values table plus an index typed array.
+    """
+    length, columns = read_columns(batches)
+    encoded = {name: column.encode() for name, column in columns.items()}
+    return {"format": "columnar", "length": length, "columns": encoded}
+
+
+def stream_columnar_payload(batches):
+    # Emits the same document as columnar_payload, encoding one column at a time
+    length, columns = read_columns(batches)
+    yield f'{{"format": "columnar", "length": {length}, "columns": {{'
+    separator = ""
+    for name in list(columns):
+        yield f"{separator}{json.dumps(name)}: {json.dumps(columns.pop(name).encode())}"
+        separator = ", "
+    yield "}}"
@@ -0,0 +1,83 @@
+import numpy as np
+
+# Joins the clean names of a case in procedure_count_query, clean names never contain it
+PROCEDURE_SEPARATOR = "|"
+
+
+def procedure_cooccurrence(case_procedures, name_to_codes):
+    """
+    Count how often each procedure happens, alone and together with every other procedure.
+
+    case_procedures holds one PROCEDURE_SEPARATOR separated string of clean names per case
+    (the GROUP_CONCAT output of procedure_count_query, which resolves codes to names in the
+    database). Each case is packed into a bitmask over procedure ids, identical masks are
+    collapsed, and the procedure x procedure counts come from one X^T W X product.
+    The result matches the order and shape of the original Counter based implementation.
+    """
+    # Flatten every (case, procedure) pair into two parallel index arrays
+    case_procedures = list(case_procedures)
+    n_cases = len(case_procedures)
+    if n_cases == 0:
+        return []
+
+    procedures = PROCEDURE_SEPARATOR.join(case_procedures).split(PROCEDURE_SEPARATOR)
+    names, cols = np.unique(np.array(procedures, dtype=object), return_inverse=True)
+    names = names.tolist()
+    n_procs = len(names)
+    cols = cols.astype(np.int64)
+    rows = np.repeat(
+        np.arange(n_cases, dtype=np.int64),
+        np.fromiter((case.count(PROCEDURE_SEPARATOR) + 1 for case in case_procedures), dtype=np.int64, count=n_cases),
+    )
+
+    # One bitmask per case, using the same bit order as np.packbits
+    n_bytes = (n_procs + 7) // 8
+    packed = np.zeros((n_cases, n_bytes), dtype=np.uint8)
+    np.bitwise_or.at(packed, (rows, cols // 8), (0x80 >> (cols % 8)).astype(np.uint8))
+
+    # Collapse identical procedure combinations into weighted rows
+    masks = packed.view(np.dtype((np.void, n_bytes))).ravel()
+    _, first_case, case_counts = np.unique(masks, return_index=True, return_counts=True)
+    unique_x = np.unpackbits(packed[first_case], axis=1, count=n_procs).astype(np.float64)
+    weights = case_counts.astype(np.float64)
+
+    co_occur = (unique_x.T @ (unique_x * weights[:, None])).astype(np.int64)
+    total_counts = np.diag(co_occur)
+    singles = unique_x.sum(axis=1) == 1
+    exclusive_counts = (unique_x[singles] * weights[singles, None]).sum(axis=0).astype(np.int64)
+
+    # The Counter implementation emitted procedures, and the overlaps of each procedure,
+    # in the order they were first seen. Recover that from the first case of each combination.
+    mask_idx, proc_idx = np.nonzero(unique_x)
+    entry_case = first_case[mask_idx]
+    first_seen = np.full(n_procs, n_cases, dtype=np.int64)
+    np.minimum.at(first_seen, proc_idx, entry_case)
+
+    per_mask = np.bincount(mask_idx, minlength=len(first_case))
+    mask_start = np.cumsum(per_mask) - per_mask
+    pair_width = per_mask[mask_idx]
+    left = np.repeat(np.arange(len(mask_idx)), pair_width)
+    offset = np.arange(len(left)) - np.repeat(np.cumsum(pair_width) - pair_width, pair_width)
+    right = mask_start[mask_idx[left]] + offset
+    first_together = np.full((n_procs, n_procs), n_cases, dtype=np.int64)
+    np.minimum.at(first_together, (proc_idx[left], proc_idx[right]), entry_case[left])
+
+    proc_ids = np.flatnonzero(total_counts)
+    proc_order = proc_ids[np.lexsort((proc_ids, first_seen[proc_ids]))]
+
+    combined_counts = []
+    for proc in proc_order.tolist():
+        others = np.flatnonzero(co_occur[proc])
+        others = others[others != proc]
+        others = others[np.lexsort((others, first_together[proc, others]))]
+        combined_counts.append({
+            "procedureName": names[proc],
+            "procedureCodes": name_to_codes.get(names[proc], []),
+            "count": int(total_counts[proc]),
+            "overlapList": {
+                **{names[other]: int(co_occur[proc, other]) for other in others.tolist()},
+                **{f"Only {names[proc]}": int(exclusive_counts[proc])},
+            },
+        })
+
+    return combined_counts
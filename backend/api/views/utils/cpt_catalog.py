@@ -0,0 +1,87 @@
+import csv
+import os
+import threading
+
+from django.conf import settings
+
+from .aho_corasick import AhoCorasick
+
+
+CPT_CODES_PATH = os.path.join(settings.BASE_DIR, "cpt_codes_cleaned.csv")
+
+
+class _CptIndex:
+    def __init__(self, rows):
+        self.rows = rows
+        self.codes = [row[0] for row in rows]
+        self.code_to_name = {row[0]: row[2] for row in rows}
+        self.name_to_codes = {}
+        self.desc_to_codes = {}
+        for code, desc, name in rows:
+            self.name_to_codes.setdefault(name, []).append(code)
+            self.desc_to_codes.setdefault(desc, []).append(code)
+        self.desc_matcher = AhoCorasick((desc, name) for _, desc, name in rows)
+
+
+class CptCatalog:
+    """
+    Indexed, in-process view of the cleaned CPT code file.
+
+    The file is parsed once per worker and parsed again only when its mtime changes,
+    so lookups by code, clean name or billing description are dictionary hits.
+    """
+
+    def __init__(self, path=CPT_CODES_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._index = _CptIndex([])
+
+    def refresh(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    self._load()
+                    self._mtime = mtime
+        return self
+
+    def _load(self):
+        with open(self.path, "r") as file:
+            read_csv = csv.reader(file, delimiter=",")
+            next(read_csv, None)
+            rows = [tuple(row) for row in read_csv]
+
+        # Swap the whole index in at once so readers never see a half-built catalog
+        self._index = _CptIndex(rows)
+
+    @property
+    def rows(self):
+        return self._index.rows
+
+    @property
+    def codes(self):
+        return self._index.codes
+
+    @property
+    def code_to_name(self):
+        return self._index.code_to_name
+
+    @property
+    def name_to_codes(self):
+        return self._index.name_to_codes
+
+    @property
+    def desc_to_codes(self):
+        return self._index.desc_to_codes
+
+    def procedures_in(self, text):
+        # Clean names of every billing description found anywhere in text
+        return self._index.desc_matcher.find(text)
+
+
+_catalog = CptCatalog()
+
+
+def get_cpt_catalog():
+    return _catalog.refresh()
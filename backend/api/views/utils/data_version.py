@@ -0,0 +1,101 @@
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.utils.timezone import is_naive, make_aware
+
+from api.models import (
+    BILLING_CODES,
+    INTRAOP_TRANSFUSION,
+    RefreshWatermark,
+    SURGERY_CASE,
+    VISIT,
+    VISIT_LABS,
+)
+
+
+# Raw EHR tables the analytics endpoints read, besides the derived tables tracked by watermarks
+SOURCE_TABLES = [model._meta.db_table for model in [SURGERY_CASE, BILLING_CODES, VISIT, VISIT_LABS, INTRAOP_TRANSFUSION]]
+
+_lock = threading.Lock()
+_cached = {"expires": 0.0, "version": None}
+
+
+class DataVersion:
+    def __init__(self, token, last_modified):
+        self.token = token
+        self.last_modified = last_modified
+
+    @property
+    def etag(self):
+        return f'"{self.token}"'
+
+
+def compute_data_version():
+    """
+    Derive a version token for the EHR data from the refresh watermarks and, on MariaDB,
+    the table metadata that batch loads change (row estimates, create and update times).
+    Both are single cheap reads, so no table is scanned to answer a conditional GET.
+    Last-Modified is the latest of the same watermarks and table times, so it moves with the token.
+    """
+    parts = []
+    last_modified = None
+
+    for name, watermark, refreshed_at in RefreshWatermark.objects.order_by("name").values_list(
+        "name", "watermark", "refreshed_at"
+    ):
+        parts.append(f"{name}:{watermark}:{refreshed_at}")
+        if last_modified is None or refreshed_at > last_modified:
+            last_modified = refreshed_at
+
+    connection = connections["default"]
+    if connection.vendor == "mysql":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT TABLE_NAME, TABLE_ROWS, CREATE_TIME, UPDATE_TIME
+                FROM information_schema.TABLES
+                WHERE TABLE_SCHEMA = DATABASE()
+                    AND TABLE_NAME IN ({', '.join(['%s'] * len(SOURCE_TABLES))})
+                ORDER BY TABLE_NAME
+                """,
+                SOURCE_TABLES,
+            )
+            for table_name, table_rows, create_time, update_time in cursor.fetchall():
+                parts.append(f"{table_name}:{table_rows}:{create_time}:{update_time}")
+                for changed_at in (create_time, update_time):
+                    if changed_at is None:
+                        continue
+                    # information_schema times are naive, in the connection's time zone
+                    if is_naive(changed_at):
+                        changed_at = make_aware(changed_at, connection.timezone)
+                    if last_modified is None or changed_at > last_modified:
+                        last_modified = changed_at
+
+    token = hashlib.sha256("|".join(parts).encode()).hexdigest()[:32]
+    return DataVersion(token, last_modified)
+
+
+def get_data_version():
+    # Cached per worker and revalidated every DATA_VERSION_TTL seconds
+    now = time.monotonic()
+    if _cached["version"] is None or now >= _cached["expires"]:
+        with _lock:
+            if _cached["version"] is None or now >= _cached["expires"]:
+                _cached["version"] = compute_data_version()
+                _cached["expires"] = now + settings.DATA_VERSION_TTL
+    return _cached["version"]
+
+
+def clear_data_version():
+    _cached["version"] = None
+
+
+def data_version_etag(request, *args, **kwargs):
+    return get_data_version().etag
+
+
+def data_version_last_modified(request, *args, **kwargs):
+    return get_data_version().last_modified
@@ -0,0 +1,51 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponse
+
+_executor = {}
+_executor_lock = threading.Lock()
+
+
+def get_db_executor():
+    with _executor_lock:
+        if "executor" not in _executor:
+            _executor["executor"] = ThreadPoolExecutor(
+                max_workers=settings.ASYNC_DB_THREADS, thread_name_prefix="sanguine-db"
+            )
+        return _executor["executor"]
+
+
+def run_view(view, request, *args, **kwargs):
+    # Executor threads keep their DB connection between requests, as a sync worker does
+    close_old_connections()
+    try:
+        response = view(request, *args, **kwargs)
+        if response.streaming:
+            # The server-side cursor behind the stream belongs to this thread, so drain it here
+            streamed = response
+            response = HttpResponse(b"".join(streamed.streaming_content), status=streamed.status_code)
+            for header, value in streamed.items():
+                response[header] = value
+            response.cookies = streamed.cookies
+        return response
+    finally:
+        close_old_connections()
+
+
+def executor_view(view):
+    """
+    Async version of a sync view, running it on a bounded pool of ASYNC_DB_THREADS threads.
+
+    Under ASGI a slow query then holds one of those threads instead of a whole worker, and the
+    pool caps the database connections a worker opens however many requests are waiting.
+    """
+    @wraps(view)
+    async def async_view(request, *args, **kwargs):
+        run = sync_to_async(run_view, thread_sensitive=False, executor=get_db_executor())
+        return await run(view, request, *args, **kwargs)
+    return async_view
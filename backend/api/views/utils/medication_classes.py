@@ -0,0 +1,35 @@
+import csv
+import os
+import re
+
+from django.conf import settings
+
+
+MEDICATION_CLASSES_PATH = os.path.join(settings.BASE_DIR, "medication_classes.csv")
+
+# Flag columns of MEDICATION_CLASS and VISIT_MEDICATION
+MEDICATION_FLAGS = ["TXA", "AMICAR", "B12", "IRON"]
+
+
+def load_medication_rules(path=MEDICATION_CLASSES_PATH):
+    """
+    Read the class,pattern rules file into {class: compiled pattern}.
+
+    A medication belongs to a class when the pattern matches anywhere in its lowercased name.
+    """
+    rules = {}
+    with open(path, "r") as file:
+        for row in csv.DictReader(file):
+            if row["class"] not in MEDICATION_FLAGS:
+                raise ValueError(f"unknown medication class {row['class']!r}, expected one of {MEDICATION_FLAGS}")
+            rules[row["class"]] = re.compile(row["pattern"])
+    return rules
+
+
+def classify_medication(names, rules):
+    # In a class if any of the names match
+    lowered = [name.lower() for name in names if name]
+    return {
+        flag: flag in rules and any(rules[flag].search(name) for name in lowered)
+        for flag in MEDICATION_FLAGS
+    }
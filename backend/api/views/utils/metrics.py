@@ -0,0 +1,296 @@
+import contextvars
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from api.db.pool import pool_stats
+
+from .query_cache import private_directory, query_cache_stats
+from .slow_queries import is_slow, log_slow_query
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# The view handling the current request, set by MetricsMiddleware
+current_view = contextvars.ContextVar("current_view", default="background")
+
+# Seconds between a worker's writes of its metrics file
+FLUSH_INTERVAL = 1.0
+
+_lock = threading.Lock()
+_queries = {}
+_streams = {}
+_responses = {}
+_dirty = {"dirty": False}
+_pending = {"timer": None}
+
+
+def new_histogram():
+    return {"count": 0, "sum": 0.0, "buckets": [0] * len(BUCKETS)}
+
+
+def observe(histogram, seconds):
+    histogram["count"] += 1
+    histogram["sum"] += seconds
+    for i, bound in enumerate(BUCKETS):
+        if seconds <= bound:
+            histogram["buckets"][i] += 1
+            break
+
+
+def record_query(view, query, seconds, rows):
+    key = (view, query)
+    with _lock:
+        stats = _queries.get(key)
+        if stats is None:
+            stats = _queries[key] = dict(new_histogram(), rows=0)
+        observe(stats, seconds)
+        stats["rows"] += rows
+        _dirty["dirty"] = True
+
+
+def record_stream(view, query, seconds):
+    with _lock:
+        stats = _streams.get((view, query))
+        if stats is None:
+            stats = _streams[(view, query)] = new_histogram()
+        observe(stats, seconds)
+        _dirty["dirty"] = True
+
+
+def record_response(view, status, seconds, size):
+    key = (view, str(status))
+    with _lock:
+        stats = _responses.get(key)
+        if stats is None:
+            stats = _responses[key] = dict(new_histogram(), bytes=0)
+        observe(stats, seconds)
+        stats["bytes"] += size
+        _dirty["dirty"] = True
+
+
+@contextmanager
+def timed_query(template, command, binds, view=None):
+    """
+    Time the SQL run in the block, which sets rows["rows"] to the number of rows it returned.
+
+    template names the query in the metrics and the slow query log, ad hoc SQL without one is
+    reported as "sql". view defaults to the view of the current request. Queries that succeed
+    but take longer than SLOW_QUERY_SECONDS also go to the slow query log, with their EXPLAIN plan.
+
+    A streamed query sets rows["seconds"] once its first batch is fetched. That is its query
+    time, and the whole block, which waits on the client reading the stream, is recorded as
+    its stream time instead.
+    """
+    rows = {"rows": 0}
+    view = view or current_view.get()
+    name = template or "sql"
+    start = time.perf_counter()
+    try:
+        yield rows
+    finally:
+        elapsed = time.perf_counter() - start
+        seconds = rows.get("seconds", elapsed)
+        record_query(view, name, seconds, rows["rows"])
+        if "seconds" in rows:
+            record_stream(view, name, elapsed)
+    if is_slow(seconds):
+        log_slow_query(name, command, binds, view, seconds, rows["rows"])
+
+
+def snapshot():
+    with _lock:
+        queries = [
+            dict(stats, view=view, query=query, buckets=list(stats["buckets"]))
+            for (view, query), stats in _queries.items()
+        ]
+        streams = [
+            dict(stats, view=view, query=query, buckets=list(stats["buckets"]))
+            for (view, query), stats in _streams.items()
+        ]
+        responses = [
+            dict(stats, view=view, status=status, buckets=list(stats["buckets"]))
+            for (view, status), stats in _responses.items()
+        ]
+    return {
+        "pid": os.getpid(),
+        "queries": queries,
+        "streams": streams,
+        "responses": responses,
+        "query_cache": query_cache_stats(),
+        "db_pool": pool_stats(),
+    }
+
+
+def flush(force=False):
+    # Publish this worker's totals to METRICS_DIR, where /api/metrics merges every worker's file
+    with _lock:
+        if not (_dirty["dirty"] or force):
+            return
+        _dirty["dirty"] = False
+    private_directory(settings.METRICS_DIR)
+    fd, tmp_path = tempfile.mkstemp(dir=settings.METRICS_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as file:
+            json.dump(snapshot(), file)
+        os.replace(tmp_path, os.path.join(settings.METRICS_DIR, f"{os.getpid()}.json"))
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _scheduled_flush():
+    with _lock:
+        _pending["timer"] = None
+    flush()
+
+
+def schedule_flush():
+    """
+    Flush within FLUSH_INTERVAL seconds on a background thread, so responses never wait on the
+    file write and a busy worker writes its file at most once per interval.
+    """
+    with _lock:
+        if _pending["timer"] is not None:
+            return
+        timer = _pending["timer"] = threading.Timer(FLUSH_INTERVAL, _scheduled_flush)
+        timer.daemon = True
+    timer.start()
+
+
+def reset_metrics():
+    with _lock:
+        _queries.clear()
+        _streams.clear()
+        _responses.clear()
+        _dirty["dirty"] = False
+        timer, _pending["timer"] = _pending["timer"], None
+    if timer is not None:
+        timer.cancel()
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def load_snapshots():
+    # Files of workers that have exited are removed, their totals no longer count
+    snapshots = []
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, "*.json")):
+        pid = os.path.basename(path)[:-len(".json")]
+        if pid.isdigit() and not pid_alive(int(pid)):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            continue
+        try:
+            with open(path) as file:
+                snapshots.append(json.load(file))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def merge(snapshots):
+    """Sum the workers' counters and histograms; gauges only count workers still running."""
+    queries, streams, responses, cache, pool, gauges = {}, {}, {}, {}, {}, {}
+    for data in snapshots:
+        for series, labels, target in [
+            (data["queries"], ("view", "query"), queries),
+            (data.get("streams", []), ("view", "query"), streams),
+            (data["responses"], ("view", "status"), responses),
+        ]:
+            for stats in series:
+                key = tuple(stats[label] for label in labels)
+                merged = target.setdefault(key, {"count": 0, "sum": 0.0, "buckets": [0] * len(BUCKETS)})
+                merged["count"] += stats["count"]
+                merged["sum"] += stats["sum"]
+                merged["buckets"] = [a + b for a, b in zip(merged["buckets"], stats["buckets"])]
+                for extra in ("rows", "bytes"):
+                    if extra in stats:
+                        merged[extra] = merged.get(extra, 0) + stats[extra]
+
+        for name, counts in data["query_cache"].items():
+            for outcome, count in counts.items():
+                cache[(name, outcome)] = cache.get((name, outcome), 0) + count
+
+        alive = pid_alive(data["pid"])
+        for alias, stats in data["db_pool"].items():
+            for stat in ("connects", "connect_seconds", "checkouts", "reused", "wait_seconds", "timeouts"):
+                pool[(alias, stat)] = pool.get((alias, stat), 0) + stats[stat]
+            if alive:
+                for stat in ("open", "idle"):
+                    gauges[(alias, stat)] = gauges.get((alias, stat), 0) + stats[stat]
+    return queries, streams, responses, cache, pool, gauges
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def label_text(**labels):
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def histogram_lines(name, series, label_names):
+    lines = []
+    for key, stats in sorted(series.items()):
+        labels = dict(zip(label_names, key))
+        cumulative = 0
+        for bound, count in zip(BUCKETS, stats["buckets"]):
+            cumulative += count
+            lines.append(f"{name}_bucket{label_text(**labels, le=bound)} {cumulative}")
+        lines.append(f"{name}_bucket{label_text(**labels, le='+Inf')} {stats['count']}")
+        lines.append(f"{name}_sum{label_text(**labels)} {stats['sum']}")
+        lines.append(f"{name}_count{label_text(**labels)} {stats['count']}")
+    return lines
+
+
+def render_prometheus(snapshots):
+    """Merged worker snapshots in the Prometheus text exposition format."""
+    queries, streams, responses, cache, pool, gauges = merge(snapshots)
+    lines = [
+        "# HELP sanguine_query_duration_seconds Wall time of SQL queries run by the API, by view and query.",
+        "# TYPE sanguine_query_duration_seconds histogram",
+        *histogram_lines("sanguine_query_duration_seconds", queries, ("view", "query")),
+        "# HELP sanguine_query_rows_total Rows returned by SQL queries.",
+        "# TYPE sanguine_query_rows_total counter",
+        *(f"sanguine_query_rows_total{label_text(view=view, query=query)} {stats['rows']}"
+          for (view, query), stats in sorted(queries.items())),
+        "# HELP sanguine_query_stream_seconds Time from running a streamed query until its last row was sent.",
+        "# TYPE sanguine_query_stream_seconds histogram",
+        *histogram_lines("sanguine_query_stream_seconds", streams, ("view", "query")),
+        "# HELP sanguine_request_duration_seconds Time to produce API responses, by view and status.",
+        "# TYPE sanguine_request_duration_seconds histogram",
+        *histogram_lines("sanguine_request_duration_seconds", responses, ("view", "status")),
+        "# HELP sanguine_response_bytes_total Bytes of serialized API response bodies.",
+        "# TYPE sanguine_response_bytes_total counter",
+        *(f"sanguine_response_bytes_total{label_text(view=view, status=status)} {stats['bytes']}"
+          for (view, status), stats in sorted(responses.items())),
+        "# HELP sanguine_query_cache_total Query cache lookups by outcome.",
+        "# TYPE sanguine_query_cache_total counter",
+        *(f"sanguine_query_cache_total{label_text(query=name, outcome=outcome)} {count}"
+          for (name, outcome), count in sorted(cache.items())),
+        "# HELP sanguine_db_pool_total Database connection pool activity; *_seconds are totals in seconds.",
+        "# TYPE sanguine_db_pool_total counter",
+        *(f"sanguine_db_pool_total{label_text(alias=alias, stat=stat)} {value}"
+          for (alias, stat), value in sorted(pool.items())),
+        "# HELP sanguine_db_pool_connections Open and idle pooled connections of running workers.",
+        "# TYPE sanguine_db_pool_connections gauge",
+        *(f"sanguine_db_pool_connections{label_text(alias=alias, state=state)} {value}"
+          for (alias, state), value in sorted(gauges.items())),
+    ]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,420 @@
+import fcntl
+import glob
+import hashlib
+import json
+import logging
+import os
+import pickle
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.utils.http import http_date
+
+from .data_version import get_data_version
+
+logger = logging.getLogger("api.views")
+
+
+class CacheEntry:
+    # A pickled query result and the data version it was computed against
+    def __init__(self, version, created, payload):
+        self.version = version
+        self.created = created
+        self.payload = payload
+
+    def is_fresh(self, version, ttl):
+        return self.version == version and time.time() - self.created < ttl
+
+    def load(self):
+        return pickle.loads(self.payload)
+
+
+class MemoryBackend:
+    """Per-process LRU, evicting least recently used entries beyond max_bytes of payload."""
+
+    shared = False
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires, entry = item
+            if expires <= time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry, timeout):
+        size = len(entry.payload)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.time() + timeout, entry)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        item = self._entries.pop(key, None)
+        if item is not None:
+            self._bytes -= len(item[1].payload)
+
+
+def private_directory(path):
+    """
+    Create path readable only by this user, refusing one another user controls.
+    Cached entries are unpickled, so nobody else may be able to write them.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if os.stat(path).st_uid != os.geteuid():
+        raise PermissionError(f"{path} is not owned by the user running the API")
+    os.chmod(path, 0o700)
+    return path
+
+
+class FileBackend:
+    """Entries pickled into a private directory shared by every worker on the host."""
+
+    shared = True
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.cache")
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as file:
+                expires, entry = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if expires <= time.time():
+            return None
+        return entry
+
+    def set(self, key, entry, timeout):
+        private_directory(self.directory)
+        # Write then rename, so readers in other workers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                pickle.dump((time.time() + timeout, entry), file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def clear(self):
+        for path in glob.glob(os.path.join(self.directory, "*.cache")):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+
+class DjangoCacheBackend:
+    """
+    Entries kept in one of Django's configured caches (e.g. memcached or redis).
+
+    The alias may hold sessions and other state too, so entries are keyed under a generation
+    number and cleared by moving it on rather than by clearing the whole cache.
+    """
+
+    shared = True
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def generation(self):
+        return self.cache.get_or_set("query:generation", 1, None)
+
+    def get(self, key):
+        return self.cache.get(f"query:{key}", version=self.generation())
+
+    def set(self, key, entry, timeout):
+        self.cache.set(f"query:{key}", entry, timeout, version=self.generation())
+
+    def clear(self):
+        try:
+            self.cache.incr("query:generation")
+        except ValueError:
+            self.cache.set("query:generation", 2, None)
+
+
+_backend = {}
+_stats_lock = threading.Lock()
+_stats = {}
+_flights_lock = threading.Lock()
+_flights = {}
+_handoff_pruned = {"at": 0.0}
+
+
+def build_backend():
+    if settings.QUERY_CACHE == "memory":
+        return MemoryBackend(settings.QUERY_CACHE_BYTES)
+    if settings.QUERY_CACHE == "file":
+        return FileBackend(settings.QUERY_CACHE_DIR)
+    if settings.QUERY_CACHE == "django":
+        return DjangoCacheBackend(settings.QUERY_CACHE_ALIAS)
+    if settings.QUERY_CACHE == "none":
+        return None
+    raise ValueError(f"Unknown QUERY_CACHE backend {settings.QUERY_CACHE!r}")
+
+
+def get_query_cache():
+    if "backend" not in _backend:
+        _backend["backend"] = build_backend()
+    return _backend["backend"]
+
+
+def reset_query_cache():
+    _backend.clear()
+    with _stats_lock:
+        _stats.clear()
+
+
+def record(name, outcome):
+    with _stats_lock:
+        counts = _stats.setdefault(name, {"hits": 0, "misses": 0, "coalesced": 0, "stale": 0})
+        counts[outcome] += 1
+
+
+def query_cache_stats():
+    with _stats_lock:
+        return {name: dict(counts) for name, counts in _stats.items()}
+
+
+def cache_key(command, binds):
+    # Whitespace-insensitive SQL plus the bind values
+    normalized = re.sub(r"\s+", " ", command).strip()
+    params = json.dumps(sorted(binds.items()), cls=DjangoJSONEncoder)
+    return hashlib.sha256(f"{normalized}\0{params}".encode()).hexdigest()
+
+
+def query_ttl(name):
+    return settings.QUERY_CACHE_TTLS.get(name, settings.QUERY_CACHE_TTL)
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.payload = None
+        self.error = None
+
+
+def coalesce(key, compute):
+    """
+    Run compute() once for concurrent callers with the same key in this process.
+
+    Returns (payload, leader): followers wait for the leader's execution and get its payload.
+    """
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+
+    if not leader:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.payload, False
+
+    try:
+        flight.payload = compute()
+        return flight.payload, True
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
+
+
+def wait_for_lock(file, deadline):
+    while True:
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+
+
+@contextmanager
+def host_lock(key, timeout):
+    """
+    Exclusive lock on key shared by the processes on this host, yielding whether it was acquired.
+
+    Gives up after timeout seconds, so a stuck leader delays other workers instead of hanging them.
+    The holder removes the lock file before releasing it, so there is no file per key left behind;
+    a waiter that then gets the lock on the removed file opens the path again.
+    """
+    private_directory(settings.QUERY_CACHE_DIR)
+    path = os.path.join(private_directory(os.path.join(settings.QUERY_CACHE_DIR, "locks")), f"{key}.lock")
+    deadline = time.monotonic() + timeout
+    while True:
+        file = open(path, "a")
+        acquired = wait_for_lock(file, deadline)
+        try:
+            current = os.stat(path).st_ino == os.fstat(file.fileno()).st_ino
+        except FileNotFoundError:
+            current = False
+        if not acquired or current:
+            break
+        file.close()
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            os.unlink(path)
+            fcntl.flock(file, fcntl.LOCK_UN)
+        file.close()
+
+
+def fresh_entry(backend, key, version, ttl):
+    entry = backend.get(key) if backend is not None else None
+    if entry is not None and entry.is_fresh(version, ttl):
+        return entry
+    return None
+
+
+def execute_and_store(backend, key, version, ttl, execute):
+    payload = pickle.dumps(execute(), pickle.HIGHEST_PROTOCOL)
+    if backend is not None:
+        # Kept past its TTL so it can still be served stale while it is refreshed
+        backend.set(key, CacheEntry(version, time.time(), payload), ttl + settings.QUERY_CACHE_MAX_STALE)
+    return payload
+
+
+def handoff_backend():
+    # Where a worker publishes results for the other workers on the host when the cache itself is per worker
+    return FileBackend(os.path.join(settings.QUERY_CACHE_DIR, "handoff"))
+
+
+def prune_handoff(directory):
+    # Handoff entries are only useful for a TTL, drop older files about once a minute per worker
+    now = time.time()
+    if now - _handoff_pruned["at"] < 60:
+        return
+    _handoff_pruned["at"] = now
+    max_ttl = max([settings.QUERY_CACHE_TTL, *settings.QUERY_CACHE_TTLS.values()])
+    for path in glob.glob(os.path.join(directory, "*.cache")):
+        try:
+            if os.path.getmtime(path) < now - max_ttl:
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def compute(backend, key, version, ttl, execute):
+    if backend is None:
+        return execute_and_store(backend, key, version, ttl, execute)
+
+    # One worker per key runs the query and publishes it, the others find it once they get the lock
+    published = backend if backend.shared else handoff_backend()
+    with host_lock(key, settings.QUERY_CACHE_LOCK_TIMEOUT):
+        entry = fresh_entry(published, key, version, ttl)
+        if entry is not None:
+            if published is not backend:
+                backend.set(key, entry, ttl + settings.QUERY_CACHE_MAX_STALE)
+            return entry.payload
+        payload = execute_and_store(backend, key, version, ttl, execute)
+        if published is not backend:
+            published.set(key, CacheEntry(version, time.time(), payload), ttl)
+            prune_handoff(published.directory)
+        return payload
+
+
+def refresh_in_background(key, refresh):
+    # One refresh per key at a time, requests keep getting the stale entry meanwhile
+    with _flights_lock:
+        if key in _flights:
+            return
+
+    def run():
+        try:
+            coalesce(key, refresh)
+        except Exception:
+            logger.exception("Refreshing a stale query cache entry failed")
+        finally:
+            connections.close_all()
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def cached_call(name, key, execute, serve_stale=False):
+    """
+    Return execute()'s result for key from the query cache when possible.
+
+    An entry is fresh for the query's TTL and only while the EHR data version it was computed
+    against is current, so invalidate_query_cache (or any refresh command) retires it.
+    On a miss, identical concurrent calls share one execution: within a worker they wait on
+    the in-flight call, and one worker on the host runs it for all, publishing the result
+    through the shared backend or, with the per-worker memory backend, a handoff file.
+    With serve_stale, an entry past its TTL or data version but younger than TTL plus
+    QUERY_CACHE_MAX_STALE is returned at once and refreshed in a background thread.
+
+    Returns (result, stale_entry), stale_entry being the CacheEntry served stale or None.
+    Results are stored pickled, so callers are free to mutate what they get back.
+    """
+    backend = get_query_cache()
+    ttl = query_ttl(name)
+    version = get_data_version().token if backend is not None else None
+
+    entry = backend.get(key) if backend is not None else None
+    if entry is not None and entry.is_fresh(version, ttl):
+        record(name, "hits")
+        return entry.load(), None
+
+    def refresh():
+        return compute(backend, key, version, ttl, execute)
+
+    if entry is not None and serve_stale and time.time() - entry.created < ttl + settings.QUERY_CACHE_MAX_STALE:
+        record(name, "stale")
+        refresh_in_background(key, refresh)
+        return entry.load(), entry
+
+    payload, leader = coalesce(key, refresh)
+    record(name, "misses" if leader else "coalesced")
+    return pickle.loads(payload), None
+
+
+def cached_query(name, command, binds, execute):
+    # Cached execute() for this SQL and binds, see cached_call
+    if name is None:
+        return execute()
+    return cached_call(name, cache_key(command, binds), execute)[0]
+
+
+def mark_stale(response, entry):
+    # Describe the served data rather than the current version, so clients revalidate once it is refreshed
+    response["X-Data-Stale"] = "true"
+    response["ETag"] = f'"{entry.version}"'
+    response["Last-Modified"] = http_date(entry.created)
+    return response
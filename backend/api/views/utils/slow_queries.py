@@ -0,0 +1,106 @@
+import fcntl
+import json
+import logging
+import os
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, connections
+
+from .query_cache import private_directory
+
+logger = logging.getLogger("api.views")
+
+# Binds whose values describe the query rather than a patient, so they are logged as-is
+SAFE_BIND_PREFIXES = ("limit", "procedure", "surgery_type", "outcome")
+
+
+def redact_binds(binds):
+    # Patient and case ids, provider ids and dates are PHI, keep only their type
+    redacted = {}
+    for name, value in binds.items():
+        if name.startswith(SAFE_BIND_PREFIXES) or value is None:
+            redacted[name] = value
+        else:
+            redacted[name] = f"<{type(value).__name__}>"
+    return redacted
+
+
+def explain_plan(command, binds):
+    connection = connections["default"]
+    prefix = "EXPLAIN" if connection.vendor == "mysql" else "EXPLAIN QUERY PLAN"
+    with connection.cursor() as cursor:
+        cursor.execute(f"{prefix} {command}", binds)
+        columns = [col[0] for col in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def log_paths(path, backups):
+    return [path] + [f"{path}.{i}" for i in range(1, backups + 1)]
+
+
+def append_entry(entry):
+    """Append a JSON line to SLOW_QUERY_LOG, rotating it past SLOW_QUERY_LOG_BYTES under a lock shared by the workers."""
+    path = settings.SLOW_QUERY_LOG
+    line = json.dumps(entry, cls=DjangoJSONEncoder) + "\n"
+    # Binds are redacted, but plans and query shapes still stay readable only by this user
+    private_directory(os.path.dirname(os.path.abspath(path)))
+    with open(f"{path}.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if os.path.exists(path) and os.path.getsize(path) + len(line) > settings.SLOW_QUERY_LOG_BYTES:
+                paths = log_paths(path, settings.SLOW_QUERY_LOG_BACKUPS)
+                for older, newer in reversed(list(zip(paths[1:], paths))):
+                    if os.path.exists(newer):
+                        os.replace(newer, older)
+                if os.path.exists(path):
+                    os.unlink(path)
+            with open(path, "a") as file:
+                file.write(line)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def log_slow_query(name, command, binds, view, seconds, rows):
+    # Runs in the request after the query finished, the EXPLAIN does not execute the query again
+    entry = {
+        "time": datetime.now(timezone.utc).isoformat(),
+        "query": name,
+        "view": view,
+        "seconds": round(seconds, 6),
+        "rows": rows,
+        "binds": redact_binds(binds),
+    }
+    try:
+        entry["plan"] = explain_plan(command, binds)
+    except DatabaseError as e:
+        entry["plan"] = None
+        entry["explain_error"] = str(e)
+    try:
+        append_entry(entry)
+    except OSError:
+        logger.exception("Could not write the slow query log")
+
+
+def read_entries(path, backups, since=None):
+    # Oldest file first; since is a unix timestamp
+    entries = []
+    for log_path in reversed(log_paths(path, backups)):
+        try:
+            with open(log_path) as file:
+                lines = file.readlines()
+        except FileNotFoundError:
+            continue
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if since is None or datetime.fromisoformat(entry["time"]).timestamp() >= since:
+                entries.append(entry)
+    return entries
+
+
+def is_slow(seconds):
+    return bool(settings.SLOW_QUERY_SECONDS) and seconds >= settings.SLOW_QUERY_SECONDS
@@ -0,0 +1,96 @@
+"""
+Permission checks for saved states.
+
+Owner and public come from the State row the caller already loaded, so the only per-user
+data is the user's shared roles: an index of {state id: role} read with one query on the
+indexed StateAccess.user column. It is cached for STATE_ACCESS_TTL seconds in the worker,
+together with the user's AccessGeneration. A cached index is only used while that
+generation, a primary key lookup, is unchanged, so a role change made through any worker
+applies to all of them at once. With STATE_ACCESS_CACHE_ALIAS set the index is kept in
+that Django cache instead and invalidations delete it there. Only role changes and state
+deletions alter the index; renames and public toggles do not need to invalidate it.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+
+from api.models import AccessGeneration, AccessLevel, StateAccess
+
+_lock = threading.Lock()
+_indexes = {}
+
+
+def shared_cache():
+    return caches[settings.STATE_ACCESS_CACHE_ALIAS] if settings.STATE_ACCESS_CACHE_ALIAS else None
+
+
+def load_roles(username):
+    return dict(StateAccess.objects.filter(user=username).values_list("state_id", "role"))
+
+
+def load_generation(username):
+    return AccessGeneration.objects.filter(user=username).values_list("generation", flat=True).first() or 0
+
+
+def get_roles(username):
+    """The user's {state id: role} index, from the cache or one query."""
+    cache = shared_cache()
+    if cache is not None:
+        roles = cache.get(f"state_access:{username}")
+        if roles is None:
+            roles = load_roles(username)
+            cache.set(f"state_access:{username}", roles, settings.STATE_ACCESS_TTL)
+        return roles
+
+    # The generation is read before the roles, so roles cached with it are never older than it
+    now = time.monotonic()
+    generation = load_generation(username)
+    with _lock:
+        cached = _indexes.get(username)
+    if cached is not None and cached[0] > now and cached[1] == generation:
+        return cached[2]
+    roles = load_roles(username)
+    with _lock:
+        _indexes[username] = (now + settings.STATE_ACCESS_TTL, generation, roles)
+    return roles
+
+
+def invalidate_access(*usernames):
+    usernames = [str(username) for username in usernames]
+    AccessGeneration.objects.bulk_create(
+        [AccessGeneration(user=username) for username in usernames], ignore_conflicts=True
+    )
+    AccessGeneration.objects.filter(user__in=usernames).update(generation=F("generation") + 1)
+    with _lock:
+        for username in usernames:
+            _indexes.pop(username, None)
+    cache = shared_cache()
+    if cache is not None:
+        cache.delete_many([f"state_access:{username}" for username in usernames])
+
+
+def reset_state_access():
+    with _lock:
+        _indexes.clear()
+
+
+def state_role(user, state):
+    # "owner", a shared role (RE/WR), "public" or None
+    username = str(user)
+    if state.owner == username:
+        return "owner"
+    role = get_roles(username).get(state.pk)
+    if role is None and state.public:
+        return "public"
+    return role
+
+
+def can_read(user, state):
+    return state_role(user, state) is not None
+
+
+def can_write(user, state):
+    return state_role(user, state) in ("owner", AccessLevel.WRITER.value)
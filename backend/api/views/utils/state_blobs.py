@@ -0,0 +1,121 @@
+"""
+State definitions stored once per distinct content, compressed.
+
+A StateBlob holds the definition as a JSON string literal, deflated and sync-flushed without
+a final block. That lets a response splice it between stored deflate blocks carrying the rest
+of the JSON document, so a client accepting deflate gets the stored bytes as they are.
+"""
+import hashlib
+import json
+import struct
+import zlib
+
+from django.db import transaction
+from django.db.models import F
+
+from api.models import StateBlob, StateVersion
+
+ADLER_BASE = 65521
+MAX_STORED_BLOCK = 65535
+
+
+def encode_definition(definition):
+    # Raw deflate of the JSON literal, ending byte-aligned so more blocks can follow
+    literal = json.dumps(definition).encode()
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    data = compressor.compress(literal) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    return data, len(literal), zlib.adler32(literal)
+
+
+def decode_definition(blob):
+    return json.loads(zlib.decompressobj(-15).decompress(bytes(blob.data)))
+
+
+def store_definition(definition):
+    """Return the blob for definition, with one more reference. Call within the transaction saving the state."""
+    digest = hashlib.sha256(definition.encode()).hexdigest()
+    with transaction.atomic():
+        if not StateBlob.objects.filter(digest=digest).exists():
+            data, literal_size, checksum = encode_definition(definition)
+            StateBlob.objects.bulk_create(
+                [StateBlob(digest=digest, data=data, size=len(definition), literal_size=literal_size, checksum=checksum)],
+                ignore_conflicts=True,
+            )
+        blob = StateBlob.objects.select_for_update().get(digest=digest)
+        blob.refcount = F("refcount") + 1
+        blob.save(update_fields=["refcount"])
+    return blob
+
+
+def release_blob(blob_id):
+    # Drop a reference, deleting the blob once no state uses it
+    if blob_id is None:
+        return
+    with transaction.atomic():
+        StateBlob.objects.select_for_update().filter(digest=blob_id).update(refcount=F("refcount") - 1)
+        StateBlob.objects.filter(digest=blob_id, refcount__lte=0).delete()
+
+
+def retain_blob(blob_id):
+    # Another reference to a blob already held, e.g. by a version snapshot
+    StateBlob.objects.filter(digest=blob_id).update(refcount=F("refcount") + 1)
+
+
+def save_definition(state, definition):
+    """Save state with definition, releasing the blob it pointed to before."""
+    with transaction.atomic():
+        previous = state.blob_id
+        state.blob = store_definition(definition)
+        state.definition = ""
+        state.save()
+        # With unchanged content this nets out, one reference taken and one released
+        release_blob(previous)
+
+
+def delete_state(state):
+    with transaction.atomic():
+        version_blobs = list(
+            StateVersion.objects.filter(state=state, blob__isnull=False).values_list("blob_id", flat=True)
+        )
+        state.delete()
+        for blob_id in [state.blob_id, *version_blobs]:
+            release_blob(blob_id)
+
+
+def load_definition(state):
+    return decode_definition(state.blob) if state.blob_id else state.definition
+
+
+def adler32_combine(adler1, adler2, length2):
+    # zlib's adler32_combine: the checksum of A + B from those of A and B and the length of B
+    remainder = length2 % ADLER_BASE
+    sum1 = adler1 & 0xFFFF
+    sum2 = (remainder * sum1) % ADLER_BASE
+    sum1 += (adler2 & 0xFFFF) + ADLER_BASE - 1
+    sum2 += (adler1 >> 16) + (adler2 >> 16) + ADLER_BASE - remainder
+    sum1 %= ADLER_BASE
+    sum2 %= ADLER_BASE
+    return (sum2 << 16) | sum1
+
+
+def stored_blocks(data, final):
+    # Uncompressed deflate blocks, valid at a byte boundary
+    chunks = [data[i:i + MAX_STORED_BLOCK] for i in range(0, len(data), MAX_STORED_BLOCK)] or [b""]
+    blocks = []
+    for i, chunk in enumerate(chunks):
+        last = final and i == len(chunks) - 1
+        blocks.append(bytes([1 if last else 0]) + struct.pack("<HH", len(chunk), len(chunk) ^ 0xFFFF) + chunk)
+    return b"".join(blocks)
+
+
+def deflate_document(prefix, blob, suffix):
+    """prefix + the blob's JSON literal + suffix as a zlib stream (HTTP's deflate coding), without recompressing."""
+    checksum = adler32_combine(zlib.adler32(prefix), blob.checksum, blob.literal_size)
+    checksum = adler32_combine(checksum, zlib.adler32(suffix), len(suffix))
+    return b"".join([
+        b"\x78\x01",
+        stored_blocks(prefix, final=False),
+        bytes(blob.data),
+        stored_blocks(suffix, final=True),
+        struct.pack(">I", checksum),
+    ])
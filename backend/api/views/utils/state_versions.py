@@ -0,0 +1,130 @@
+"""
+Version history of saved states.
+
+Every save gives a state its next version. Full saves (POST, PUT) and every
+STATE_SNAPSHOT_INTERVAL-th PATCH store a snapshot: State.blob moves to the new definition and
+a StateVersion row references the same blob. Other PATCHes only store their delta against the
+previous version, so the current definition is State.blob with the deltas after
+State.snapshot_version applied in order.
+
+A delta is a list of [start, end, text] edits, each replacing definition[start:end] of the
+base version with text, ordered and not overlapping.
+"""
+import json
+
+from django.conf import settings
+from django.db import transaction
+
+from api.models import StateVersion
+
+from .state_blobs import decode_definition, load_definition, release_blob, retain_blob, save_definition
+
+
+class VersionConflict(Exception):
+    """The state moved past the version a delta was made against."""
+
+    def __init__(self, version):
+        super().__init__(f"the state is at version {version}")
+        self.version = version
+
+
+def parse_delta(delta):
+    if not isinstance(delta, list):
+        raise ValueError("delta must be a list of [start, end, text] edits")
+    edits = []
+    position = 0
+    for edit in delta:
+        if not (
+            isinstance(edit, list) and len(edit) == 3
+            and all(type(offset) is int for offset in edit[:2]) and isinstance(edit[2], str)
+        ):
+            raise ValueError("delta must be a list of [start, end, text] edits")
+        start, end, text = edit
+        if start < position or end < start:
+            raise ValueError("delta edits must be ordered and must not overlap")
+        position = end
+        edits.append([start, end, text])
+    return edits
+
+
+def apply_delta(base, edits):
+    if edits and edits[-1][1] > len(base):
+        raise ValueError("delta edit past the end of the base version")
+    pieces = []
+    position = 0
+    for start, end, text in edits:
+        pieces += [base[position:start], text]
+        position = end
+    pieces.append(base[position:])
+    return "".join(pieces)
+
+
+def apply_deltas(definition, state, after, upto):
+    deltas = StateVersion.objects.filter(
+        state=state, version__gt=after, version__lte=upto, delta__isnull=False
+    ).order_by("version").values_list("delta", flat=True)
+    for delta in deltas:
+        definition = apply_delta(definition, json.loads(delta))
+    return definition
+
+
+def load_current(state):
+    return apply_deltas(load_definition(state), state, state.snapshot_version, state.version)
+
+
+def load_version(state, version):
+    """The definition of an earlier version of state, or None if it does not exist or was pruned."""
+    if version == state.version:
+        return load_current(state)
+    if not 0 < version < state.version:
+        return None
+    snapshot = (
+        StateVersion.objects.filter(state=state, version__lte=version, blob__isnull=False)
+        .select_related("blob").order_by("-version").first()
+    )
+    if snapshot is None:
+        return None
+    return apply_deltas(decode_definition(snapshot.blob), state, snapshot.version, version)
+
+
+def prune_history(state):
+    # Keep the versions from the STATE_SNAPSHOTS_KEPT-th latest snapshot on
+    kept = list(
+        StateVersion.objects.filter(state=state, blob__isnull=False)
+        .order_by("-version").values_list("version", flat=True)[:settings.STATE_SNAPSHOTS_KEPT]
+    )
+    if len(kept) < settings.STATE_SNAPSHOTS_KEPT:
+        return
+    pruned = StateVersion.objects.filter(state=state, version__lt=kept[-1])
+    blob_ids = list(pruned.filter(blob__isnull=False).values_list("blob_id", flat=True))
+    pruned.delete()
+    for blob_id in blob_ids:
+        release_blob(blob_id)
+
+
+def save_snapshot(state, definition, author):
+    """Save state (new or changed) as its next version, with definition in full."""
+    with transaction.atomic():
+        state.version = state.version + 1 if state.pk else 1
+        state.snapshot_version = state.version
+        save_definition(state, definition)
+        retain_blob(state.blob_id)
+        StateVersion.objects.create(state=state, version=state.version, blob_id=state.blob_id, author=author)
+        prune_history(state)
+
+
+def save_delta(state, base_version, edits, author):
+    """
+    Apply edits to version base_version of state and save the result as its next version.
+    The caller holds the state's row lock; raises VersionConflict if base_version is not current.
+    """
+    if base_version != state.version:
+        raise VersionConflict(state.version)
+    definition = apply_delta(load_current(state), edits)
+    if state.version + 1 - state.snapshot_version >= settings.STATE_SNAPSHOT_INTERVAL:
+        save_snapshot(state, definition, author)
+        return
+    with transaction.atomic():
+        state.version += 1
+        StateVersion.objects.create(state=state, version=state.version, delta=json.dumps(edits), author=author)
+        state.save(update_fields=["version", "updated_at"])
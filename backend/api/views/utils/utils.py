@@ -1,24 +1,17 @@
 import ast
-import csv
 import json
 import logging
+import time
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import connections
 
-logger = logging.getLogger("api.views")
-
+from .cpt_catalog import get_cpt_catalog
+from .metrics import current_view, timed_query
+from .query_cache import cached_query
 
-def cpt():
-    # Instantiate mapping array
-    cpt = []
-
-    # Read in the cpt codes
-    with open("cpt_codes_cleaned.csv", "r") as file:
-        read_csv = csv.reader(file, delimiter=",")
-        next(read_csv, None)
-        for row in read_csv:
-            cpt.append(tuple(row))
+logger = logging.getLogger("api.views")
 
-    return cpt
+STREAM_BATCH_SIZE = 2000
 
 
 def get_bind_names(filters):
@@ -28,7 +21,7 @@ def get_bind_names(filters):
 
 
 def get_all_cpt_code_filters():
-    filters = [a[0] for a in cpt()]
+    filters = list(get_cpt_catalog().codes)
     bind_names = get_bind_names(filters)
     filters_safe_sql = f"WHERE CODE IN (%({')s,%('.join(bind_names)})s) "
 
@@ -57,18 +50,79 @@ def log_request(request, paramsToExclude=[]):
     )
 
 
-def execute_sql(command, *args, **kwargs):
-    with connections["default"].cursor() as cursor:
-        cursor.execute(command, kwargs)
-        return cursor.fetchall(), cursor.description
+def execute_sql(command, *args, template=None, cache=None, **kwargs):
+    # template names the query in metrics and the slow query log; cache names it for the
+    # result cache and its TTL, None always goes to the database
+    def execute():
+        with timed_query(template, command, kwargs) as timing, connections["default"].cursor() as cursor:
+            cursor.execute(command, kwargs)
+            rows = cursor.fetchall()
+            timing["rows"] = len(rows)
+            return rows, cursor.description
+
+    return cached_query(cache, command, kwargs, execute)
+
+
+def execute_sql_dict(command, *args, template=None, cache=None, **kwargs):
+    def execute():
+        with timed_query(template, command, kwargs) as timing, connections["default"].cursor() as cursor:
+            cursor.execute(command, kwargs)
 
+            rows = cursor.fetchall()
+            timing["rows"] = len(rows)
+            cols = [col[0] for col in cursor.description]
 
-def execute_sql_dict(command, *args, **kwargs):
-    with connections["default"].cursor() as cursor:
-        cursor.execute(command, kwargs)
+            dict_rows = [dict(zip(cols, row)) for row in rows]
+            return dict_rows
 
-        rows = cursor.fetchall()
-        cols = [col[0] for col in cursor.description]
+    return cached_query(cache, command, kwargs, execute)
 
-        dict_rows = [dict(zip(cols, row)) for row in rows]
-        return dict_rows
+
+def execute_sql_stream(command, batch_size=STREAM_BATCH_SIZE, template=None, **kwargs):
+    """
+    Yield the rows of a query as lists of dicts, batch_size rows at a time.
+
+    On MySQL/MariaDB this uses an unbuffered server-side cursor, so rows are pulled from
+    the server as they are consumed instead of being materialized in the worker first.
+    """
+    # The rows are pulled after the view has returned, so note the view asking for them now
+    return stream_rows(template, command, batch_size, current_view.get(), kwargs)
+
+
+def stream_rows(template, command, batch_size, view, binds):
+    connection = connections["default"]
+    connection.ensure_connection()
+
+    if connection.vendor == "mysql":
+        from MySQLdb.cursors import SSCursor
+        cursor = connection.connection.cursor(SSCursor)
+    else:
+        cursor = connection.cursor()
+
+    # The query time ends at the first batch, later batches wait on the client reading the stream
+    with timed_query(template, command, binds, view=view) as timing:
+        start = time.perf_counter()
+        try:
+            cursor.execute(command, binds)
+            cols = [col[0] for col in cursor.description]
+            rows = cursor.fetchmany(batch_size)
+            timing["seconds"] = time.perf_counter() - start
+            while rows:
+                timing["rows"] += len(rows)
+                yield [dict(zip(cols, row)) for row in rows]
+                rows = cursor.fetchmany(batch_size)
+        finally:
+            # An unbuffered cursor has to be drained before the connection can be reused
+            cursor.close()
+
+
+def stream_json_result(batches):
+    # Emits the same document as JsonResponse({"result": rows}), one batch at a time
+    encoder = DjangoJSONEncoder()
+    yield '{"result": ['
+    separator = ""
+    for batch in batches:
+        if batch:
+            yield separator + ", ".join(encoder.encode(row) for row in batch)
+            separator = ", "
+    yield "]}"
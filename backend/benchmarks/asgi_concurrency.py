@@ -0,0 +1,101 @@
+"""
+Compare sync gunicorn workers with ASGI (uvicorn) workers under concurrent slow requests.
+
+Each mode is started with the same worker count against the database configured in the
+environment (logins are disabled for the run), then hit with --concurrency parallel clients.
+
+Usage (from the backend directory, with the MARIADB_* and DJANGO_* variables set):
+    python benchmarks/asgi_concurrency.py [--workers 2] [--concurrency 32] [--requests 256]
+        [--path /api/get_sanguine_surgery_cases]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    "wsgi": ["api.wsgi:application"],
+    "asgi": ["api.asgi:application", "--worker-class", "uvicorn_worker.UvicornWorker"],
+}
+
+
+def start_server(mode, port, workers):
+    env = dict(os.environ, DJANGO_SERVER=mode, DJANGO_DISABLE_LOGINS="True")
+    command = [
+        sys.executable, "-m", "gunicorn", *SERVERS[mode],
+        "--bind", f"127.0.0.1:{port}", "--timeout", "300", "--workers", str(workers),
+    ]
+    return subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_until_up(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1).read()
+            return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    raise SystemExit(f"{url} did not come up within {timeout}s")
+
+
+def fetch(url):
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=300) as response:
+            response.read()
+            ok = response.status == 200
+    except (urllib.error.URLError, ConnectionError):
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+def run(url, concurrency, n_requests):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as clients:
+        results = list(clients.map(fetch, [url] * n_requests))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        "throughput": n_requests / elapsed,
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+        "errors": sum(not ok for _, ok in results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=256)
+    parser.add_argument("--path", default="/api/get_sanguine_surgery_cases")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    print(f"{'mode':>6} {'req/s':>9} {'p50 (s)':>9} {'p95 (s)':>9} {'errors':>7}")
+    for mode in SERVERS:
+        server = start_server(mode, args.port, args.workers)
+        try:
+            url = f"http://127.0.0.1:{args.port}{args.path}"
+            wait_until_up(f"http://127.0.0.1:{args.port}/api/")
+            fetch(url)  # Warm the workers' connections and caches
+            result = run(url, args.concurrency, args.requests)
+        finally:
+            server.terminate()
+            server.wait()
+        print(
+            f"{mode:>6} {result['throughput']:>9.1f} {result['p50']:>9.3f} "
+            f"{result['p95']:>9.3f} {result['errors']:>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Compare the NumPy co-occurrence engine against the original Counter loop.
+
+Usage (from the backend directory):
+    python benchmarks/cooccurrence.py [--cases 10000 100000 1000000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "api.test_settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from api.views.utils.cooccurrence import PROCEDURE_SEPARATOR, procedure_cooccurrence  # noqa: E402
+from api.views.utils.cpt_catalog import get_cpt_catalog  # noqa: E402
+
+
+def legacy_procedure_cooccurrence(case_codes, mapping):
+    procedures_in_case = [
+        sorted(list(set([mapping[y] for y in x.split(",")]))) for x in case_codes
+    ]
+
+    co_occur_counts = defaultdict(Counter)
+    for case_procedures in procedures_in_case:
+        for procedure in case_procedures:
+            co_occur_counts[procedure].update(
+                el for el in case_procedures if el is not procedure
+            )
+
+    total_counts = Counter(
+        [item for sublist in procedures_in_case for item in sublist]
+    )
+
+    all_single_cpt_cases = [
+        y for y in [set(x) for x in procedures_in_case] if len(y) == 1
+    ]
+    exclusive_counts = Counter(
+        [item for sublist in all_single_cpt_cases for item in sublist]
+    )
+
+    return [
+        {
+            "procedureName": proc_name,
+            "procedureCodes": [
+                key for key, val in mapping.items() if val == proc_name
+            ],
+            "count": total_counts[proc_name],
+            "overlapList": {
+                **co_occur_counts[proc_name],
+                **{f"Only {proc_name}": exclusive_counts[proc_name]},
+            },
+        }
+        for proc_name in total_counts
+    ]
+
+
+def synthetic_cases(n_cases, codes, seed=42):
+    rng = random.Random(seed)
+    return [
+        ",".join(rng.choices(codes, k=rng.randint(1, 5)))
+        for _ in range(n_cases)
+    ]
+
+
+def case_procedure_names(case_codes, mapping):
+    # What procedure_count_query returns for each case: its distinct clean names, joined
+    return [
+        PROCEDURE_SEPARATOR.join(sorted({mapping[code] for code in codes.split(",")}))
+        for codes in case_codes
+    ]
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args(argv)
+
+    catalog = get_cpt_catalog()
+    print(f"{'cases':>10} {'legacy (s)':>12} {'numpy (s)':>12} {'speedup':>9}")
+    for n_cases in args.cases:
+        cases = synthetic_cases(n_cases, catalog.codes)
+        legacy, legacy_time = timed(legacy_procedure_cooccurrence, cases, catalog.code_to_name)
+        engine, engine_time = timed(
+            procedure_cooccurrence, case_procedure_names(cases, catalog.code_to_name), catalog.name_to_codes
+        )
+        if json.dumps(legacy) != json.dumps(engine):
+            raise SystemExit(f"Results differ for {n_cases} cases")
+        print(f"{n_cases:>10} {legacy_time:>12.3f} {engine_time:>12.3f} {legacy_time / engine_time:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
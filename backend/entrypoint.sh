@@ -16,9 +16,21 @@ if [[ "$AUTH_PROVIDER" == "cas" ]]; then
 fi
 
 poetry run python manage.py migrate sessions
+poetry run python manage.py migrate api
+poetry run python manage.py sync_cpt_codes
 
-# Start the server with 
-poetry run gunicorn api.wsgi:application --bind 0.0.0.0:8000 --timeout 300 --workers 4 &
+# Bring the case summary up to date, rebuilding it whole when it is still empty
+poetry run python manage.py refresh_case_summary
+
+# Start the server with sync workers, or with uvicorn workers serving the async views
+SERVER="${DJANGO_SERVER:-wsgi}"
+SERVER="${SERVER,,}"
+
+if [[ "$SERVER" == "asgi" ]]; then
+  poetry run gunicorn api.asgi:application --worker-class uvicorn_worker.UvicornWorker --bind 0.0.0.0:8000 --timeout 300 --workers "${DJANGO_ASGI_WORKERS:-2}" &
+else
+  poetry run gunicorn api.wsgi:application --bind 0.0.0.0:8000 --timeout 300 --workers 4 &
+fi
 
 # Get the PID of the background process
 PID=$!
@@ -8,6 +8,7 @@ import { SurgeryUrgencyArray, SurgeryUrgencyType } from './Presets/DataDict';
 import BrowserWarning from './Components/Modals/BrowserWarning';
 import DataRetrieval from './Components/Modals/DataRetrieval';
 import { SingleCasePoint } from './Interfaces/Types/DataTypes';
+import { ColumnarPayload, decodeColumnarResult } from './HelperFunctions/ColumnarDecoder';
 
 function App() {
   const store = useContext(Store);
@@ -27,8 +28,8 @@ function App() {
     async function fetchAllCases() {
       await whoamiAPICall();
       try {
-        const surgeryCasesFetch = await fetch(`${import.meta.env.VITE_QUERY_URL}get_sanguine_surgery_cases`);
-        const surgeryCasesInput: { result: unknown[] } = await surgeryCasesFetch.json();
+        const surgeryCasesFetch = await fetch(`${import.meta.env.VITE_QUERY_URL}get_sanguine_surgery_cases?format=columnar`);
+        const surgeryCasesInput = { result: decodeColumnarResult(await surgeryCasesFetch.json() as ColumnarPayload) };
 
         // Fix data types for the surgery cases
         let minDate = +Infinity;
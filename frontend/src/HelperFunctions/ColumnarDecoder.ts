@@ -0,0 +1,49 @@
+type TypedArrayColumn = { type: 'int8' | 'int16' | 'int32' | 'uint8' | 'uint16' | 'uint32' | 'float64', data: string };
+type DictionaryColumn = { type: 'dictionary', values: unknown[], indices: TypedArrayColumn };
+type StringColumn = { type: 'string', data: unknown[] };
+type Column = TypedArrayColumn | DictionaryColumn | StringColumn;
+
+export type ColumnarPayload = { format: 'columnar', length: number, columns: { [name: string]: Column } };
+
+const typedArrayConstructors: { [type in TypedArrayColumn['type']]: new (buffer: ArrayBuffer) => ArrayLike<number> } = {
+  int8: Int8Array,
+  int16: Int16Array,
+  int32: Int32Array,
+  uint8: Uint8Array,
+  uint16: Uint16Array,
+  uint32: Uint32Array,
+  float64: Float64Array,
+};
+
+// Buffers are little-endian base64, as written by the backend
+const decodeTypedArray = (column: TypedArrayColumn) => {
+  const binary = atob(column.data);
+  const bytes = new Uint8Array(binary.length);
+  for (let i = 0; i < binary.length; i += 1) {
+    bytes[i] = binary.charCodeAt(i);
+  }
+  return new typedArrayConstructors[column.type](bytes.buffer);
+};
+
+// Expand the columnar case payload back into row objects, restoring NaN as null
+export const decodeColumnarResult = (payload: ColumnarPayload) => {
+  const rows: Record<string, unknown>[] = Array.from({ length: payload.length }, () => ({}));
+
+  Object.entries(payload.columns).forEach(([name, column]) => {
+    if (column.type === 'string') {
+      column.data.forEach((value, i) => { rows[i][name] = value; });
+    } else if (column.type === 'dictionary') {
+      const indices = decodeTypedArray(column.indices);
+      for (let i = 0; i < indices.length; i += 1) {
+        rows[i][name] = column.values[indices[i]];
+      }
+    } else {
+      const values = decodeTypedArray(column);
+      for (let i = 0; i < values.length; i += 1) {
+        rows[i][name] = Number.isNaN(values[i]) ? null : values[i];
+      }
+    }
+  });
+
+  return rows;
+};